@@ -1,5 +1,7 @@
 import time
 import sys
+import os
+import tempfile
 
 import matplotlib.pyplot as plt
 import ROOT
@@ -7,6 +9,9 @@ import ROOT
 from garfield_base import GarfieldSetup
 from func_lib import load_root_libraries, load_garfield
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from exyz import ExyzIndex
+
 # EXYZ_FILE = "../DataFiles/EXYZ_gpp.txt"
 EXYZ_FILE = "../DataFiles/EXYZ_He4-5.4MeV_2023-04-03_1113.txt"
 # EXYZ_FILE = "../DataFiles/EXYZ_Li6-10.0MeV_2023-04-04_1352.txt"
@@ -124,15 +129,28 @@ class Chamber(GarfieldSetup):
         self.t_step = (self.t_max - self.t_min) / self.num_time_bins
         self.sensor.SetTimeWindow(self.t_min, self.t_step, self.num_time_bins)
 
+    def skip_ions(self):
+        """TrackTrim.ReadFile scans past skipped ions line by line, so instead
+        write a file with only the requested ions using the ion index"""
+        index = ExyzIndex(self.file_name)
+        stop = len(index) if self.num_ions == 0 else self.num_skip_ions + self.num_ions
+        fd, file_name = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        index.write_ions(file_name, self.num_skip_ions, stop)
+        return file_name
+
     def read_data(self):
         """Read the data file from SRIM"""
+        file_name = self.skip_ions() if self.num_skip_ions else self.file_name
 
         # Import ions.
         file = self.track.ReadFile(
-            file=self.file_name,
+            file=file_name,
             nIons=self.num_ions,
-            nSkip=self.num_skip_ions,
+            nSkip=0,
         )
+        if file_name != self.file_name:
+            os.remove(file_name)
         if not file:
             raise Exception("Failed to read EXYZ file.")
 
@@ -0,0 +1,299 @@
+"""Compressed archives of EXYZ files, .exyza, that give back the text file byte for byte.
+
+Values are kept as the decimal significand and exponent SRIM wrote, delta encoded along each
+track, and whole ions are compressed together in chunks, so one ion is read by decompressing
+its chunk only. The header and whatever follows the last complete row go into the compressed
+footer. On the files in DataFiles this is about 7.4x smaller than the text with lzma and 6.8x
+with zlib, less for files of a few ions. The noise in the low digits keeps a lossless format
+from an order of magnitude.
+"""
+from argparse import ArgumentParser
+import json
+import lzma
+import os
+import struct
+import zlib
+import numpy as np
+from exyz import (
+    ExyzData, IonTrack, NUM_COLUMNS, _replace_atomically, complete_rows, ion_boundaries,
+    parse_exyz_block, parse_exyz_header, split_exyz_header, to_exyz_data,
+)
+
+MAGIC = b"EXYZA\x02"
+# Archives of version 1 hold one chunk per ion and a plain JSON footer, they can still be read
+MAGIC_V1 = b"EXYZA\x01"
+ARCHIVE_VERSION = 2
+ARCHIVE_EXTENSION = ".exyza"
+# Whole ions are compressed together up to this many rows, a single ion is read by
+# decompressing only its chunk. Per ion chunks compress much worse.
+CHUNK_ROWS = 4096
+# How SRIM writes a row, the values have five significant digits
+ROW_FORMAT = "%07d %10.4E %11.4E %11.4E %11.4E %11.4E %11.4E"
+NUM_DIGITS = 5
+
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1 << 20}]
+COMPRESSORS = {
+    "lzma": lambda data: lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS),
+    "zlib": lambda data: zlib.compress(data, 9),
+}
+DECOMPRESSORS = {
+    "lzma": lambda data: lzma.decompress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS),
+    "zlib": zlib.decompress,
+}
+# Written after MAGIC, the footer is compressed too
+COMPRESSION_CODES = {"lzma": 0, "zlib": 1}
+FOOTER_FORMAT = "<5Q"
+
+
+def to_decimal(values: np.ndarray):
+    """Split values with five significant digits into integer significand and exponent,
+    values = significand * 10**(exponent - 4). Float32 input is precise enough."""
+    magnitude = np.abs(values.astype(np.float64))
+    exponent = np.floor(np.log10(np.where(magnitude > 0, magnitude, 1))).astype(np.int64)
+    significand = np.rint(magnitude / 10.0 ** (exponent - NUM_DIGITS + 1)).astype(np.int64)
+    # log10 can land just below a power of ten
+    carry = significand >= 10 ** NUM_DIGITS
+    significand[carry] = np.rint(significand[carry] / 10)
+    exponent[carry] += 1
+    return np.where(values < 0, -significand, significand), exponent
+
+
+def from_decimal(significand: np.ndarray, exponent: np.ndarray):
+    """The float64 closest to significand * 10**(exponent - 4), i.e. exactly what parsing
+    the text gives. Both operands are exact so the single multiply/divide rounds correctly."""
+    shift = exponent - NUM_DIGITS + 1
+    scale = 10.0 ** np.abs(shift)
+    return np.where(shift >= 0, significand * scale, significand / scale)
+
+
+def _shuffle(array: np.ndarray):
+    """Group the bytes by significance, which compresses much better"""
+    return array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+
+def _unshuffle(data: bytes, dtype, count):
+    itemsize = np.dtype(dtype).itemsize
+    return np.frombuffer(data, np.uint8).reshape(itemsize, count).T.copy().view(dtype).ravel()
+
+
+def encode_ion(rows: np.ndarray):
+    """Delta encode the value columns of one ion (raw SRIM units) along the track"""
+    significand, exponent = to_decimal(rows[:, 1:].T.astype(np.float32))
+    significand = np.diff(significand, axis=1, prepend=0).astype(np.int32)
+    exponent = np.diff(exponent, axis=1, prepend=0).astype(np.int8)
+    return _shuffle(significand.ravel()) + exponent.tobytes()
+
+
+def encoded_size(num_rows):
+    return (NUM_COLUMNS - 1) * num_rows * 5
+
+
+def decode_ion(data: bytes, ion_number, num_rows):
+    count = (NUM_COLUMNS - 1) * num_rows
+    significand = _unshuffle(data[:4 * count], np.int32, count).reshape(-1, num_rows)
+    exponent = np.frombuffer(data[4 * count:], np.int8).reshape(-1, num_rows)
+    values = from_decimal(
+        np.cumsum(significand, axis=1, dtype=np.int64), np.cumsum(exponent, axis=1, dtype=np.int64)
+    )
+    rows = np.empty((num_rows, NUM_COLUMNS))
+    rows[:, 0] = ion_number
+    rows[:, 1:] = values.T
+    return rows
+
+
+def format_rows(rows: np.ndarray, decimal=".", newline="\n"):
+    text = "".join(ROW_FORMAT % (int(row[0]), *row[1:]) + newline for row in rows)
+    return text.replace(".", decimal).encode()
+
+
+def chunk_boundaries(boundaries, chunk_rows=CHUNK_ROWS):
+    """Positions of the ions that start a new chunk, a chunk holds whole ions up to chunk_rows rows"""
+    starts = [0]
+    for position in range(1, len(boundaries) - 1):
+        if boundaries[position + 1] - boundaries[starts[-1]] > chunk_rows:
+            starts.append(position)
+    return starts + [len(boundaries) - 1]
+
+
+def pack_footer(header_text, newline, trailer, ions, chunks):
+    """Header, the text after the last complete row, the ion table [ion number, rows, chunk]
+    and the chunk table [offset, length]"""
+    ions, chunks = np.asarray(ions, "<i8").reshape(-1, 3), np.asarray(chunks, "<i8").reshape(-1, 2)
+    return b"".join([
+        struct.pack(FOOTER_FORMAT, len(header_text), len(newline), len(trailer), len(ions), len(chunks)),
+        header_text, newline, trailer, ions.tobytes(), chunks.tobytes(),
+    ])
+
+
+def unpack_footer(footer):
+    lengths = struct.unpack_from(FOOTER_FORMAT, footer)
+    position = struct.calcsize(FOOTER_FORMAT)
+    fields = []
+    for length in lengths[:3]:
+        fields.append(footer[position:position + length])
+        position += length
+    num_ions, num_chunks = lengths[3:]
+    ions = np.frombuffer(footer, "<i8", 3 * num_ions, position).reshape(-1, 3)
+    chunks = np.frombuffer(footer, "<i8", 2 * num_chunks, position + 24 * num_ions).reshape(-1, 2)
+    return (*fields, ions, chunks)
+
+
+def write_archive(exyz_path, archive_path=None, compression="lzma", chunk_rows=CHUNK_ROWS):
+    """Archive an EXYZ file, whole ions compressed together in chunks of about chunk_rows rows.
+    Raises ValueError if the archive would not give back the exact same file."""
+    archive_path = archive_path or os.path.splitext(exyz_path)[0] + ARCHIVE_EXTENSION
+    with open(exyz_path, "rb") as file:
+        contents = file.read()
+    header_text, block = split_exyz_header(contents)
+    header = parse_exyz_header(header_text)
+    newline = "\r\n" if b"\r\n" in block else "\n"
+    rows = parse_exyz_block(complete_rows(block))
+
+    text = format_rows(rows, header.decimal, newline)
+    if not block.startswith(text):
+        raise ValueError(f"{exyz_path} is not in the SRIM row format, keep the text file")
+    compress = COMPRESSORS[compression]
+    boundaries = ion_boundaries(rows[:, 0])
+    chunk_starts = chunk_boundaries(boundaries, chunk_rows)
+    def write(file):
+        ions, chunks = [], []
+        file.write(MAGIC + bytes([COMPRESSION_CODES[compression]]))
+        offset = len(MAGIC) + 1
+        for first, last in zip(chunk_starts[:-1], chunk_starts[1:]):
+            data = []
+            for start, end in zip(boundaries[first:last], boundaries[first + 1:last + 1]):
+                ion_rows = rows[start:end]
+                data.append(encode_ion(ion_rows))
+                if not np.array_equal(decode_ion(data[-1], ion_rows[0, 0], len(ion_rows)), ion_rows):
+                    raise ValueError(f"{exyz_path} has values that are not bit-exact in the archive")
+                ions.append([int(ion_rows[0, 0]), int(end - start), len(chunks)])
+            chunk = compress(b"".join(data))
+            file.write(chunk)
+            chunks.append([offset, len(chunk)])
+            offset += len(chunk)
+        # Whatever follows the last complete row, e.g. blank lines or a cut off row
+        trailer = block[len(text):]
+        footer = compress(pack_footer(header_text, newline.encode(), trailer, ions, chunks))
+        file.write(footer)
+        file.write(struct.pack("<Q", len(footer)))
+
+    # Nothing is left at archive_path when a value turns out not to be bit-exact halfway through
+    _replace_atomically(write, archive_path)
+    return archive_path
+
+
+class ExyzArchive:
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        with open(archive_path, "rb") as file:
+            magic = file.read(len(MAGIC))
+            if magic not in (MAGIC, MAGIC_V1):
+                raise ValueError(f"{archive_path} is not an EXYZ archive")
+            if magic == MAGIC:
+                (code,) = file.read(1)
+                compression = {code: name for name, code in COMPRESSION_CODES.items()}[code]
+            file.seek(-8, os.SEEK_END)
+            (footer_length,) = struct.unpack("<Q", file.read(8))
+            file.seek(-8 - footer_length, os.SEEK_END)
+            footer = file.read(footer_length)
+        if magic == MAGIC:
+            self.decompress = DECOMPRESSORS[compression]
+            self.header_text, newline, self.trailer, ions, chunks = unpack_footer(self.decompress(footer))
+            self.newline = newline.decode()
+            self.ion_number, self.num_rows, self.chunk = ions.T
+            self.chunk_offset, self.chunk_length = chunks.T
+        else:
+            footer = json.loads(footer)
+            self.decompress = DECOMPRESSORS[footer["compression"]]
+            self.header_text = footer["header"].encode("latin-1")
+            self.newline = footer["newline"]
+            self.trailer = footer["trailer"].encode("latin-1")
+            ions = np.array(footer["ions"], dtype=np.int64).reshape(-1, 4)
+            self.ion_number, self.num_rows, self.chunk_offset, self.chunk_length = ions.T
+            self.chunk = np.arange(len(ions))
+        self.header = parse_exyz_header(self.header_text)
+        # Where each ion starts in its decompressed chunk
+        sizes = encoded_size(self.num_rows)
+        chunk_start = np.searchsorted(self.chunk, self.chunk)
+        ends = np.cumsum(sizes)
+        self.start = ends - sizes - (ends - sizes)[chunk_start]
+        self._cached_chunk = (None, None)
+
+    def __len__(self):
+        return len(self.ion_number)
+
+    def _read_chunk(self, file, chunk):
+        """Decompressed chunk, the last one is kept for the following ions"""
+        if self._cached_chunk[0] != chunk:
+            file.seek(self.chunk_offset[chunk])
+            self._cached_chunk = (chunk, self.decompress(file.read(self.chunk_length[chunk])))
+        return self._cached_chunk[1]
+
+    def _read_rows(self, file, position):
+        data = self._read_chunk(file, self.chunk[position])
+        start = self.start[position]
+        return decode_ion(
+            data[start:start + encoded_size(self.num_rows[position])],
+            self.ion_number[position], self.num_rows[position],
+        )
+
+    def read_rows(self, positions=None):
+        """Raw rows of the ions at `positions`, default all ions"""
+        positions = range(len(self)) if positions is None else positions
+        with open(self.archive_path, "rb") as file:
+            rows = [self._read_rows(file, position) for position in positions]
+        return np.concatenate(rows) if rows else np.empty((0, NUM_COLUMNS))
+
+    def read_ion(self, ion_number):
+        """Decompress a single ion"""
+        position = int(np.searchsorted(self.ion_number, ion_number))
+        if position == len(self) or self.ion_number[position] != ion_number:
+            raise KeyError(f"Ion {ion_number} not in {self.archive_path}")
+        return IonTrack.from_rows(self.read_rows([position]))
+
+    def read(self) -> ExyzData:
+        return to_exyz_data(self.header, self.read_rows())
+
+    def write_text(self, exyz_path):
+        """Write back the original EXYZ file, byte for byte"""
+        with open(exyz_path, "wb") as file:
+            file.write(self.header_text)
+            with open(self.archive_path, "rb") as archive:
+                for position in range(len(self)):
+                    rows = self._read_rows(archive, position)
+                    file.write(format_rows(rows, self.header.decimal, self.newline))
+            file.write(self.trailer)
+
+
+def main():
+    parser = ArgumentParser(description="Convert EXYZ files to and from compressed archives")
+    parser.add_argument("files", type=str, nargs="+", help="EXYZ files, or archives with --extract")
+    parser.add_argument("-c", "--compression", type=str, choices=COMPRESSORS, default="lzma")
+    parser.add_argument("-x", "--extract", action="store_true", help="write the text files back")
+    parser.add_argument("--remove", action="store_true", help="remove each source once converted")
+    args = parser.parse_args()
+
+    total_text, total_archive = 0, 0
+    for file_path in args.files:
+        if args.extract:
+            exyz_path = os.path.splitext(file_path)[0] + ".txt"
+            ExyzArchive(file_path).write_text(exyz_path)
+            print(f"{file_path} -> {exyz_path}")
+        else:
+            try:
+                archive_path = write_archive(file_path, compression=args.compression)
+            except Exception as e:
+                print(f"Skipping {file_path}: {e}")
+                continue
+            text_size, archive_size = os.path.getsize(file_path), os.path.getsize(archive_path)
+            total_text += text_size
+            total_archive += archive_size
+            print(f"{file_path} -> {archive_path} ({text_size / archive_size:.1f}x)")
+        if args.remove:
+            os.remove(file_path)
+    if total_archive:
+        print(f"{total_text / 1e6:.2f} MB -> {total_archive / 1e6:.2f} MB ({total_text / total_archive:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
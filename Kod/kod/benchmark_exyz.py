@@ -0,0 +1,87 @@
+from argparse import ArgumentParser
+from timeit import default_timer as timer
+import glob
+import os
+import numpy as np
+import pandas as pd
+from config import DATA_DIR
+from exyz import read_exyz, EXYZ_COLUMNS
+
+
+def read_exyz_legacy(exyz_file_path):
+    """The pd.read_csv path SimulationResult.read_exyz_file used before exyz.read_exyz"""
+    angstrom_to_cm_factor = 1e-8
+    keV_to_MeV_factor = 1e-3
+    return pd.read_csv(
+        exyz_file_path,
+        sep="\s+",
+        header=None,
+        names=EXYZ_COLUMNS,
+        engine="python",
+        skiprows=15,
+        converters={
+            "Ion Number": lambda x: int(x.replace(",", ".")),
+            "Energy": lambda x: float(x.replace(",", "."))*keV_to_MeV_factor,
+            "Depth": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
+            "Y": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
+            "Z": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
+            "Electronic Stop.": lambda x: float(x.replace(",", "."))/angstrom_to_cm_factor,
+            "Recoil Energy": lambda x: float(x.replace(",", ".")),
+        },
+    )
+
+
+def best_time(func, *args, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = timer()
+        func(*args)
+        times.append(timer() - start)
+    return min(times)
+
+
+def check_same(df: pd.DataFrame, exyz_data):
+    return (
+        np.array_equal(df["Ion Number"].values, exyz_data.ion_number)
+        and np.allclose(df["Energy"].values, exyz_data.energy)
+        and np.allclose(df["Depth"].values, exyz_data.depth)
+    )
+
+
+def benchmark(file_paths, repeats=3):
+    total_legacy, total_new = 0, 0
+    print(f"{'file':<45} {'kB':>6} {'legacy [ms]':>12} {'numpy [ms]':>11} {'speedup':>8}")
+    for file_path in file_paths:
+        try:
+            same = check_same(read_exyz_legacy(file_path), read_exyz(file_path))
+        except Exception as e:
+            print(f"{os.path.basename(file_path):<45} skipped: {e}")
+            continue
+        if not same:
+            print(f"{os.path.basename(file_path):<45} skipped: parsers disagree")
+            continue
+        t_legacy = best_time(read_exyz_legacy, file_path, repeats=repeats)
+        t_new = best_time(read_exyz, file_path, repeats=repeats)
+        total_legacy += t_legacy
+        total_new += t_new
+        size = os.path.getsize(file_path) / 1e3
+        print(
+            f"{os.path.basename(file_path):<45} {size:>6.0f} {t_legacy * 1e3:>12.2f} "
+            f"{t_new * 1e3:>11.2f} {t_legacy / t_new:>7.1f}x"
+        )
+    if total_new:
+        print(f"{'total':<45} {'':>6} {total_legacy * 1e3:>12.2f} {total_new * 1e3:>11.2f} "
+              f"{total_legacy / total_new:>7.1f}x")
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark EXYZ parsing against the pd.read_csv path")
+    parser.add_argument("files", type=str, nargs="*", help="EXYZ files, default all in DataFiles")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="repeats per file")
+    args = parser.parse_args()
+    file_paths = args.files or sorted(glob.glob(os.path.join(DATA_DIR, "EXYZ*.txt")))
+    benchmark(file_paths, repeats=args.repeats)
+
+
+if __name__ == "__main__":
+    main()
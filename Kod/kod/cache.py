@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+CACHE_DIR_NAME = "CacheFiles"
+
+# (absolute path, size, mtime) -> content hash, so unchanged files are only hashed once per process
+_file_hashes = {}
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        sha1 = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                sha1.update(chunk)
+        _file_hashes[key] = sha1.hexdigest()
+    return _file_hashes[key]
+
+
+def sidecar_directory(file_path, kind, version):
+    """Sidecars live in CacheFiles next to the source and are keyed by content hash
+    and parser version, so a changed source or parser never hits a stale entry."""
+    cache_dir = os.path.join(os.path.dirname(file_path), CACHE_DIR_NAME)
+    return os.path.join(cache_dir, f"{kind}-v{version}-{file_hash(file_path)}")
+
+
+def load_sidecar(directory):
+    """Return (meta, arrays) with the arrays memory-mapped read-only, or None on a miss"""
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path) as file:
+        meta = json.load(file)
+    arrays = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in meta["arrays"]
+    }
+    return meta, arrays
+
+
+class SidecarWriter:
+    """Collects arrays chunk by chunk and publishes them as .npy files in one atomic rename"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        self.tmp_directory = tempfile.mkdtemp(dir=os.path.dirname(directory), prefix=".tmp-")
+        self.files = {}
+        self.dtypes = {}
+        self.shapes = {}
+
+    def append(self, **arrays):
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            if name not in self.files:
+                self.files[name] = open(os.path.join(self.tmp_directory, f"{name}.raw"), "wb")
+                self.dtypes[name] = array.dtype
+                self.shapes[name] = [0, *array.shape[1:]]
+            self.files[name].write(array.astype(self.dtypes[name], copy=False).tobytes())
+            self.shapes[name][0] += len(array)
+
+    def _write_npy(self, name):
+        raw_path = os.path.join(self.tmp_directory, f"{name}.raw")
+        header = {
+            "descr": np.lib.format.dtype_to_descr(self.dtypes[name]),
+            "fortran_order": False,
+            "shape": tuple(self.shapes[name]),
+        }
+        with open(os.path.join(self.tmp_directory, f"{name}.npy"), "wb") as npy_file:
+            np.lib.format.write_array_header_1_0(npy_file, header)
+            with open(raw_path, "rb") as raw_file:
+                shutil.copyfileobj(raw_file, npy_file)
+        os.remove(raw_path)
+
+    def commit(self, meta=None, replace=False):
+        """Publish the directory. With `replace` an existing directory is swapped out,
+        otherwise the first writer wins."""
+        for name, file in self.files.items():
+            file.close()
+            self._write_npy(name)
+        meta = dict(meta or {}, arrays=list(self.files))
+        with open(os.path.join(self.tmp_directory, "meta.json"), "w") as file:
+            json.dump(meta, file)
+        old_directory = None
+        if replace and os.path.isdir(self.directory):
+            old_directory = f"{self.tmp_directory}-old"
+            os.replace(self.directory, old_directory)
+        try:
+            os.replace(self.tmp_directory, self.directory)
+        except OSError:
+            # Another process published the same sidecar first
+            self.abort()
+        if old_directory:
+            shutil.rmtree(old_directory, ignore_errors=True)
+
+    def abort(self):
+        for file in self.files.values():
+            file.close()
+        shutil.rmtree(self.tmp_directory, ignore_errors=True)
+
+
+def save_sidecar(directory, arrays, meta=None, replace=False):
+    writer = SidecarWriter(directory)
+    try:
+        writer.append(**arrays)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit(meta, replace)
+
+
+class LazyArrays:
+    """Arrays of a sidecar directory as attributes, each memory-mapped on first access"""
+
+    def __init__(self, directory, names, prefix=""):
+        self._directory = directory
+        self._names = set(names)
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name not in self._names:
+            raise AttributeError(name)
+        array = np.load(os.path.join(self._directory, f"{self._prefix}{name}.npy"), mmap_mode="r")
+        setattr(self, name, array)
+        return array
+
+    def __dir__(self):
+        return sorted(self._names)
+
+
+def clear_cache(data_dir):
+    """Remove all sidecars of the files in `data_dir`"""
+    shutil.rmtree(os.path.join(data_dir, CACHE_DIR_NAME), ignore_errors=True)
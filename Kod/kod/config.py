@@ -3,4 +3,9 @@ import os
 
 SRIM_EXECUTABLE_DIRECTORY = "../../SRIM-2013"
 DATA_DIR = "DataFiles"
-PICKLE_DIR = os.path.join(DATA_DIR, "PickleFiles")
\ No newline at end of file
+PICKLE_DIR = os.path.join(DATA_DIR, "PickleFiles")
+RESULTS_DIR = os.path.join(DATA_DIR, "Results")
+STORE_DIR = os.path.join(DATA_DIR, "Store")
+TABLES_DIR = os.path.join(DATA_DIR, "Tables")
+RUNTIMES_PATH = os.path.join(DATA_DIR, "runtimes.jsonl")
+TUNINGS_PATH = os.path.join(DATA_DIR, "tunings.jsonl")
@@ -0,0 +1,133 @@
+"""Running statistics of the mean Bragg curve, to stop a run once it has converged.
+
+Every ion contributes the energy it lost in each depth bin divided by the bin width, its dE/dx
+averaged over the bin and 0 past its range. The mean and variance per bin are merged batch by
+batch (Chan et al.), so no ion has to be kept once its batch has been added.
+"""
+from argparse import ArgumentParser
+import numpy as np
+from exyz import ExyzData, read_exyz
+
+# Largest standard error of the mean dE/dx, relative to the peak of the mean curve
+DEFAULT_PRECISION = 0.02
+DEFAULT_BATCH_SIZE = 10
+# Batches in a row that have to meet the precision before the run stops
+CONSECUTIVE_BATCHES = 2
+# Fewer ions give too poor an estimate of the standard error itself
+MIN_EVENTS = 10
+NUM_BINS = 100
+# Bins reach this much further than the deepest ion of the first batch
+DEPTH_MARGIN = 1.25
+
+
+def ion_curves(exyz_data: ExyzData, bins):
+    """dE/dx [MeV/cm] of every ion averaged over each depth bin [cm], shape (ions, bins).
+    The energy lost in a step is put at the depth it ends at, energy past the last bin is dropped."""
+    num_bins = len(bins) - 1
+    energy_loss = -np.diff(exyz_data.energy, prepend=np.nan)
+    energy_loss[exyz_data.ion_offsets[:-1]] = 0
+    ion_index = np.repeat(np.arange(exyz_data.num_ions), np.diff(exyz_data.ion_offsets))
+    bin_index = np.searchsorted(bins, exyz_data.depth, side="right") - 1
+    inside = (bin_index >= 0) & (bin_index < num_bins)
+    energy_loss = np.bincount(
+        ion_index[inside] * num_bins + bin_index[inside], energy_loss[inside], exyz_data.num_ions * num_bins
+    )
+    return energy_loss.reshape(exyz_data.num_ions, num_bins) / np.diff(bins)
+
+
+class RunningCurve:
+    """Mean and standard error of the dE/dx per depth bin over all ions added so far"""
+
+    def __init__(self, bins):
+        self.bins = np.asarray(bins, dtype=float)
+        self.count = 0
+        self.mean = np.zeros(len(self.bins) - 1)
+        self.m2 = np.zeros(len(self.bins) - 1)  # sum of squared deviations from the mean
+
+    @classmethod
+    def for_batch(cls, exyz_data: ExyzData, num_bins=NUM_BINS):
+        """Bins from 0 past the deepest ion of a first batch"""
+        return cls(np.linspace(0, DEPTH_MARGIN * exyz_data.depth.max(), num_bins + 1))
+
+    def add(self, exyz_data: ExyzData):
+        self.update(ion_curves(exyz_data, self.bins))
+
+    def update(self, curves):
+        """Merge the statistics of a batch of ion curves, shape (ions, bins)"""
+        count = len(curves)
+        if not count:
+            return
+        mean = curves.mean(axis=0)
+        m2 = ((curves - mean) ** 2).sum(axis=0)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def depth(self):
+        return (self.bins[:-1] + self.bins[1:]) / 2
+
+    @property
+    def standard_error(self):
+        if self.count < 2:
+            return np.full(len(self.mean), np.inf)
+        return np.sqrt(self.m2 / (self.count - 1) / self.count)
+
+    def relative_error(self):
+        """Largest standard error of any bin relative to the peak of the mean curve"""
+        peak = self.mean.max()
+        return float(self.standard_error.max() / peak) if peak > 0 else float("inf")
+
+    def report(self, precision):
+        """Achieved precision, kept with the result"""
+        return {
+            "precision": precision,
+            "achieved": self.relative_error(),
+            "num_events": self.count,
+            "converged": self.relative_error() <= precision,
+            "depth": self.depth.tolist(),
+            "mean": self.mean.tolist(),
+            "standard_error": self.standard_error.tolist(),
+        }
+
+
+class StoppingRule:
+    """Stops once the curve has met the precision for CONSECUTIVE_BATCHES batches in a row,
+    with at least MIN_EVENTS ions, or once max_events ions have been run"""
+
+    def __init__(self, precision=DEFAULT_PRECISION, max_events=None):
+        self.precision = precision
+        self.max_events = max_events
+        self.streak = 0
+
+    def done(self, curve: RunningCurve):
+        self.streak = self.streak + 1 if curve.relative_error() <= self.precision else 0
+        if self.max_events is not None and curve.count >= self.max_events:
+            return True
+        return self.streak >= CONSECUTIVE_BATCHES and curve.count >= MIN_EVENTS
+
+
+def main():
+    parser = ArgumentParser(description="Standard error of the mean Bragg curve of EXYZ files as ions are added")
+    parser.add_argument("file_path", type=str)
+    parser.add_argument("-p", "--precision", type=float, default=DEFAULT_PRECISION)
+    parser.add_argument("-b", "--batch_size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    exyz_data = read_exyz(args.file_path)
+    curve = RunningCurve.for_batch(exyz_data)
+    rule = StoppingRule(args.precision)
+    for start in range(0, exyz_data.num_ions, args.batch_size):
+        curve.add(exyz_data.ions(start, min(start + args.batch_size, exyz_data.num_ions)))
+        done = rule.done(curve)
+        print(f"{curve.count:>6} ions: standard error {curve.relative_error():.2%} of the peak")
+        if done:
+            print(f"Converged to {args.precision:.2%} after {curve.count} ions")
+            return
+    print(f"Not converged to {args.precision:.2%} with all {curve.count} ions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+class BraggEvents:
+    """Bragg curves of many events stored as two flat arrays plus offsets (CSR style).
+    Event i is x_values[offsets[i]:offsets[i + 1]] and the same slice of dE_values."""
+
+    __slots__ = ("x_values", "dE_values", "offsets")
+
+    def __init__(self, x_values, dE_values, offsets):
+        self.x_values = np.asarray(x_values)
+        self.dE_values = np.asarray(dE_values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if len(self.x_values) != len(self.dE_values) or self.offsets[-1] - self.offsets[0] != len(self.x_values):
+            raise ValueError("x_values, dE_values and offsets do not match")
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), [0])
+
+    @classmethod
+    def from_events(cls, events):
+        """From an iterable of {"x_values": ..., "dE_values": ...} dicts"""
+        events = list(events)
+        if not events:
+            return cls.empty()
+        lengths = [len(event["x_values"]) for event in events]
+        return cls(
+            np.concatenate([event["x_values"] for event in events]),
+            np.concatenate([event["dE_values"] for event in events]),
+            np.concatenate([[0], np.cumsum(lengths)]),
+        )
+
+    @classmethod
+    def from_matrix(cls, x_values, dE_values):
+        """Events of equal length sharing the same x_values, one event per row of dE_values"""
+        dE_values = np.asarray(dE_values)
+        num_events, num_points = dE_values.shape
+        return cls(
+            np.tile(x_values, num_events),
+            dE_values.ravel(),
+            np.arange(num_events + 1) * num_points,
+        )
+
+    @classmethod
+    def concatenate(cls, collections):
+        collections = list(collections)
+        if not collections:
+            return cls.empty()
+        offsets = [collections[0].offsets - collections[0].offsets[0]]
+        for collection in collections[1:]:
+            offsets.append(collection.offsets[1:] - collection.offsets[0] + offsets[-1][-1])
+        return cls(
+            np.concatenate([collection.x_values for collection in collections]),
+            np.concatenate([collection.dE_values for collection in collections]),
+            np.concatenate(offsets),
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        """An event as a dict of views for an int, a BraggEvents for a slice or index array"""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                first, last = self.offsets[start], self.offsets[stop]
+                return BraggEvents(
+                    self.x_values[first - self.offsets[0]:last - self.offsets[0]],
+                    self.dE_values[first - self.offsets[0]:last - self.offsets[0]],
+                    self.offsets[start:stop + 1],
+                )
+            index = np.arange(start, stop, step)
+        if isinstance(index, (list, np.ndarray)):
+            return self.take(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = self.offsets[index:index + 2] - self.offsets[0]
+        return {"x_values": self.x_values[start:end], "dE_values": self.dE_values[start:end]}
+
+    def take(self, indices):
+        """Copy of the events at `indices`"""
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices] - self.offsets[0]
+        lengths = self.lengths[indices]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return BraggEvents(self.x_values[rows], self.dE_values[rows], offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return self.x_values.nbytes + self.dE_values.nbytes + self.offsets.nbytes
+
+    def event_index(self):
+        """Event number of every point"""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def _reduce(self, ufunc, values, empty):
+        result = np.full(len(self), empty, dtype=float)
+        nonempty = self.lengths > 0
+        if nonempty.any():
+            starts = self.offsets[:-1][nonempty] - self.offsets[0]
+            result[nonempty] = ufunc.reduceat(values, starts)
+        return result
+
+    def sum(self):
+        """Sum of dE_values per event, NaN ignored"""
+        return self._reduce(np.add, np.nan_to_num(self.dE_values), 0.0)
+
+    def mean(self):
+        counts = self._reduce(np.add, np.isfinite(self.dE_values).astype(float), 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum() / counts
+
+    def max(self):
+        return self._reduce(np.fmax, self.dE_values, np.nan)
+
+    def peak_x(self):
+        """x value of the maximum dE of every event"""
+        maxima = np.repeat(self.max(), self.lengths)
+        is_peak = self.dE_values == maxima
+        # First peak point of each event
+        peak = np.full(len(self), np.nan)
+        events = self.event_index()[is_peak]
+        first = np.unique(events, return_index=True)[1]
+        peak[events[first]] = self.x_values[is_peak][first]
+        return peak
+
+    def histogram(self, bins):
+        """(sum of dE, number of points) per x bin over all events, NaN ignored"""
+        valid = np.isfinite(self.dE_values)
+        x_values, dE_values = self.x_values[valid], self.dE_values[valid]
+        return (
+            np.histogram(x_values, bins, weights=dE_values)[0],
+            np.histogram(x_values, bins)[0].astype(float),
+        )
+
+    def average(self, bins):
+        """Bin centers and mean dE per x bin over all events"""
+        bins = np.asarray(bins, dtype=float)
+        dE_sum, counts = self.histogram(bins)
+        with np.errstate(invalid="ignore"):
+            return (bins[:-1] + bins[1:]) / 2, dE_sum / counts
+
+    def __repr__(self):
+        return f"BraggEvents({len(self)} events, {len(self.x_values)} points)"
@@ -0,0 +1,528 @@
+from dataclasses import dataclass, field, asdict
+import os
+import re
+import tempfile
+import numpy as np
+from cache import sidecar_directory, load_sidecar, save_sidecar, SidecarWriter
+
+
+EXYZ_COLUMNS = [
+    "Ion Number",
+    "Energy",
+    "Depth",
+    "Y",
+    "Z",
+    "Electronic Stop.",
+    "Recoil Energy",
+]
+NUM_COLUMNS = len(EXYZ_COLUMNS)
+
+KEV_TO_MEV = 1e-3
+EV_TO_MEV = 1e-6
+ANGSTROM_TO_CM = 1e-8
+# eV/Angstrom -> MeV/cm
+EV_PER_ANGSTROM_TO_MEV_PER_CM = EV_TO_MEV / ANGSTROM_TO_CM
+
+# e.g. "He     004.00  15000keV    294117eV" or "He     004,00  5400keV    1000eV"
+ION_DATA_REGEX = re.compile(
+    rb"^\s*([A-Z][a-z]?)\s+(\d+[.,]\d+)\s+(\d+(?:[.,]\d+)?)keV\s+(\d+(?:[.,]\d+)?)eV"
+)
+HEADER_END = b"-------"
+# Bump when the parsed columns change, invalidates all EXYZ sidecars
+EXYZ_CACHE_VERSION = 1
+
+
+@dataclass
+class ExyzHeader:
+    element: str
+    mass: float
+    energy: float  # eV
+    energy_interval: float  # eV
+    decimal: str
+    data_offset: int  # byte offset of the first data row
+    text: bytes = field(repr=False)
+
+
+@dataclass
+class ExyzData:
+    """Columns of an EXYZ file in MeV, cm and MeV/cm"""
+
+    header: ExyzHeader
+    ion_number: np.ndarray
+    energy: np.ndarray
+    depth: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    stopping: np.ndarray
+    recoil: np.ndarray
+    ion_offsets: np.ndarray = None
+
+    def __post_init__(self):
+        if self.ion_offsets is None:
+            self.ion_offsets = ion_boundaries(self.ion_number)
+
+    @property
+    def num_rows(self):
+        return len(self.ion_number)
+
+    @property
+    def num_ions(self):
+        return len(self.ion_offsets) - 1
+
+    def iter_ions(self):
+        """IonTrack views of the columns, no data is copied"""
+        for start, end in zip(self.ion_offsets[:-1], self.ion_offsets[1:]):
+            yield IonTrack(
+                ion_number=int(self.ion_number[start]),
+                energy=self.energy[start:end],
+                depth=self.depth[start:end],
+                y=self.y[start:end],
+                z=self.z[start:end],
+                stopping=self.stopping[start:end],
+                recoil=self.recoil[start:end],
+            )
+
+    def ions(self, start, stop):
+        """ExyzData view of the ions at positions start..stop-1"""
+        first, last = self.ion_offsets[start], self.ion_offsets[stop]
+        return ExyzData(
+            header=self.header,
+            ion_number=self.ion_number[first:last],
+            energy=self.energy[first:last],
+            depth=self.depth[first:last],
+            y=self.y[first:last],
+            z=self.z[first:last],
+            stopping=self.stopping[first:last],
+            recoil=self.recoil[first:last],
+            ion_offsets=self.ion_offsets[start:stop + 1] - first,
+        )
+
+    def iter_batches(self, max_rows=1 << 20):
+        """Views of consecutive ions with about `max_rows` rows each (at least one ion)"""
+        start = 0
+        while start < self.num_ions:
+            stop = np.searchsorted(self.ion_offsets, self.ion_offsets[start] + max_rows, side="right") - 1
+            stop = max(stop, start + 1)
+            yield self.ions(start, stop)
+            start = stop
+
+    def columns(self):
+        return dict(zip(EXYZ_COLUMNS, (
+            self.ion_number, self.energy, self.depth, self.y, self.z, self.stopping, self.recoil
+        )))
+
+
+def _to_float(value: bytes):
+    return float(value.replace(b",", b"."))
+
+
+def parse_exyz_header(header: bytes):
+    """Parse the SRIM header, `header` must end with the '-------' line"""
+    decimal = "."
+    element, mass, energy, energy_interval = "", np.nan, np.nan, np.nan
+    for line in header.splitlines():
+        match = ION_DATA_REGEX.match(line)
+        if match:
+            element = match.group(1).decode()
+            mass = _to_float(match.group(2))
+            energy = _to_float(match.group(3)) * 1e3
+            energy_interval = _to_float(match.group(4))
+            decimal = "," if b"," in match.group(2) else "."
+            break
+    return ExyzHeader(element, mass, energy, energy_interval, decimal, len(header), header)
+
+
+def read_exyz_header(file_path):
+    header = b""
+    with open(file_path, "rb") as file:
+        for line in file:
+            header += line
+            if line.startswith(HEADER_END):
+                return parse_exyz_header(header)
+    raise Exception(f"No EXYZ header found in {file_path}")
+
+
+def split_exyz_header(contents: bytes):
+    """Split the raw contents of an EXYZ file into header and data block"""
+    start = contents.find(b"\n" + HEADER_END)
+    if start == -1:
+        raise Exception("No EXYZ header found")
+    end = contents.find(b"\n", start + 1)
+    end = len(contents) if end == -1 else end + 1
+    return contents[:end], contents[end:]
+
+
+def complete_rows(block: bytes):
+    """Drop a trailing row that was not completely written"""
+    if block.endswith(b"\n") or not block:
+        return block
+    last_line_start = block.rfind(b"\n") + 1
+    if len(block[last_line_start:].split()) == NUM_COLUMNS:
+        return block
+    return block[:last_line_start]
+
+
+def parse_exyz_block(block: bytes):
+    """Decode whitespace separated EXYZ rows in one go.
+    Accepts both '.' and ',' as decimal separator, returns raw SRIM units."""
+    if b"," in block:
+        block = block.replace(b",", b".")
+    values = np.array(block.split(), dtype=np.float64)
+    if values.size % NUM_COLUMNS:
+        raise ValueError(f"EXYZ data has {values.size} values, not a multiple of {NUM_COLUMNS}")
+    return values.reshape(-1, NUM_COLUMNS)
+
+
+def convert_units(rows: np.ndarray):
+    """Raw SRIM units (keV, Angstrom, eV/Angstrom, eV) to MeV, cm and MeV/cm"""
+    return dict(
+        energy=rows[:, 1] * KEV_TO_MEV,
+        depth=rows[:, 2] * ANGSTROM_TO_CM,
+        y=rows[:, 3] * ANGSTROM_TO_CM,
+        z=rows[:, 4] * ANGSTROM_TO_CM,
+        stopping=rows[:, 5] * EV_PER_ANGSTROM_TO_MEV_PER_CM,
+        recoil=rows[:, 6] * EV_TO_MEV,
+    )
+
+
+def to_exyz_data(header: ExyzHeader, rows: np.ndarray):
+    return ExyzData(header=header, ion_number=rows[:, 0].astype(np.int64), **convert_units(rows))
+
+
+def ion_boundaries(ion_number: np.ndarray):
+    """Row offsets where a new ion starts, including 0 and len(ion_number)"""
+    if not len(ion_number):
+        return np.zeros(1, dtype=np.int64)
+    changes = np.flatnonzero(ion_number[1:] != ion_number[:-1]) + 1
+    return np.concatenate(([0], changes, [len(ion_number)]))
+
+
+def read_exyz(file_path):
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    header, block = split_exyz_header(contents)
+    rows = parse_exyz_block(complete_rows(block))
+    return to_exyz_data(parse_exyz_header(header), rows)
+
+
+@dataclass
+class IonTrack:
+    ion_number: int
+    energy: np.ndarray
+    depth: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    stopping: np.ndarray
+    recoil: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray):
+        return cls(ion_number=int(rows[0, 0]), **convert_units(rows))
+
+
+def iter_exyz_rows(file_path, chunk_size=1 << 20):
+    """Yield the parsed rows of the file `chunk_size` bytes at a time, in raw SRIM units"""
+    with open(file_path, "rb") as file:
+        while not file.readline().startswith(HEADER_END):
+            if not file.peek(1):
+                raise Exception(f"No EXYZ header found in {file_path}")
+        rest = b""
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            cut = chunk.rfind(b"\n") + 1
+            rest = chunk[cut:]
+            rows = parse_exyz_block(chunk[:cut])
+            if len(rows):
+                yield rows
+        rows = parse_exyz_block(complete_rows(rest))
+        if len(rows):
+            yield rows
+
+
+def build_exyz_sidecar(file_path, directory, chunk_size=1 << 20):
+    writer = SidecarWriter(directory)
+    try:
+        num_rows, last_ion = 0, None
+        ion_offsets = []
+        for rows in iter_exyz_rows(file_path, chunk_size):
+            ion_number = rows[:, 0].astype(np.int64)
+            starts = ion_boundaries(ion_number)[:-1]
+            if ion_number[0] == last_ion:
+                starts = starts[1:]
+            ion_offsets.append(starts + num_rows)
+            num_rows += len(rows)
+            last_ion = ion_number[-1]
+            writer.append(ion_number=ion_number, **convert_units(rows))
+        if not num_rows:
+            # A header without rows still gets its (empty) columns
+            rows = np.empty((0, NUM_COLUMNS))
+            writer.append(ion_number=rows[:, 0].astype(np.int64), **convert_units(rows))
+        ion_offsets.append([num_rows])
+        writer.append(ion_offsets=np.concatenate(ion_offsets).astype(np.int64))
+        header = asdict(read_exyz_header(file_path))
+        header["text"] = header["text"].decode("latin-1")
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit({"header": header})
+
+
+def load_exyz(file_path, use_cache=True):
+    """Same as read_exyz, but served from a memory-mapped sidecar in CacheFiles/.
+    The sidecar is built on the first load and rebuilt whenever the file changes."""
+    if not use_cache:
+        return read_exyz(file_path)
+    directory = sidecar_directory(file_path, "exyz", EXYZ_CACHE_VERSION)
+    sidecar = load_sidecar(directory)
+    if sidecar is None:
+        build_exyz_sidecar(file_path, directory)
+        sidecar = load_sidecar(directory)
+    meta, arrays = sidecar
+    header = dict(meta["header"])
+    header["text"] = header["text"].encode("latin-1")
+    return ExyzData(header=ExyzHeader(**header), **arrays)
+
+
+def compute_dedx(energy, depth, ion_offsets):
+    """dE, dx and dE/dx of all ions in one pass over the flat columns.
+    The first row of every ion is NaN, like diff() within each ion."""
+    dE = np.empty(len(energy))
+    dx = np.empty(len(depth))
+    dE[1:] = np.diff(energy)
+    dx[1:] = np.diff(depth)
+    first_rows = ion_offsets[:-1][ion_offsets[:-1] < len(energy)]
+    dE[first_rows] = np.nan
+    dx[first_rows] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dE_dx = -dE / dx
+    return dE, dx, dE_dx
+
+
+def pad_tails(depth, dE_dx, dx, ion_offsets, tail_length=20):
+    """Append `tail_length` zeros to the dE/dx of every ion, with depths continuing from the
+    last depth in steps of the ion's mean dx. Returns depth, dE/dx and the new ion offsets."""
+    num_ions = len(ion_offsets) - 1
+    num_rows = np.diff(ion_offsets)
+    new_offsets = ion_offsets + tail_length * np.arange(num_ions + 1)
+    padded_depth = np.empty(len(depth) + tail_length * num_ions)
+    padded_dE_dx = np.zeros(len(padded_depth))
+
+    rows = np.arange(len(depth)) + tail_length * np.repeat(np.arange(num_ions), num_rows)
+    padded_depth[rows] = depth
+    padded_dE_dx[rows] = dE_dx
+
+    # Mean over the defined steps of each ion, NaN for ions with a single row
+    dx_sum = np.bincount(np.repeat(np.arange(num_ions), num_rows), np.nan_to_num(dx), num_ions)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_dx = np.where(num_rows > 1, dx_sum / (num_rows - 1), np.nan)
+    last_depth = depth[ion_offsets[1:] - 1]
+    tail_rows = new_offsets[1:, None] - tail_length + np.arange(tail_length)
+    steps = np.linspace(0, 1, tail_length)
+    padded_depth[tail_rows] = last_depth[:, None] + (tail_length * mean_dx)[:, None] * steps
+    return padded_depth, padded_dE_dx, new_offsets
+
+
+def bragg_curves(exyz_data: ExyzData, tail_length=20):
+    """x_values, dE_values and offsets of the Bragg curves of all ions, as flat arrays.
+    Every curve starts at the second row of its ion and ends with `tail_length` zeros."""
+    dE, dx, dE_dx = compute_dedx(exyz_data.energy, exyz_data.depth, exyz_data.ion_offsets)
+    depth, dE_dx, offsets = pad_tails(exyz_data.depth, dE_dx, dx, exyz_data.ion_offsets, tail_length)
+    # Drop the first row of every ion, it has no dE/dx
+    keep = np.ones(len(depth), dtype=bool)
+    keep[offsets[:-1][offsets[:-1] < len(depth)]] = False
+    return depth[keep], dE_dx[keep], offsets - np.arange(len(offsets))
+
+
+def _replace_atomically(write, destination_path):
+    """Let `write(file)` fill a temporary file next to `destination_path`, then rename it into place"""
+    directory = os.path.dirname(destination_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(tmp_path, destination_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _stream_copy(source_path, destination_path, fix_decimals, chunk_size):
+    def write(destination):
+        with open(source_path, "rb") as source:
+            for chunk in iter(lambda: source.read(chunk_size), b""):
+                destination.write(chunk.replace(b",", b".") if fix_decimals else chunk)
+    _replace_atomically(write, destination_path)
+
+
+def move_exyz_file(source_path, destination_path, chunk_size=1 << 20):
+    """Move an EXYZ file without copying it when possible.
+    Garfield only reads '.' decimals, so a file written with ',' decimals is fixed
+    in a single streaming pass on its way to the destination."""
+    fix_decimals = read_exyz_header(source_path).decimal == ","
+    if not fix_decimals:
+        try:
+            os.replace(source_path, destination_path)
+            return
+        except OSError:
+            # Different file systems, fall back to a copy
+            pass
+    _stream_copy(source_path, destination_path, fix_decimals, chunk_size)
+    os.remove(source_path)
+
+
+ION_NUMBER_REGEX = re.compile(rb"(?m)^(\d+)")
+
+
+def merge_exyz_files(source_paths, destination_path):
+    """Concatenate EXYZ files of the same ion, energy and interval into one file, as if
+    it were a single run. Ions are renumbered to run on from the previous file."""
+    headers = [read_exyz_header(source_path) for source_path in source_paths]
+    for source_path, header in zip(source_paths[1:], headers[1:]):
+        if (header.element, header.mass, header.energy, header.energy_interval, header.decimal) != (
+            headers[0].element, headers[0].mass, headers[0].energy, headers[0].energy_interval, headers[0].decimal
+        ):
+            raise ValueError(f"{source_path} is not from the same simulation as {source_paths[0]}")
+
+    def write(destination):
+        destination.write(headers[0].text)
+        num_ions = 0
+        for source_path, header in zip(source_paths, headers):
+            with open(source_path, "rb") as source:
+                source.seek(header.data_offset)
+                block = complete_rows(source.read())
+            ion_numbers = np.unique(np.array(ION_NUMBER_REGEX.findall(block), dtype=np.int64))
+            offset = num_ions - (ion_numbers[0] - 1 if len(ion_numbers) else 0)
+            destination.write(ION_NUMBER_REGEX.sub(lambda match: b"%07d" % (int(match.group(1)) + offset), block))
+            num_ions += len(ion_numbers)
+    _replace_atomically(write, destination_path)
+    return destination_path
+
+
+# Bump when the index layout changes, invalidates all index sidecars
+EXYZ_INDEX_VERSION = 1
+WHITESPACE = np.frombuffer(b" \t\r\n", dtype=np.uint8)
+
+
+def _row_starts(block: bytes):
+    """Offsets of the non-empty lines in a block of complete lines"""
+    buffer = np.frombuffer(block, dtype=np.uint8)
+    line_starts = np.concatenate(([0], np.flatnonzero(buffer == ord("\n"))[:-1] + 1))
+    line_starts = line_starts[line_starts < len(buffer)]
+    return line_starts[~np.isin(buffer[line_starts], WHITESPACE)]
+
+
+def build_exyz_index(file_path, directory, chunk_size=1 << 20):
+    """Scan the file once and store per ion: ion number, byte range, row count
+    and final depth/energy (cm, MeV)"""
+    header = read_exyz_header(file_path)
+    ion_number, byte_offset, num_rows, final_depth, final_energy = [], [], [], [], []
+    with open(file_path, "rb") as file:
+        file.seek(header.data_offset)
+        position, rest = header.data_offset, b""
+        while True:
+            chunk = file.read(chunk_size)
+            if chunk:
+                chunk = rest + chunk
+                cut = chunk.rfind(b"\n") + 1
+                block, rest = chunk[:cut], chunk[cut:]
+            else:
+                block, rest = complete_rows(rest), b""
+            rows = parse_exyz_block(block)
+            if len(rows):
+                row_starts = _row_starts(block) + position
+                if len(row_starts) != len(rows):
+                    raise ValueError(f"Could not index {file_path}, rows span several lines")
+                boundaries = ion_boundaries(rows[:, 0])
+                starts, ends = boundaries[:-1], boundaries[1:]
+                if ion_number and ion_number[-1] == rows[0, 0]:
+                    # The first ion of this block continues the last one of the previous
+                    num_rows[-1] += ends[0]
+                    final_depth[-1], final_energy[-1] = rows[ends[0] - 1, 2], rows[ends[0] - 1, 1]
+                    starts, ends = starts[1:], ends[1:]
+                ion_number.extend(rows[starts, 0])
+                byte_offset.extend(row_starts[starts])
+                num_rows.extend(ends - starts)
+                final_depth.extend(rows[ends - 1, 2])
+                final_energy.extend(rows[ends - 1, 1])
+            position += len(block)
+            if not chunk:
+                break
+    byte_offset.append(position)
+    save_sidecar(directory, {
+        "ion_number": np.array(ion_number, dtype=np.int64),
+        "byte_offset": np.array(byte_offset, dtype=np.int64),
+        "num_rows": np.array(num_rows, dtype=np.int64),
+        "final_depth": np.array(final_depth) * ANGSTROM_TO_CM,
+        "final_energy": np.array(final_energy) * KEV_TO_MEV,
+    }, {"data_offset": header.data_offset})
+
+
+class ExyzIndex:
+    """Random access to the ions of an EXYZ file.
+    The index is built once per file content and kept as a sidecar in CacheFiles/."""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        directory = sidecar_directory(file_path, "exyz-index", EXYZ_INDEX_VERSION)
+        sidecar = load_sidecar(directory)
+        if sidecar is None:
+            build_exyz_index(file_path, directory)
+            sidecar = load_sidecar(directory)
+        meta, arrays = sidecar
+        self.data_offset = meta["data_offset"]
+        self.ion_number = arrays["ion_number"]
+        # One entry more than there are ions, the last one is the end of the data
+        self.byte_offset = arrays["byte_offset"]
+        self.num_rows = arrays["num_rows"]
+        self.final_depth = arrays["final_depth"]
+        self.final_energy = arrays["final_energy"]
+        # SRIM numbers ions 1, 2, 3, ... so the position is usually ion_number - first
+        self.contiguous = bool(len(self.ion_number)) and (
+            self.ion_number[-1] - self.ion_number[0] == len(self.ion_number) - 1
+        )
+
+    def __len__(self):
+        return len(self.ion_number)
+
+    def position(self, ion_number):
+        if self.contiguous:
+            position = ion_number - int(self.ion_number[0])
+        else:
+            position = int(np.searchsorted(self.ion_number, ion_number))
+        if not 0 <= position < len(self) or self.ion_number[position] != ion_number:
+            raise KeyError(f"Ion {ion_number} not in {self.file_path}")
+        return position
+
+    def read_bytes(self, start, stop):
+        """Raw rows of the ions at positions start..stop-1"""
+        stop = min(stop, len(self))
+        if start >= stop:
+            return b""
+        with open(self.file_path, "rb") as file:
+            file.seek(self.byte_offset[start])
+            return file.read(self.byte_offset[stop] - self.byte_offset[start])
+
+    def read_header(self):
+        with open(self.file_path, "rb") as file:
+            return parse_exyz_header(file.read(self.data_offset))
+
+    def read_ions(self, start, stop):
+        """ExyzData with the ions at positions start..stop-1"""
+        rows = parse_exyz_block(self.read_bytes(start, stop))
+        return to_exyz_data(self.read_header(), rows)
+
+    def read_ion(self, ion_number):
+        position = self.position(ion_number)
+        return IonTrack.from_rows(parse_exyz_block(self.read_bytes(position, position + 1)))
+
+    def write_ions(self, destination_path, start, stop):
+        """Write an EXYZ file with only the ions at positions start..stop-1,
+        e.g. for Garfield's TrackTrim.ReadFile instead of skipping ions with nSkip"""
+        with open(self.file_path, "rb") as file:
+            header = file.read(self.data_offset)
+        with open(destination_path, "wb") as file:
+            file.write(header)
+            file.write(self.read_bytes(start, stop))
@@ -0,0 +1,196 @@
+"""Live view of a TRIM run from the EXYZ.txt it is still writing.
+
+ExyzFollower parses only the bytes appended since its last poll. An ion counts as finished
+once the next one has started, its rows then go into a running mean Bragg curve, see
+convergence.RunningCurve. Run this module next to a TRIM run to watch it, e.g.
+    python follow.py "../../SRIM-2013/SRIM Outputs/EXYZ.txt" -N 1000
+"""
+from argparse import ArgumentParser
+import os
+import threading
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from convergence import RunningCurve
+from exyz import NUM_COLUMNS, parse_exyz_block, parse_exyz_header, split_exyz_header, to_exyz_data
+
+POLL_INTERVAL = 1.0
+# Seconds between the progress lines of Simulation(follow=True)
+PRINT_INTERVAL = 30.0
+
+
+class ExyzFollower:
+    """Follows a growing EXYZ file. num_events, if known, gives the ETA. bins [cm] of the
+    running mean are taken from the first finished ions when not given."""
+
+    def __init__(self, file_path, num_events=None, bins=None):
+        self.file_path = os.path.abspath(file_path)
+        self.num_events = num_events
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        self.position = 0  # offset of the first byte not read yet
+        self.pending = b""  # read but not parsed yet, the header or a row cut off mid-line
+        self.header = None
+        self.current_ion = np.empty((0, NUM_COLUMNS))  # rows of the ion still being written
+        self.curve = None if self.bins is None else RunningCurve(self.bins)
+        self.ions_finished = 0
+        self.start_time = time.monotonic()
+
+    def poll(self):
+        """Read and parse what was appended since the last poll. Returns the number of ions
+        that were finished by it."""
+        try:
+            size = os.path.getsize(self.file_path)
+        except FileNotFoundError:
+            return 0
+        if size < self.position:
+            # A new run has started the file over
+            self.reset()
+        with open(self.file_path, "rb") as file:
+            file.seek(self.position)
+            appended = file.read()
+        data, header = self.pending + appended, self.header
+        if header is None:
+            try:
+                header_bytes, data = split_exyz_header(data)
+            except Exception:
+                header_bytes = b""
+            if not header_bytes.endswith(b"\n"):
+                # The header is not complete yet
+                self.position += len(appended)
+                self.pending += appended
+                return 0
+            header = parse_exyz_header(header_bytes)
+        cut = data.rfind(b"\n") + 1
+        rows = np.concatenate([self.current_ion, parse_exyz_block(data[:cut])])
+        self.position += len(appended)
+        self.header, self.pending = header, data[cut:]
+        if not len(rows):
+            return 0
+        # Everything before the first row of the last ion is finished
+        last_ion_start = np.flatnonzero(rows[:, 0] == rows[-1, 0])[0]
+        self.current_ion = rows[last_ion_start:]
+        return self._add(rows[:last_ion_start])
+
+    def finish(self):
+        """Poll a last time and count the last ion as finished, once the run is over"""
+        self.poll()
+        if self.pending.strip() and self.header is not None:
+            self.current_ion = np.concatenate([self.current_ion, parse_exyz_block(self.pending + b"\n")])
+            self.pending = b""
+        rows, self.current_ion = self.current_ion, self.current_ion[:0]
+        return self._add(rows)
+
+    def _add(self, rows):
+        if not len(rows):
+            return 0
+        exyz_data = to_exyz_data(self.header, rows)
+        if self.curve is None:
+            self.curve = RunningCurve.for_batch(exyz_data)
+        self.curve.add(exyz_data)
+        self.ions_finished += exyz_data.num_ions
+        return exyz_data.num_ions
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.start_time
+
+    @property
+    def ions_per_second(self):
+        return self.ions_finished / self.elapsed
+
+    @property
+    def eta(self):
+        """Seconds until num_events ions are finished at the rate so far, None if unknown"""
+        if self.num_events is None or not self.ions_finished:
+            return None
+        return max(self.num_events - self.ions_finished, 0) / self.ions_per_second
+
+    def running_mean(self):
+        """Depth [cm] and mean dE/dx [MeV/cm] over the finished ions"""
+        if self.curve is None:
+            return np.empty(0), np.empty(0)
+        return self.curve.depth, self.curve.mean
+
+    def status(self):
+        total = f"/{self.num_events}" if self.num_events else ""
+        line = f"{self.ions_finished}{total} ions in {self.elapsed:.0f} s, {self.ions_per_second:.3g} ions/s"
+        if self.eta is not None:
+            line += f", ETA {self.eta:.0f} s"
+        if self.curve is not None and self.curve.count:
+            line += f", peak {self.curve.mean.max():.3g} MeV/cm at {self.curve.depth[self.curve.mean.argmax()]:.3g} cm"
+        return line
+
+
+class FollowThread(threading.Thread):
+    """Polls a follower in the background and reports its status every print_interval seconds.
+    stop() finishes the follower once the run is over."""
+
+    def __init__(self, follower: ExyzFollower, label="", poll_interval=POLL_INTERVAL, print_interval=PRINT_INTERVAL,
+                 report=print):
+        super().__init__(name="follow", daemon=True)
+        self.follower = follower
+        self.label = label
+        self.poll_interval = poll_interval
+        self.print_interval = print_interval
+        self.report = report
+        self.stopped = threading.Event()
+
+    def run(self):
+        last_print = time.monotonic()
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.follower.poll()
+            except ValueError:
+                # A row caught mid-write with a column missing, read again on the next poll
+                continue
+            if time.monotonic() - last_print >= self.print_interval:
+                self.report(f"{self.label}{self.follower.status()}")
+                last_print = time.monotonic()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.follower.finish()
+        self.report(f"{self.label}{self.follower.status()}")
+
+
+def main():
+    parser = ArgumentParser(description="Follow the EXYZ.txt of a running TRIM")
+    parser.add_argument("file_path", type=str)
+    parser.add_argument("-N", "--num_events", type=int, default=None, help="ions of the run, for the ETA")
+    parser.add_argument("-i", "--interval", type=float, default=5.0, help="seconds between updates")
+    parser.add_argument("--plot", action="store_true", help="plot the running mean Bragg curve")
+    args = parser.parse_args()
+
+    follower = ExyzFollower(args.file_path, args.num_events)
+    if args.plot:
+        fig, ax = plt.subplots()
+        (line,) = ax.plot([], [])
+        ax.set_xlabel("Depth [cm]")
+        ax.set_ylabel("dE/dx [MeV/cm]")
+    try:
+        while True:
+            position = follower.position
+            follower.poll()
+            print(follower.status())
+            # Only the last ion is left and the file has stopped growing
+            if args.num_events and follower.ions_finished >= args.num_events - 1 and follower.position == position:
+                break
+            if args.plot:
+                line.set_data(*follower.running_mean())
+                ax.relim()
+                ax.autoscale_view()
+                plt.pause(args.interval)
+            else:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    follower.finish()
+    print(follower.status())
+
+
+if __name__ == "__main__":
+    main()
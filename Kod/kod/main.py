@@ -1,10 +1,18 @@
 from argparse import ArgumentParser
 from pprint import pprint
 
-from simulation import simulate_all
+from simulation import BACKENDS, simulate_all
+from convergence import DEFAULT_BATCH_SIZE
+from tuning import DEFAULT_TOLERANCE
+from srim_outputs import DEFAULT_OUTPUTS
+from transfer import COMPRESSORS, LocalDirectoryBackend, ScpBackend, TransferQueue
 from func_lib import plot_all
 
 
+def energy_interval(value):
+    return value if value == "auto" else float(value)
+
+
 def get_arguments():
     parser = ArgumentParser(description="add description")
 
@@ -28,16 +36,35 @@ def get_arguments():
         "-N",
         "--num_events",
         type=int,
-        help="number of events per isotope",
+        help="number of events per isotope, the most that are run with --precision",
         default=1,
     )
+    parser.add_argument(
+        "--precision",
+        type=float,
+        help="run ions in batches until the standard error of the mean dE/dx is below this fraction "
+             "of its peak in every depth bin",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="ions per batch with --precision",
+        default=DEFAULT_BATCH_SIZE,
+    )
     parser.add_argument(
         "-x",
         "--energy_interval",
-        type=float,
-        help="interval between energt measurements",
+        type=energy_interval,
+        help="interval between energt measurements, 'auto' to tune it on a pilot run",
         default=1e4,
     )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="largest relative deviation of dE/dx and cluster density from the pilot with -x auto",
+        default=DEFAULT_TOLERANCE,
+    )
     parser.add_argument(
         "-m",
         "--material",
@@ -59,6 +86,76 @@ def get_arguments():
         help="phase of material",
         default=1,
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of TRIM runs in parallel, each in its own SRIM sandbox",
+        default=1,
+    )
+    parser.add_argument(
+        "-s",
+        "--shards",
+        type=int,
+        help="number of TRIM processes the events of each run are split over",
+        default=1,
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        type=str,
+        choices=BACKENDS,
+        help="TRIM, or the in-process Monte Carlo surrogate, whose ranges are within 5%% of SRIM "
+        "but whose Bragg curves of heavy ions such as Sr80 are off by about 30%%",
+        default="srim",
+    )
+    parser.add_argument(
+        "-t",
+        "--transfer",
+        type=str,
+        help="send new EXYZ files in the background to 'remote' (scp) or to a local directory",
+        default=None,
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        type=str,
+        choices=sorted(COMPRESSORS),
+        help="compress files before the transfer",
+        default=None,
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="print the progress of every TRIM run while it goes",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="seconds after which a TRIM run is stopped, keeping the ions it has finished",
+        default=None,
+    )
+    parser.add_argument(
+        "--stall_timeout",
+        type=float,
+        help="seconds without new output after which a TRIM run is stopped as hung",
+        default=None,
+    )
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="keep a warm TRIM worker in every job process instead of a new sandbox per run",
+    )
+    parser.add_argument(
+        "--range",
+        action="store_true",
+        help="also keep RANGE.txt, the final distribution of the ions and recoils",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="run TRIM even if an identical simulation has been saved",
+    )
 
     return parser.parse_args()
 
@@ -72,15 +169,38 @@ def main():
     args = get_arguments()
     check_args(args)
 
-    simulation_dataset = simulate_all(
-        args.isotopes,
-        args.energies,
-        args.num_events,
-        args.energy_interval,
-        material=args.material,
-        density=args.density,
-        phase=args.phase,
-    )
+    transfer = None
+    if args.transfer:
+        backend = ScpBackend() if args.transfer == "remote" else LocalDirectoryBackend(args.transfer)
+        transfer = TransferQueue(backend, args.compression)
+
+    try:
+        simulation_dataset = simulate_all(
+            args.isotopes,
+            args.energies,
+            args.num_events,
+            args.energy_interval,
+            material=args.material,
+            density=args.density,
+            phase=args.phase,
+            jobs=args.jobs,
+            shards=args.shards,
+            backend=args.backend,
+            transfer=transfer,
+            tolerance=args.tolerance,
+            precision=args.precision,
+            batch_size=args.batch_size,
+            follow=args.follow,
+            timeout=args.timeout,
+            stall_timeout=args.stall_timeout,
+            session=args.session,
+            outputs=DEFAULT_OUTPUTS + ("range",) if args.range else DEFAULT_OUTPUTS,
+            use_cache=not args.no_cache,
+        )
+    finally:
+        # Also when the campaign fails, what was queued is still sent
+        if transfer is not None:
+            transfer.close()
 
     pprint(simulation_dataset)
 
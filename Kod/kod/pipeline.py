@@ -0,0 +1,107 @@
+"""Producer/consumer pipeline: items from a producer pass through stages that each run
+in their own thread, connected by bounded queues, so a slow stage only holds up the
+producer once the queues in front of it are full."""
+import queue
+import threading
+import time
+
+# Marks the end of the items on a queue
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0  # seconds spent on items
+        self.idle = 0.0  # seconds waiting for input or for room downstream
+
+    @property
+    def throughput(self):
+        return self.items / self.busy if self.busy else float("nan")
+
+
+class Pipeline:
+    """stages is a list of (name, function). Every stage calls its function on each item
+    and passes the return value on, the last stage's return values are collected."""
+
+    def __init__(self, stages, queue_size=4):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.stats = [StageStats(name) for name, _ in stages]
+        self.results = []
+        self.errors = []
+
+    def _put(self, index, item, stats):
+        start = time.perf_counter()
+        if index < len(self.queues):
+            self.queues[index].put(item)
+        elif item is not _DONE:
+            self.results.append(item)
+        stats.idle += time.perf_counter() - start
+
+    def _run_stage(self, index):
+        _, function = self.stages[index]
+        stats = self.stats[index]
+        while True:
+            start = time.perf_counter()
+            item = self.queues[index].get()
+            stats.idle += time.perf_counter() - start
+            if item is _DONE:
+                self._put(index + 1, _DONE, stats)
+                return
+            if self.errors:
+                # Drain without work after a failure, so the producer never blocks
+                continue
+            start = time.perf_counter()
+            try:
+                item = function(item)
+            except Exception as error:
+                self.errors.append(error)
+                continue
+            finally:
+                stats.busy += time.perf_counter() - start
+            stats.items += 1
+            self._put(index + 1, item, stats)
+
+    def run(self, producer, name="produce"):
+        """Feed the items of the `producer` iterable through the stages in this thread.
+        Returns the results of the last stage, re-raises the first error of any stage."""
+        threads = [
+            threading.Thread(target=self._run_stage, args=(index,), name=stage_name, daemon=True)
+            for index, (stage_name, _) in enumerate(self.stages)
+        ]
+        for thread in threads:
+            thread.start()
+        stats = StageStats(name)
+        self.stats.insert(0, stats)
+        items = iter(producer)
+        try:
+            while not self.errors:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                finally:
+                    stats.busy += time.perf_counter() - start
+                stats.items += 1
+                self._put(0, item, stats)
+        finally:
+            if hasattr(items, "close"):
+                # Stop a generator early, e.g. to shut down its worker processes
+                items.close()
+            self._put(0, _DONE, stats)
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return self.results
+
+    def report(self):
+        lines = [f"{'stage':<10} {'items':>6} {'busy [s]':>9} {'idle [s]':>9} {'items/s':>8}"]
+        for stats in self.stats:
+            lines.append(
+                f"{stats.name:<10} {stats.items:>6} {stats.busy:>9.2f} {stats.idle:>9.2f} {stats.throughput:>8.2f}"
+            )
+        return "\n".join(lines)
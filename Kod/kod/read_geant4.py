@@ -4,10 +4,14 @@ import os
 import numpy as np
 import matplotlib.pyplot as plt
 from config import DATA_DIR
+from cache import sidecar_directory, load_sidecar, save_sidecar
+from events import BraggEvents
 
 # DATA_DIR  = "DataFiles\\Geant4"
 # FILE_NAME = "Ca40_800MeV_100_events_CF4_500mbar_train.txt"
 FILE_NAME = "Ne20_300MeV_100_events_CF4_500mbar_train.txt"
+# Bump when read_data_file changes, invalidates all Geant4 sidecars
+GEANT4_CACHE_VERSION = 1
 
 @dataclass
 class Geant4Result:
@@ -37,8 +41,22 @@ class Geant4Result:
         return isotope, total_energy, num_events, id
 
     @staticmethod
-    def read_data_file(file_name, directory):
-        results = pd.read_csv(os.path.join(directory, file_name), sep="\s+", header=None).transpose()
+    def read_events(file_path, use_cache=True):
+        """One row per event, memory-mapped from a sidecar in CacheFiles/ when cached"""
+        if not use_cache:
+            return pd.read_csv(file_path, sep="\s+", header=None).values
+        directory = sidecar_directory(file_path, "geant4", GEANT4_CACHE_VERSION)
+        sidecar = load_sidecar(directory)
+        if sidecar is None:
+            events = pd.read_csv(file_path, sep="\s+", header=None).values
+            save_sidecar(directory, {"events": events})
+            return events
+        return sidecar[1]["events"]
+
+    @classmethod
+    def read_data_file(cls, file_name, directory, use_cache=True):
+        events = cls.read_events(os.path.join(directory, file_name), use_cache=use_cache)
+        results = pd.DataFrame(events.T)
         num_points = results.shape[0]
         chamber_length = 50
         # depth = pd.DataFrame(np.linspace(0, chamber_length, num_points))
@@ -47,13 +65,8 @@ class Geant4Result:
         return results
 
     def get_bragg_data(self):
-        bragg_data = []
         x_values = self.results["depth"].values
-        for result in self.results.transpose().values[:-1]:
-            dE_values = result
-            bragg_event = {"x_values": x_values, "dE_values": dE_values}
-            bragg_data.append(bragg_event)
-        return bragg_data
+        return BraggEvents.from_matrix(x_values, self.results.values[:, :-1].T)
     
     def get_average_bragg_data(self):
         data = self.results.values
@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+import os
+import shutil
+import tempfile
+from config import SRIM_EXECUTABLE_DIRECTORY
+
+# Read-only parts of the SRIM install, shared with every sandbox through links
+SHARED_EXTENSIONS = {".exe", ".dll", ".ocx", ".chm", ".hlp", ".pdf"}
+SHARED_DIRS = {"Data"}
+# TRIM writes here, so each sandbox starts with its own empty copy
+OUTPUT_DIRS = {"SRIM Outputs", "SRIM Restore"}
+
+
+def link_or_copy(source_path, destination_path):
+    """Hard link, else symlink, else copy"""
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(source_path), destination_path)
+        except OSError:
+            shutil.copy2(source_path, destination_path)
+
+
+def clone_srim_directory(srim_directory, sandbox_directory):
+    """Clone the SRIM install into sandbox_directory. Files TRIM may write (TRIM.IN, TRIMAUTO,
+    the output tables) are copied, so a run in the sandbox never touches the install."""
+    for root, dirs, files in os.walk(srim_directory):
+        relative_root = os.path.relpath(root, srim_directory)
+        top_dir = relative_root.split(os.sep)[0]
+        os.makedirs(os.path.join(sandbox_directory, relative_root), exist_ok=True)
+        if top_dir in OUTPUT_DIRS:
+            dirs.clear()
+            continue
+        for file_name in files:
+            source_path = os.path.join(root, file_name)
+            destination_path = os.path.join(sandbox_directory, relative_root, file_name)
+            if top_dir in SHARED_DIRS or os.path.splitext(file_name)[1].lower() in SHARED_EXTENSIONS:
+                link_or_copy(source_path, destination_path)
+            else:
+                shutil.copy2(source_path, destination_path)
+    for output_dir in OUTPUT_DIRS:
+        os.makedirs(os.path.join(sandbox_directory, output_dir), exist_ok=True)
+
+
+@contextmanager
+def srim_sandbox(srim_directory=SRIM_EXECUTABLE_DIRECTORY, parent_directory=None):
+    """A private SRIM directory for one TRIM run, removed afterwards"""
+    sandbox_directory = tempfile.mkdtemp(prefix="srim-", dir=parent_directory)
+    try:
+        clone_srim_directory(srim_directory, sandbox_directory)
+        yield sandbox_directory
+    finally:
+        shutil.rmtree(sandbox_directory, ignore_errors=True)
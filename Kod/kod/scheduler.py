@@ -0,0 +1,115 @@
+"""Runtime prediction and longest-first ordering of simulation campaigns.
+
+Every finished run is appended to RUNTIMES_PATH. CostModel fits log(runtime) as a linear
+function of the logs of the run's parameters, pulled towards a prior for the features that
+the recorded runs don't pin down, so a handful of runs already gives a usable ordering.
+"""
+from argparse import ArgumentParser
+import heapq
+import json
+import os
+import time
+import numpy as np
+from config import RUNTIMES_PATH
+from surrogate import SYMBOLS
+
+FEATURES = ["constant", "num_events", "energy", "atomic_number", "exyz_rows", "shards"]
+# TRIM time grows with the number of ions and their energy, sharding divides it, roughly
+PRIOR_WEIGHTS = np.array([np.log(1e-3), 1.0, 1.0, 0.0, 0.1, -1.0])
+# Strength of the pull towards PRIOR_WEIGHTS, in units of squared log error per feature
+PRIOR_STRENGTH = 1.0
+
+
+def run_features(parameters, shards=1):
+    """Feature vector of a run from its simulation_parameters"""
+    energy = parameters["energy"]
+    return np.array([
+        1.0,
+        np.log(parameters["num_events"]),
+        np.log(energy / 1e6),
+        np.log(SYMBOLS.index(parameters["element"]) + 1),
+        np.log(max(energy / parameters["energy_interval"], 1)),
+        np.log(shards),
+    ])
+
+
+def record_runtime(parameters, shards, seconds, path=RUNTIMES_PATH):
+    """Append a finished run, one JSON object per line"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    record = {"parameters": parameters, "shards": shards, "seconds": seconds, "time": time.time()}
+    with open(path, "a") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def read_runtimes(path=RUNTIMES_PATH):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class CostModel:
+    """Predicted runtime [s] of a run, log-linear ridge regression towards PRIOR_WEIGHTS.
+    Each backend gets its own fit, the surrogate and TRIM scale differently."""
+
+    def __init__(self, records=(), backend="srim"):
+        records = [
+            record for record in records
+            if record["parameters"].get("backend", "srim") == backend and record["seconds"] > 0
+            # Runs stopped before any ion finished say nothing about the cost per ion
+            and record["parameters"]["num_events"] > 0
+        ]
+        self.num_records = len(records)
+        self.weights = PRIOR_WEIGHTS.copy()
+        if records:
+            features = np.array([run_features(record["parameters"], record["shards"]) for record in records])
+            log_seconds = np.log([record["seconds"] for record in records])
+            regularization = PRIOR_STRENGTH * np.eye(len(FEATURES))
+            self.weights = np.linalg.solve(
+                features.T @ features + regularization,
+                features.T @ log_seconds + regularization @ PRIOR_WEIGHTS,
+            )
+
+    @classmethod
+    def load(cls, backend="srim", path=RUNTIMES_PATH):
+        return cls(read_runtimes(path), backend)
+
+    def predict(self, parameters, shards=1):
+        return float(np.exp(run_features(parameters, shards) @ self.weights))
+
+
+def longest_first(costs):
+    """Indices of costs in descending order, the order to submit jobs to a worker pool in"""
+    return sorted(range(len(costs)), key=lambda index: -costs[index])
+
+
+def makespan(costs, workers):
+    """Finish time of the last job when every job goes to the first free worker in order"""
+    finish_times = [0.0] * max(1, min(workers, len(costs)))
+    for cost in costs:
+        heapq.heapreplace(finish_times, finish_times[0] + cost)
+    return max(finish_times)
+
+
+def main():
+    parser = ArgumentParser(description="Fit the runtime model to the recorded runs")
+    parser.add_argument("-b", "--backend", type=str, default="srim")
+    args = parser.parse_args()
+
+    records = read_runtimes()
+    model = CostModel(records, args.backend)
+    print(f"{model.num_records} recorded {args.backend} runs")
+    for feature, weight in zip(FEATURES, model.weights):
+        print(f"{feature:<14} {weight:+.3f}")
+    for record in records[-10:]:
+        if record["parameters"].get("backend", "srim") == args.backend:
+            parameters = record["parameters"]
+            print(
+                f"{parameters['element']}{parameters['mass']} {parameters['energy'] / 1e6:g} MeV "
+                f"x{parameters['num_events']}: {record['seconds']:.1f} s, "
+                f"predicted {model.predict(parameters, record['shards']):.1f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Warm TRIM workers that take one run after the other.
+
+TRIM itself reads TRIM.IN once and exits, so a worker is a shell kept open with pexpect in a
+SRIM sandbox of its own. Every job writes TRIM.IN there and starts TRIM from that shell. The
+sandbox copy, the shell and, on Linux, the wineserver are set up once per worker instead of
+once per run, which is most of the time of a short run such as He4 at 5.4 MeV with a few ions.
+Works the same with the stand-in TRIM of stand_in_trim.py.
+"""
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+import os
+import queue
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+from timeit import default_timer as timer
+import pexpect
+from srim import Ion, Layer, Target, TRIM
+from config import SRIM_EXECUTABLE_DIRECTORY
+from sandbox import clone_srim_directory, srim_sandbox
+from srim_outputs import DEFAULT_OUTPUTS, load_outputs
+from watchdog import trim_command, write_trim_input
+
+# Printed by the worker shell after every job, with TRIM's exit code. Written as two quoted
+# halves in the command, so an echo of the command line never matches.
+SENTINEL = "__TRIM_DONE__"
+SENTINEL_PATTERN = SENTINEL + r" (-?\d+)"
+# Seconds the wineserver stays up after its last client, so the next job finds it running
+WINESERVER_PERSIST = 600
+
+
+class TrimWorker:
+    """A shell in its own copy of srim_directory that runs TRIM for every job"""
+
+    def __init__(self, srim_directory=SRIM_EXECUTABLE_DIRECTORY, parent_directory=None):
+        self.directory = tempfile.mkdtemp(prefix="srim-session-", dir=parent_directory)
+        clone_srim_directory(srim_directory, self.directory)
+        self.command = " ".join(shlex.quote(part) for part in trim_command())
+        self.jobs = 0
+        self.shell = None
+        self.start()
+
+    def start(self):
+        env = dict(os.environ, WINEDEBUG="-all")
+        self.shell = pexpect.spawn("/bin/sh", cwd=self.directory, env=env, encoding="utf-8", echo=False, timeout=None)
+        # No pause before every command, pexpect's default is tuned for interactive prompts
+        self.shell.delaybeforesend = None
+        if shutil.which("wineserver"):
+            self.execute(f"wineserver -p{WINESERVER_PERSIST}")
+
+    def execute(self, command, timeout=None):
+        """Run a command in the shell and return its exit code"""
+        half = len(SENTINEL) // 2
+        self.shell.sendline(f"{command}; printf '%s %d\\n' '{SENTINEL[:half]}''{SENTINEL[half:]}' $?")
+        self.shell.expect(SENTINEL_PATTERN, timeout=timeout)
+        return int(self.shell.match.group(1))
+
+    def run(self, trim, timeout=None, outputs=DEFAULT_OUTPUTS):
+        """Run a pysrim TRIM and return the SrimOutputs in `outputs`. The EXYZ file is left in
+        SRIM Outputs and has to be moved away before the next job, see exyz_moved. A job over
+        `timeout` seconds restarts the shell and raises TimeoutError."""
+        write_trim_input(trim, self.directory)
+        exyz_path = os.path.join(self.directory, "SRIM Outputs", "EXYZ.txt")
+        if os.path.isfile(exyz_path):
+            os.remove(exyz_path)
+        try:
+            returncode = self.execute(self.command, timeout)
+        except pexpect.TIMEOUT:
+            self.restart()
+            raise TimeoutError(f"TRIM did not finish within {timeout} s")
+        except pexpect.EOF:
+            self.restart()
+            raise RuntimeError("The TRIM worker shell exited")
+        self.jobs += 1
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, self.command)
+        return load_outputs(self.directory, outputs)
+
+    def restart(self):
+        self.shell.close(force=True)
+        self.start()
+
+    def close(self):
+        if self.shell is not None:
+            self.shell.sendline("exit")
+            self.shell.close(force=True)
+            self.shell = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TrimSession:
+    """Up to num_workers warm TrimWorkers, started on first use and kept until close()"""
+
+    def __init__(self, srim_directory=SRIM_EXECUTABLE_DIRECTORY, num_workers=1, parent_directory=None):
+        self.srim_directory = srim_directory
+        self.num_workers = num_workers
+        self.parent_directory = parent_directory
+        self.workers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def worker(self):
+        """Borrow a worker, a new one while there are fewer than num_workers, else the next idle one"""
+        with self.lock:
+            if self.idle.empty() and len(self.workers) < self.num_workers:
+                self.workers.append(TrimWorker(self.srim_directory, self.parent_directory))
+                self.idle.put(self.workers[-1])
+        worker = self.idle.get()
+        try:
+            yield worker
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.close()
+            self.workers.clear()
+            self.idle = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Session of every process by SRIM directory, e.g. each worker process of simulate_all
+_sessions = {}
+
+
+def trim_session(srim_directory=SRIM_EXECUTABLE_DIRECTORY):
+    """The process-wide session of srim_directory, closed when the process exits"""
+    if srim_directory not in _sessions:
+        _sessions[srim_directory] = TrimSession(srim_directory)
+        # Unlike atexit, also run when a worker process of a ProcessPoolExecutor exits
+        Finalize(_sessions[srim_directory], _sessions[srim_directory].close, exitpriority=10)
+    return _sessions[srim_directory]
+
+
+def main():
+    parser = ArgumentParser(description="Time short TRIM runs in fresh sandboxes against a warm session")
+    parser.add_argument("-i", "--isotope", type=str, default="He-4")
+    parser.add_argument("-E", "--energy", type=float, default=5.4e6)
+    parser.add_argument("-N", "--num_events", type=int, default=1)
+    parser.add_argument("-x", "--energy_interval", type=float, default=1e4)
+    parser.add_argument("-r", "--runs", type=int, default=5)
+    parser.add_argument("-d", "--srim_directory", type=str, default=SRIM_EXECUTABLE_DIRECTORY)
+    args = parser.parse_args()
+
+    element, mass = args.isotope.split("-")
+    target = Target([Layer.from_formula("CF4", density=0.001764, phase=1, width=10000.0e06)])
+
+    def new_trim():
+        ion = Ion(element, args.energy, int(mass))
+        return TRIM(target, ion, number_ions=args.num_events, calculation=1, exyz=args.energy_interval)
+
+    start = timer()
+    for _ in range(args.runs):
+        with srim_sandbox(args.srim_directory) as sandbox_directory:
+            new_trim().run(sandbox_directory)
+    fresh = (timer() - start) / args.runs
+
+    with TrimSession(args.srim_directory) as session:
+        start = timer()
+        for _ in range(args.runs):
+            with session.worker() as worker:
+                worker.run(new_trim())
+        warm = (timer() - start) / args.runs
+    print(f"{args.runs} runs of {args.isotope} {args.energy / 1e6:g} MeV x{args.num_events}: "
+          f"{fresh:.2f} s per run in fresh sandboxes, {warm:.2f} s in a warm session")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,13 +8,46 @@ import pickle
 import shutil
 import datetime
 import time
-import subprocess
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice, repeat
+import random
+import tempfile
+from types import SimpleNamespace
 import pandas as pd
-from config import PICKLE_DIR, SRIM_EXECUTABLE_DIRECTORY
+import glob
+import hashlib
+import inspect
+import json
+from config import DATA_DIR, PICKLE_DIR, RESULTS_DIR, SRIM_EXECUTABLE_DIRECTORY
+from cache import LazyArrays, save_sidecar
+from store import ExyzStore
+from sandbox import srim_sandbox
+from pipeline import Pipeline
+from scheduler import CostModel, longest_first, makespan, record_runtime
+from transfer import remote_transfer_queue
+from follow import PRINT_INTERVAL, ExyzFollower, FollowThread
+from watchdog import Watchdog, call_trim, salvage_exyz
+from srim_outputs import DEFAULT_OUTPUTS, EXYZ_NAMES, SrimOutputs, exyz_moved, load_outputs
+from session import trim_session
+from convergence import DEFAULT_BATCH_SIZE, RunningCurve, StoppingRule
+from tuning import DEFAULT_TOLERANCE, PILOT_EVENTS, find_tuning, record_tuning, reference_interval, tune
+from surrogate import SurrogateTarget, ionization_profile, simulate_tracks, write_exyz
+from events import BraggEvents
+from exyz import load_exyz, read_exyz, move_exyz_file, merge_exyz_files, compute_dedx, pad_tails, bragg_curves
+
+# "srim" runs TRIM, "surrogate" the in-process Monte Carlo model of surrogate.py. Its ranges
+# are within 5% of SRIM, but its Bragg curves of heavy ions such as Sr80 are off by about 30%
+BACKENDS = ("srim", "surrogate")
 
 
 class Simulation:
-    def __init__(self, element, mass, energy, num_events, energy_interval, scp_to_remote=False, **kwargs):
+    def __init__(self, element, mass, energy, num_events, energy_interval, scp_to_remote=False,
+                 srim_directory=SRIM_EXECUTABLE_DIRECTORY, store_exyz=True, shards=1, backend="srim", transfer=None,
+                 precision=None, batch_size=DEFAULT_BATCH_SIZE, follow=False, timeout=None, stall_timeout=None,
+                 session=None, outputs=DEFAULT_OUTPUTS, **kwargs):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
         self.element = element
         self.mass = mass
         self.energy = energy
@@ -24,94 +57,401 @@ class Simulation:
         self.num_events = num_events
         self.energy_interval = energy_interval
 
+        self.backend = backend
+        self.parameters = simulation_parameters(
+            element, mass, energy, num_events, energy_interval, backend=backend, precision=precision,
+            batch_size=batch_size, **kwargs
+        )
+        self.target_kwargs = kwargs
         self.target = self.setup_target(**kwargs)
         self.ion = Ion(self.element, self.total_energy, self.mass)
-
-        self.srim_executable_directory = SRIM_EXECUTABLE_DIRECTORY
-        self.scp_to_remote = scp_to_remote
-        self.remote_exyz_dir = "~/kandidatarbete/Kod/kod/DataFiles"
-        self.remote_username = "jakonil"
+        # Number of TRIM processes the events are split over
+        self.shards = min(shards, num_events)
+        # With a precision, ions are run in batches until the mean Bragg curve has converged,
+        # num_events is then the most that are run, see convergence.py
+        self.precision = precision
+        self.batch_size = batch_size
+        # Report progress while TRIM runs, from the EXYZ file it is writing, see follow.py
+        self.follow = follow
+        # With either timeout [s] TRIM runs under a Watchdog, a run it stops keeps its finished ions
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        # TrimSession whose warm workers run TRIM, True for the one of this process, see session.py
+        self.session = trim_session(srim_directory) if session is True else session
+        # SRIM outputs parsed after a TRIM run, "range" adds RANGE.txt, see srim_outputs.py
+        self.outputs = tuple(outputs)
+
+        self.srim_executable_directory = srim_directory
+        # Parallel workers leave the store to the parent process
+        self.store_exyz = store_exyz
+        # TransferQueue the EXYZ file is handed to after the run
+        self.transfer = remote_transfer_queue() if scp_to_remote and transfer is None else transfer
 
     def setup_target(self, material="CF4", density=0.001764, phase=1, width=10000.0e06):
         layer = Layer.from_formula(material, density=density, phase=phase, width=width)
         target = Target([layer])
         return target
 
-    def european_fix(self):
-        source_path = os.path.join(self.srim_executable_directory, "SRIM Outputs/EXYZ.txt")
-        with open(source_path, 'r') as file:
-            contents = file.read()
-            contents = contents.replace(',', '.')
-        with open(source_path, 'w') as file:
-            file.write(contents)
-
-
-    def move_exyz_file(self):
-        source_path = os.path.join(self.srim_executable_directory, "SRIM Outputs/EXYZ.txt")
-        time_stamp = str(datetime.datetime.now())[:-10].replace(" ", "_").replace(":", "")
+    def move_exyz_file(self, source_path=None):
+        """Move EXYZ.txt, by default TRIM's, into DataFiles, fixing european decimal separators on the way"""
+        if source_path is None:
+            source_path = os.path.join(self.srim_executable_directory, "SRIM Outputs/EXYZ.txt")
+        # Seconds in the time stamp so two runs in the same minute don't overwrite each other
+        time_stamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
         new_file_name = f"EXYZ_{self.id}_{time_stamp}.txt"
         self.exyz_file_name = new_file_name
         destination_path = os.path.join("DataFiles", new_file_name)
-        shutil.copy(source_path, destination_path)
+        move_exyz_file(source_path, destination_path)
+        if self.store_exyz:
+            ExyzStore().ingest(destination_path)
         return destination_path
 
-    def scp_exyz_file(self, source_path):
-        remote_host = "remote11.chalmers.se"
-        remote_ip = f"{self.remote_username}@{remote_host}"
-        command = f"scp {source_path} {remote_ip}:{self.remote_exyz_dir}"
-        result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-                text=True,
+    def run(self):
+        return self.finish(*self.run_backend())
+
+    @property
+    def uses_session(self):
+        """Whether TRIM runs on a session worker, sharded and supervised runs use srim_directory"""
+        return (
+            self.backend == "srim" and self.session is not None and self.shards == 1
+            and self.timeout is None and self.stall_timeout is None
         )
-        if result.returncode == 0:
-            print("File transferred successfully!")
-        else:
-            print(f"An error occurred: {result.stderr}")
 
-    def run(self):
-        sim_result = SimulationResult(self.isotope, self.total_energy, self.num_events)
-        trim = TRIM(
-            self.target, self.ion, number_ions=self.num_events, calculation=1, exyz=self.energy_interval
+    def run_backend(self, staging_directory=None):
+        """Run TRIM, or the surrogate, and move the EXYZ file out of the way of the next run,
+        into staging_directory or SRIM Outputs. Returns the result and the EXYZ file for finish()."""
+        if self.precision is not None:
+            return self.run_batches(staging_directory)
+        if self.backend == "surrogate":
+            return self.run_surrogate()
+        if self.uses_session:
+            return self.run_in_session(staging_directory)
+        result = self.run_shards() if self.shards > 1 else self.run_trim()
+        return result, exyz_moved(result, self.stage_exyz_file(staging_directory))
+
+    def stage_exyz_file(self, directory=None, srim_directory=None):
+        output_directory = os.path.join(srim_directory or self.srim_executable_directory, "SRIM Outputs")
+        file_descriptor, staged_path = tempfile.mkstemp(
+            prefix=".EXYZ-", suffix=".txt", dir=directory or output_directory
         )
-        result = trim.run(self.srim_executable_directory)
-        # Fix european decimal separator
-        self.european_fix()
+        os.close(file_descriptor)
+        shutil.move(os.path.join(output_directory, "EXYZ.txt"), staged_path)
+        return staged_path
+
+    def finish(self, result, exyz_path):
+        """Move the EXYZ file into DataFiles and collect the SimulationResult"""
+        sim_result = SimulationResult(self.isotope, self.total_energy, self.num_events)
+        sim_result.parameters = self.parameters
+        sim_result.convergence = getattr(result, "convergence", None)
+        if sim_result.convergence is not None:
+            sim_result.num_events = sim_result.convergence["num_events"]
+        sim_result.partial = getattr(result, "partial", None)
+        if sim_result.partial is not None:
+            sim_result.num_events = sim_result.partial["num_events"]
 
         # Move exyz file to DataFiles
-        source_path = self.move_exyz_file()
+        source_path = exyz_moved(result, self.move_exyz_file(exyz_path))
 
         # Add exyz file to sim_result
         sim_result.add_exyz_file(self.exyz_file_name)
 
-        # Move exyz file to remote machine
-        if self.scp_to_remote:
-            self.scp_exyz_file(source_path)
+        # Send exyz file to the remote machine in the background
+        if self.transfer is not None:
+            self.transfer.put(source_path)
 
         sim_result.add_result(result)
         return sim_result
 
+    def run_trim(self, **settings):
+        trim = TRIM(
+            self.target, self.ion, number_ions=self.num_events, calculation=1, exyz=self.energy_interval,
+            **settings
+        )
+        if self.timeout is not None or self.stall_timeout is not None:
+            return self.run_supervised(trim)
+        if not self.follow:
+            call_trim(trim, self.srim_executable_directory)
+            return load_outputs(self.srim_executable_directory, self.outputs)
+        follower = ExyzFollower(
+            os.path.join(self.srim_executable_directory, "SRIM Outputs/EXYZ.txt"), self.num_events
+        )
+        thread = FollowThread(follower, label=f"{self.id}: ")
+        thread.start()
+        try:
+            call_trim(trim, self.srim_executable_directory)
+        finally:
+            thread.stop()
+        return load_outputs(self.srim_executable_directory, self.outputs)
+
+    def run_in_session(self, staging_directory=None):
+        """Run TRIM on a warm worker of self.session. The EXYZ file is staged in DataFiles by
+        default, the worker's SRIM Outputs are the next job's."""
+        trim = TRIM(self.target, self.ion, number_ions=self.num_events, calculation=1, exyz=self.energy_interval)
+        with self.session.worker() as worker:
+            result = worker.run(trim, outputs=self.outputs)
+            return result, exyz_moved(result, self.stage_exyz_file(staging_directory or DATA_DIR, worker.directory))
+
+    def run_supervised(self, trim):
+        """Run TRIM under a Watchdog. When it had to be stopped, or crashed, the complete ions of
+        EXYZ.txt are kept and the result is rebuilt from them and flagged partial, also when
+        there are none, so that the other runs of a campaign go on."""
+        watchdog = Watchdog(
+            self.timeout, self.stall_timeout, print_interval=PRINT_INTERVAL if self.follow else None,
+            label=f"{self.id}: ",
+        )
+        report = watchdog.run(trim, self.srim_executable_directory, self.num_events)
+        if report.finished:
+            return load_outputs(self.srim_executable_directory, self.outputs)
+        exyz_path = os.path.join(self.srim_executable_directory, "SRIM Outputs/EXYZ.txt")
+        rows = salvage_exyz(exyz_path, self.num_events) if os.path.isfile(exyz_path) else None
+        if rows is None:
+            # TRIM stopped before it wrote the header, the run is kept with no ions
+            rows = np.empty((0, len(STORED_OUTPUTS["exyz"])))
+            write_exyz(exyz_path, self.element, self.mass, self.energy, self.energy_interval, rows)
+        num_events = len(np.unique(rows[:, 0]))
+        print(f"{self.id}: {report.reason}, salvaged {num_events} of {self.num_events} ions")
+        result = exyz_result(rows, num_events)
+        result.partial = {
+            "reason": report.reason, "num_events": num_events, "requested": self.num_events,
+            "seconds": report.seconds,
+        }
+        return result
+
+    def run_shards(self):
+        """Split the events over self.shards concurrent TRIM runs with distinct random seeds.
+        The EXYZ files are merged into SRIM Outputs/EXYZ.txt and the results combined,
+        so the rest of run() works as for a single TRIM run."""
+        shard_sizes = [len(shard) for shard in np.array_split(np.arange(self.num_events), self.shards)]
+        seeds = random.sample(range(1, 100001), len(shard_sizes))
+        output_directory = os.path.join(self.srim_executable_directory, "SRIM Outputs")
+        shard_directory = tempfile.mkdtemp(dir=output_directory, prefix=".shards-")
+        shard_paths = [os.path.join(shard_directory, f"EXYZ_{index}.txt") for index in range(len(shard_sizes))]
+        arguments = (
+            self.element, self.mass, self.energy, self.energy_interval,
+            self.srim_executable_directory, self.target_kwargs, (self.timeout, self.stall_timeout), self.outputs,
+        )
+        try:
+            with ProcessPoolExecutor(max_workers=len(shard_sizes)) as executor:
+                results = list(executor.map(run_shard, repeat(arguments), shard_sizes, seeds, shard_paths))
+            merge_exyz_files(shard_paths, os.path.join(output_directory, "EXYZ.txt"))
+            # Before the shard EXYZ files are gone, the results may still read them
+            return merge_srim_results(results)
+        finally:
+            shutil.rmtree(shard_directory, ignore_errors=True)
+
+    def run_batches(self, staging_directory=None):
+        """Run batches of batch_size ions until the StoppingRule is met, each batch a run of
+        its own with a new random seed. The EXYZ files are merged and the results combined like
+        run_shards does, the result gets the convergence report of the mean Bragg curve."""
+        batch_directory = tempfile.mkdtemp(dir=staging_directory or DATA_DIR, prefix=".batches-")
+        rule = StoppingRule(self.precision, self.num_events)
+        curve, results, exyz_paths = None, [], []
+        try:
+            while curve is None or not rule.done(curve):
+                num_events = min(self.batch_size, self.num_events - (curve.count if curve else 0))
+                batch = Simulation(
+                    self.element, self.mass, self.energy, num_events, self.energy_interval,
+                    srim_directory=self.srim_executable_directory, shards=self.shards, backend=self.backend,
+                    follow=self.follow, timeout=self.timeout, stall_timeout=self.stall_timeout, session=self.session,
+                    outputs=self.outputs, **self.target_kwargs
+                )
+                result, exyz_path = batch.run_backend(batch_directory)
+                exyz_paths.append(exyz_moved(
+                    result, shutil.move(exyz_path, os.path.join(batch_directory, f"EXYZ_{len(results)}.txt"))
+                ))
+                results.append(result)
+                exyz_data = read_exyz(exyz_paths[-1])
+                if exyz_data.num_ions:
+                    curve = curve or RunningCurve.for_batch(exyz_data)
+                    curve.add(exyz_data)
+                    print(f"{self.id}: {curve.count} ions, standard error {curve.relative_error():.2%} of the peak")
+                if hasattr(result, "partial"):
+                    # Stopped by the watchdog, later batches would likely fare no better
+                    break
+            file_descriptor, merged_path = tempfile.mkstemp(
+                prefix=".EXYZ-", suffix=".txt", dir=staging_directory or DATA_DIR
+            )
+            os.close(file_descriptor)
+            merge_exyz_files(exyz_paths, merged_path)
+            result = merge_srim_results(results)
+        finally:
+            shutil.rmtree(batch_directory, ignore_errors=True)
+        # None when the first batch was stopped before any ion finished
+        result.convergence = curve.report(self.precision) if curve is not None else None
+        return result, merged_path
+
+    def run_surrogate(self):
+        """Simulate in process with the Monte Carlo model in surrogate.py instead of TRIM.
+        Returns a result with the columns save_sim_result keeps and the path of the EXYZ file."""
+        parameters = self.parameters
+        target = SurrogateTarget.from_formula(parameters["material"], parameters["density"])
+        rows = simulate_tracks(
+            self.ion.atomic_number, self.mass, self.energy, self.num_events, self.energy_interval, target
+        )
+        file_descriptor, exyz_path = tempfile.mkstemp(prefix=".EXYZ-", suffix=".txt", dir="DataFiles")
+        os.close(file_descriptor)
+        write_exyz(exyz_path, self.element, self.mass, self.energy, self.energy_interval, rows)
+        return exyz_result(rows, self.num_events), exyz_path
+
     def __str__(self):
         return f"{self.element = }, {self.energy = }, {self.num_events = }, {self.target = }"
 
 
+def exyz_result(rows, num_ions):
+    """A result with the columns save_sim_result keeps from raw EXYZ rows alone, IONIZ is
+    binned from them like surrogate.ionization_profile does"""
+    depth, ions, recoils = ionization_profile(rows, num_ions)
+    return SimpleNamespace(
+        ioniz=SimpleNamespace(depth=depth, ions=ions, recoils=recoils, num_ions=num_ions),
+        exyz=SimpleNamespace(**dict(zip(STORED_OUTPUTS["exyz"], rows.T))),
+    )
+
+
+def run_shard(arguments, num_events, seed, shard_path):
+    """Worker of Simulation.run_shards, runs one shard in a SRIM sandbox"""
+    element, mass, energy, energy_interval, srim_directory, target_kwargs, (timeout, stall_timeout), outputs = arguments
+    with srim_sandbox(srim_directory) as sandbox_directory:
+        sim = Simulation(
+            element, mass, energy, num_events, energy_interval, srim_directory=sandbox_directory,
+            timeout=timeout, stall_timeout=stall_timeout, outputs=outputs, **target_kwargs
+        )
+        result = sim.run_trim(random_seed=seed)
+        move_exyz_file(os.path.join(sandbox_directory, "SRIM Outputs/EXYZ.txt"), shard_path)
+    exyz_moved(result, shard_path)
+    return result
+
+
+def merge_srim_results(results):
+    """Combine the results of shards into one result with the columns save_sim_result keeps.
+    IONIZ and RANGE are per ion, so they are averaged weighted by the number of ions. EXYZ
+    columns are concatenated with the ions renumbered like merge_exyz_files does."""
+    num_ions = np.array([result.ioniz.num_ions for result in results], dtype=float)
+    # Runs salvaged without ions have zero weight, as long as one has ions
+    weights = num_ions if num_ions.sum() else None
+    merged = SimpleNamespace(ioniz=SimpleNamespace(
+        depth=np.asarray(results[0].ioniz.depth),
+        ions=np.average([result.ioniz.ions for result in results], axis=0, weights=weights),
+        recoils=np.average([result.ioniz.recoils for result in results], axis=0, weights=weights),
+        num_ions=int(num_ions.sum()),
+    ))
+    range_outputs = [getattr(result, "range", None) for result in results]
+    if all(range_output is not None for range_output in range_outputs):
+        merged.range = SimpleNamespace(
+            depth=np.asarray(range_outputs[0].depth),
+            **{name: np.average([getattr(output, name) for output in range_outputs], axis=0, weights=weights)
+               for name in ("ions", "elements")},
+            num_ions=merged.ioniz.num_ions,
+        )
+    exyz_outputs = [getattr(result, "exyz", None) for result in results]
+    if all(exyz is not None for exyz in exyz_outputs):
+        names = [name for name in STORED_OUTPUTS["exyz"] if all(hasattr(exyz, name) for exyz in exyz_outputs)]
+        columns = {name: [np.asarray(getattr(exyz, name)) for exyz in exyz_outputs] for name in names}
+        if "ion_number" in columns:
+            ion_numbers, first_ion = [], 1
+            for ion_number in columns["ion_number"]:
+                if len(ion_number):
+                    ion_number = ion_number - ion_number[0] + first_ion
+                    first_ion += len(np.unique(ion_number))
+                ion_numbers.append(ion_number)
+            columns["ion_number"] = ion_numbers
+        merged.exyz = SimpleNamespace(**{name: np.concatenate(arrays) for name, arrays in columns.items()})
+    partials = [getattr(result, "partial", None) for result in results]
+    if any(partials):
+        merged.partial = {
+            "reason": next(partial["reason"] for partial in partials if partial),
+            "num_events": merged.ioniz.num_ions,
+            "requested": sum(
+                partial["requested"] if partial else result.ioniz.num_ions
+                for result, partial in zip(results, partials)
+            ),
+            "seconds": max(partial["seconds"] for partial in partials if partial),
+        }
+    return merged
+
+
+def view_nbytes(view):
+    """Bytes held by the arrays of a derived view"""
+    if hasattr(view, "nbytes"):
+        return view.nbytes
+    if isinstance(view, dict):
+        return sum(view_nbytes(value) for value in view.values())
+    if isinstance(view, (list, tuple)):
+        return sum(view_nbytes(value) for value in view)
+    if hasattr(view, "__dict__"):
+        return view_nbytes(vars(view))
+    return 0
+
+
 class SimulationResult:
-    def __init__(self, isotope, total_energy, num_events):
+    # Default bound on the memory held by cached views, None for no bound
+    max_cache_bytes = None
+
+    def __init__(self, isotope, total_energy, num_events, max_cache_bytes=None):
         self.isotope = isotope
         self.total_energy = total_energy
         self.num_events = num_events
         self.id = f"{self.isotope}-{self.total_energy / 1e6}MeV"
         self.label = f"SRIM-{self.id}"
         self.pickle_path = f"{PICKLE_DIR}/{self.id}.pickle"
+        if max_cache_bytes is not None:
+            self.max_cache_bytes = max_cache_bytes
 
         self.results = []
+        # How energy_interval was chosen, see tuning.py, None when it was given
+        self.tuning = None
+        # Achieved precision of the mean Bragg curve, see convergence.py, None for a fixed num_events
+        self.convergence = None
+        # Why and after how many ions a supervised run was stopped early, None for a complete run
+        self.partial = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_views", None)
+        return state
+
+    @property
+    def views(self) -> OrderedDict:
+        """Derived views by key, least recently used first. Not set on unpickled results
+        until first use."""
+        if "_views" not in self.__dict__:
+            self._views = OrderedDict()
+        return self._views
+
+    def cached_view(self, key, build):
+        """The view `key`, built by `build()` on a miss. The least recently used views
+        are dropped while the cache holds more than max_cache_bytes."""
+        if key in self.views:
+            self.views.move_to_end(key)
+            return self.views[key][0]
+        view = build()
+        self.views[key] = (view, view_nbytes(view))
+        if self.max_cache_bytes is not None:
+            while len(self.views) > 1 and self.cache_nbytes() > self.max_cache_bytes:
+                self.views.popitem(last=False)
+        return view
+
+    def cache_nbytes(self):
+        return sum(nbytes for _, nbytes in self.views.values())
+
+    def invalidate(self):
+        """Drop all derived views, called whenever the inputs change"""
+        self.views.clear()
 
     def add_exyz_file(self, file_name):
         self.exyz_file_name = file_name
+        self.invalidate()
+
+    @property
+    def exyz_file_path(self):
+        return f"DataFiles/{self.exyz_file_name}"
+
+    @property
+    def result_path(self):
+        return result_directory(self.id, getattr(self, "parameters", None))
 
     def add_result(self, result):
         self.results.append(result)
+        self.invalidate()
 
     @staticmethod
     def normalize_units(bragg_event, energy_factor, distance_factor):
@@ -121,6 +461,9 @@ class SimulationResult:
         }
 
     def get_ioniz_data(self):
+        return self.cached_view("ioniz", self.build_ioniz_data)
+
+    def build_ioniz_data(self):
         bragg_data = []
         for result in self.results:
             ioniz = result.ioniz
@@ -128,9 +471,12 @@ class SimulationResult:
             dE_values = ioniz.recoils + ioniz.ions
             bragg_event = {"x_values": x_values, "dE_values": dE_values}
             bragg_data.append(self.normalize_units(bragg_event, 1e6, 1e8))
-        return bragg_data
+        return BraggEvents.from_events(bragg_data)
 
     def get_exyz_data(self):
+        return self.cached_view("exyz", self.build_exyz_data)
+
+    def build_exyz_data(self):
         bragg_data = []
         for result in self.results:
             exyz = result.exyz
@@ -138,110 +484,493 @@ class SimulationResult:
             dE_values = -np.ediff1d(exyz.energy) / np.ediff1d(exyz.depth)
             bragg_event = {"x_values": x_values, "dE_values": dE_values}
             bragg_data.append(self.normalize_units(bragg_event, 1e3, 1e8))
-        return bragg_data
+        return BraggEvents.from_events(bragg_data)
     
     def plot(self, ax, num_events=1, exyz=False, ioniz=True):
+        # EXYZ events are streamed, only the batch of the first num_events ions is read
         data = {'ioniz': self.get_ioniz_data() if ioniz else None, 
-                'exyz': self.get_exyz_data2() if exyz else None}
+                'exyz': self.iter_exyz_data() if exyz else None}
         for _type, events in data.items():
             if events is None:
                 continue
-            for event in events[:num_events]:
+            for event in islice(events, num_events):
                 ax.plot(event["x_values"], event["dE_values"], label=f"{self.label}-{_type}")
     
     def read_exyz_file(self):
-        """In progress, should probably not finish this"""
-        exyz_file_path = f"DataFiles/{self.exyz_file_name}"
-        angstrom_to_cm_factor = 1e-8
-        keV_to_MeV_factor = 1e-3
-        df = pd.read_csv(
-            exyz_file_path,
-            sep="\s+",
-            header=None,
-            names=[
-                "Ion Number",
-                "Energy",
-                "Depth",
-                "Y",
-                "Z",
-                "Electronic Stop.",
-                "Recoil Energy",
-            ],
-            engine="python",
-            skiprows=15,
-            converters={
-                "Ion Number": lambda x: int(x.replace(",", ".")),
-                "Energy": lambda x: float(x.replace(",", "."))*keV_to_MeV_factor,
-                "Depth": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
-                "Y": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
-                "Z": lambda x: float(x.replace(",", "."))*angstrom_to_cm_factor,
-                "Electronic Stop.": lambda x: float(x.replace(",", "."))/angstrom_to_cm_factor,
-                "Recoil Energy": lambda x: float(x.replace(",", ".")),
-            },
-        )
-        df_group = df.groupby(["Ion Number"])
-
-        def modify_data(df: pd.DataFrame):
-            df["dE"] = df["Energy"].diff()
-            df["dx"] = df["Depth"].diff()
-            df['dE/dx'] = -df['dE']/df['dx']
-            return df
-        
-        def extend_data(df: pd.DataFrame):
-            df_ext = pd.DataFrame()
-            tail_length = 20
-            dEdx_tail = pd.DataFrame(np.zeros((tail_length, 1)), columns=['dE/dx'])
-            extended_dEdx = pd.concat([df['dE/dx'], dEdx_tail['dE/dx']], ignore_index=True)
-            df_ext['dE/dx'] = extended_dEdx
-            last_depth = df['Depth'].iloc[-1]
-            depth_tail = pd.DataFrame(np.linspace(last_depth, last_depth + tail_length*df['dx'].mean(), tail_length), columns=['Depth'])
-            df_ext['Depth'] = pd.concat([df['Depth'], depth_tail['Depth']], ignore_index=True)
-            return df_ext
-        
-        ion_dfs = [extend_data(modify_data(df_group.get_group(ion))) for ion in df_group.groups]
-        return ion_dfs
+        """dE/dx of all ions in one DataFrame, each ion padded with a tail of zeros"""
+        exyz_data = load_exyz(self.exyz_file_path)
+        dE, dx, dE_dx = compute_dedx(exyz_data.energy, exyz_data.depth, exyz_data.ion_offsets)
+        depth, dE_dx, offsets = pad_tails(exyz_data.depth, dE_dx, dx, exyz_data.ion_offsets)
+        ion_numbers = exyz_data.ion_number[exyz_data.ion_offsets[:-1]]
+        return pd.DataFrame({
+            "Ion Number": np.repeat(ion_numbers, np.diff(offsets)),
+            "Depth": depth,
+            "dE/dx": dE_dx,
+        })
 
     def get_exyz_data2(self):
-        bragg_data = []
-        ion_dfs = self.read_exyz_file()
-        for ion_df in ion_dfs:
-            x_values = ion_df["Depth"].values[1:]
-            dE_values = ion_df["dE/dx"].values[1:]
-            bragg_event = {"x_values": x_values, "dE_values": dE_values}
-            bragg_data.append(bragg_event)
-        return bragg_data
-    
-def simulate(element, mass, energy, num_events, energy_interval, **kwargs):
+        return self.cached_view("exyz2", lambda: BraggEvents(*bragg_curves(load_exyz(self.exyz_file_path))))
+
+    def iter_bragg_batches(self, max_rows=1 << 20):
+        """BraggEvents of consecutive ions of the EXYZ file with about max_rows rows each. The
+        columns are memory-mapped, so only the batch at hand is held in memory."""
+        for exyz_batch in load_exyz(self.exyz_file_path).iter_batches(max_rows):
+            yield BraggEvents(*bragg_curves(exyz_batch))
+
+    def iter_exyz_data(self, max_rows=1 << 20):
+        """The Bragg events of get_exyz_data2 one ion at a time, in constant memory"""
+        for events in self.iter_bragg_batches(max_rows):
+            yield from events
+
+    def get_ion_tracks(self):
+        """IonTrack of every ion in the EXYZ file, one at a time"""
+        yield from load_exyz(self.exyz_file_path).iter_ions()
+
+    def get_average_exyz_data(self, bins=None):
+        """Mean dE/dx per depth bin over all ions, accumulated without keeping the ions in memory"""
+        bins = np.linspace(0, 50, 101) if bins is None else np.asarray(bins, dtype=float)
+        return self.cached_view(("average", tuple(bins)), lambda: self.build_average_exyz_data(bins))
+
+    def build_average_exyz_data(self, bins):
+        dE_sum = np.zeros(len(bins) - 1)
+        counts = np.zeros(len(bins) - 1)
+        for events in self.iter_bragg_batches():
+            batch_sum, batch_counts = events.histogram(bins)
+            dE_sum += batch_sum
+            counts += batch_counts
+        with np.errstate(invalid="ignore"):
+            dE_mean = dE_sum / counts
+        depth = (bins[:-1] + bins[1:]) / 2
+        return depth, dE_mean
+
+def simulation_parameters(element, mass, energy, num_events, energy_interval, backend="srim", precision=None,
+                          batch_size=DEFAULT_BATCH_SIZE, **kwargs):
+    """Canonical parameter set of a simulation with the target defaults filled in"""
+    target = inspect.signature(Simulation.setup_target).parameters
+    unknown = set(kwargs) - set(target)
+    if unknown:
+        raise TypeError(f"Unknown simulation parameters {sorted(unknown)}")
+    target = {name: kwargs.get(name, target[name].default) for name in target if name != "self"}
+    parameters = {
+        "element": str(element),
+        "mass": int(mass),
+        "energy": float(energy),
+        "num_events": int(num_events),
+        "energy_interval": float(energy_interval),
+        "material": str(target["material"]),
+        "density": float(target["density"]),
+        "phase": int(target["phase"]),
+        "width": float(target["width"]),
+    }
+    # Only other backends are recorded, so results saved before there was a choice keep their key
+    if backend != "srim":
+        parameters["backend"] = backend
+    if precision is not None:
+        parameters["precision"] = float(precision)
+        parameters["batch_size"] = int(batch_size)
+    return parameters
+
+
+def parameter_key(parameters):
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def result_directory(sim_id, parameters=None):
+    """Results with known parameters are keyed by them, so different targets or
+    intervals for the same isotope and energy don't overwrite each other"""
+    if parameters is None:
+        return os.path.join(RESULTS_DIR, sim_id)
+    return os.path.join(RESULTS_DIR, f"{sim_id}_{parameter_key(parameters)}")
+
+
+# Result cache lookups of simulate() in this process
+cache_stats = {"hits": 0, "misses": 0}
+
+
+def load_cached_result(parameters, outputs=DEFAULT_OUTPUTS):
+    """The saved result of an identical simulation with all of `outputs`, or None"""
+    sim_id = f"{parameters['element']}{parameters['mass']}-{parameters['energy'] / 1e6}MeV"
+    result_path = result_directory(sim_id, parameters)
+    if not os.path.isfile(os.path.join(result_path, "meta.json")):
+        return None
+    sim_result = load_sim_result(result_path)
+    if sim_result.parameters != parameters:
+        return None
+    if not all(hasattr(result, output) for result in sim_result.results for output in outputs):
+        # Saved without RANGE, which is asked for now
+        return None
+    if getattr(sim_result, "partial", None) is not None:
+        # Run the simulation again, the partial one is overwritten once it completes
+        return None
+    if hasattr(sim_result, "exyz_file_name") and not os.path.isfile(sim_result.exyz_file_path):
+        return None
+    return sim_result
+
+
+def simulate(element, mass, energy, num_events, energy_interval, use_cache=True,
+             srim_directory=SRIM_EXECUTABLE_DIRECTORY, store_exyz=True, shards=1, backend="srim", transfer=None,
+             scp_to_remote=False, tolerance=DEFAULT_TOLERANCE, precision=None, batch_size=DEFAULT_BATCH_SIZE,
+             follow=False, timeout=None, stall_timeout=None, session=None, outputs=DEFAULT_OUTPUTS, **kwargs):
+    """Run TRIM, or the surrogate model with backend="surrogate", or with `use_cache`
+    return the saved result of an identical earlier run. A new EXYZ file is put on the
+    `transfer` queue, or with `scp_to_remote` on the one of remote_transfer_queue.
+    energy_interval="auto" tunes it on a pilot run to `tolerance`, the tuning is kept as
+    sim_result.tuning. With a `precision` ions are run in batches until
+    the mean Bragg curve has converged, but at most num_events, see Simulation.run_batches.
+    `follow` prints the progress of TRIM while it runs. With a `timeout` or `stall_timeout`
+    [s] TRIM is stopped when it runs too long or hangs, and the result of the ions it had
+    finished is flagged sim_result.partial, see watchdog.py. `session` runs TRIM on warm
+    workers, a TrimSession or True for the one of this process, see session.py. `outputs`
+    are the SRIM outputs kept, add "range" for RANGE.txt, see srim_outputs.py."""
     # kwargs can be material, density, phase and width
-    sim = Simulation(element, mass, energy, num_events, energy_interval, **kwargs)
+    tuning = None
+    if energy_interval == "auto":
+        tuning = tune_energy_interval(
+            element, mass, energy, tolerance, use_cache=use_cache, srim_directory=srim_directory,
+            backend=backend, **kwargs
+        )
+        energy_interval = tuning["energy_interval"]
+    parameters = simulation_parameters(
+        element, mass, energy, num_events, energy_interval, backend, precision, batch_size, **kwargs
+    )
+    if use_cache:
+        sim_result = load_cached_result(parameters, outputs)
+        if sim_result is not None:
+            cache_stats["hits"] += 1
+            print(f"Cache hit for {sim_result.id}: {sim_result.result_path}")
+            return sim_result
+        cache_stats["misses"] += 1
+        print(f"Cache miss for {element}{mass}-{energy / 1e6}MeV, running {backend}")
+    sim = Simulation(
+        element, mass, energy, num_events, energy_interval,
+        scp_to_remote=scp_to_remote, srim_directory=srim_directory, store_exyz=store_exyz, shards=shards,
+        backend=backend, transfer=transfer, precision=precision, batch_size=batch_size, follow=follow,
+        timeout=timeout, stall_timeout=stall_timeout, session=session, outputs=outputs, **kwargs
+    )
     sim_result: SimulationResult = sim.run()
+    sim_result.tuning = tuning
+    print(f"Finished {sim_result.id}{run_summary(sim_result)}")
     save_sim_result(sim_result)
     return sim_result
 
 
-def simulate_all(isotopes: list, energies: list, num_events: int, energy_interval: int, **kwargs):
-    simulation_dataset = {}
+def run_summary(sim_result):
+    """Achieved precision of a run with a precision and why a partial run stopped, for printing after its id"""
+    summary = ""
+    convergence = getattr(sim_result, "convergence", None)
+    if convergence is not None:
+        status = "converged" if convergence["converged"] else f"not converged to {convergence['precision']:.2%}"
+        summary += (
+            f", {convergence['num_events']} ions, standard error {convergence['achieved']:.2%} "
+            f"of the peak ({status})"
+        )
+    partial = getattr(sim_result, "partial", None)
+    if partial is not None:
+        summary += f", partial: {partial['reason']}, {partial['num_events']} of {partial['requested']} ions"
+    return summary
+
+
+def stored_outputs(result):
+    """Only the columns save_sim_result keeps of a result, cheap to send between processes.
+    SrimOutputs already are, their EXYZ columns are only read from the file by the receiver."""
+    if isinstance(result, SrimOutputs):
+        return result
+    outputs = {}
+    for output, names in STORED_OUTPUTS.items():
+        srim_output = getattr(result, output, None)
+        if srim_output is not None:
+            outputs[output] = SimpleNamespace(**{
+                name: np.asarray(getattr(srim_output, name)) for name in names if hasattr(srim_output, name)
+            })
+    for name in ("convergence", "partial"):
+        if hasattr(result, name):
+            outputs[name] = getattr(result, name)
+    return SimpleNamespace(**outputs)
+
+
+def run_in_sandbox(element, mass, energy, num_events, energy_interval, staging_directory,
+                   srim_directory=SRIM_EXECUTABLE_DIRECTORY, backend="srim", **kwargs):
+    """Worker of simulate_all, runs TRIM in a private copy of the SRIM directory. Returns the
+    stored outputs, the EXYZ file, moved to staging_directory before the sandbox is removed,
+    and the runtime in seconds."""
+    start = timer()
+    sim = Simulation(
+        element, mass, energy, num_events, energy_interval, srim_directory=srim_directory, backend=backend, **kwargs
+    )
+    if backend != "srim" or sim.uses_session:
+        # The surrogate needs no SRIM directory, session workers have sandboxes of their own
+        result, exyz_path = sim.run_backend(staging_directory)
+        return stored_outputs(result), exyz_path, timer() - start
+    with srim_sandbox(srim_directory) as sandbox_directory:
+        sim.srim_executable_directory = sandbox_directory
+        result, exyz_path = sim.run_backend(staging_directory)
+    return stored_outputs(result), exyz_path, timer() - start
+
+
+def run_pilot(element, mass, energy, tolerance=DEFAULT_TOLERANCE, pilot_events=PILOT_EVENTS,
+              srim_directory=SRIM_EXECUTABLE_DIRECTORY, backend="srim", **kwargs):
+    """Run a short pilot at the reference interval and tune energy_interval on it, see tuning.py.
+    The pilot's EXYZ file is deleted afterwards."""
+    pilot_interval = reference_interval(energy)
+    with tempfile.TemporaryDirectory(dir=DATA_DIR, prefix=".pilot-") as staging_directory:
+        _, exyz_path, seconds = run_in_sandbox(
+            element, mass, energy, pilot_events, pilot_interval, staging_directory,
+            srim_directory=srim_directory, backend=backend, **kwargs
+        )
+        try:
+            tuning = tune(read_exyz(exyz_path), tolerance)
+        finally:
+            os.remove(exyz_path)
+    tuning["pilot_seconds"] = seconds
+    return tuning
+
+
+def tune_energy_interval(element, mass, energy, tolerance=DEFAULT_TOLERANCE, pilot_events=PILOT_EVENTS,
+                         use_cache=True, srim_directory=SRIM_EXECUTABLE_DIRECTORY, backend="srim", **kwargs):
+    """The tuning of energy_interval for a run, from an earlier identical pilot with `use_cache`"""
+    pilot = simulation_parameters(element, mass, energy, pilot_events, reference_interval(energy), backend, **kwargs)
+    tuning = find_tuning(pilot, tolerance) if use_cache else None
+    if tuning is None:
+        tuning = run_pilot(element, mass, energy, tolerance, pilot_events, srim_directory, backend, **kwargs)
+        record_tuning(pilot, tuning)
+    print(f"energy_interval {tuning['energy_interval']:g} eV for {element}{mass}-{energy / 1e6}MeV")
+    return tuning
+
+
+def simulate_all(isotopes: list, energies: list, num_events: int, energy_interval: int,
+                 jobs=1, use_cache=True, srim_directory=SRIM_EXECUTABLE_DIRECTORY, shards=1, backend="srim",
+                 transfer=None, scp_to_remote=False, queue_size=4, tolerance=DEFAULT_TOLERANCE, precision=None,
+                 batch_size=DEFAULT_BATCH_SIZE, follow=False, timeout=None, stall_timeout=None, session=False,
+                 outputs=DEFAULT_OUTPUTS, **kwargs):
+    """Simulate every isotope at its energy. The TRIM runs are spread over `jobs` processes,
+    each in its own SRIM sandbox. With shards > 1 each run is also
+    split over that many TRIM processes. backend="surrogate" skips TRIM, see surrogate.py.
+
+    The runs are submitted longest first, by the runtimes CostModel predicts from earlier
+    runs, and every runtime is recorded for the next prediction. They feed a pipeline: while
+    the next TRIM run goes, finished ones are converted into DataFiles, parsed, saved and put
+    on the `transfer` queue, or with `scp_to_remote` on the one of remote_transfer_queue, by
+    background stages connected by queues of queue_size. The throughput of every stage and
+    the predicted and actual makespan are printed at the end.
+
+    energy_interval="auto" tunes the interval of every run on a pilot first, see
+    tune_energy_interval, with the pilots spread over the `jobs` processes too. With a
+    `precision` every run stops once its mean Bragg curve has converged, and with `follow`
+    the workers print the progress of their TRIM runs. A run stopped by `timeout` or
+    `stall_timeout` keeps its finished ions and the campaign goes on, see simulate. With
+    `session` every worker process keeps a warm TRIM worker for all the runs it gets. The
+    workers send back the parsed tables of `outputs` and the EXYZ file, whose columns are
+    parsed in the persist stage."""
+    transfer = remote_transfer_queue() if scp_to_remote and transfer is None else transfer
+    runs = []
     for isotope, energy in zip(isotopes, energies):
         element, mass = isotope.split("-")
         mass = int(mass)
         energy_per_nucleon = energy / mass
         if energy_per_nucleon < 1e6 or energy_per_nucleon > 30e6:
             raise Exception(f"Non-realistic {energy = } for {isotope = }")
-        sim_result: SimulationResult = simulate(
-            element, mass, energy, num_events, energy_interval, **kwargs
-        )
-        simulation_dataset[sim_result.id] = sim_result
+        runs.append((element, mass, energy))
+
+    tunings = {}
+    if energy_interval == "auto":
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                run: executor.submit(
+                    tune_energy_interval, *run, tolerance, use_cache=use_cache, srim_directory=srim_directory,
+                    backend=backend, **kwargs
+                )
+                for run in dict.fromkeys(runs)
+            }
+            try:
+                tunings = {run: future.result() for run, future in futures.items()}
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    simulation_dataset = {}
+    pending = {}
+    for run in runs:
+        interval = tunings[run]["energy_interval"] if tunings else energy_interval
+        parameters = simulation_parameters(*run, num_events, interval, backend, precision, batch_size, **kwargs)
+        sim_result = load_cached_result(parameters, outputs) if use_cache else None
+        if sim_result is not None:
+            cache_stats["hits"] += 1
+            print(f"Cache hit for {sim_result.id}: {sim_result.result_path}")
+            simulation_dataset[sim_result.id] = sim_result
+        else:
+            # The same run twice in one call is only simulated once
+            pending[parameter_key(parameters)] = parameters
+    cache_stats["misses"] += len(pending) if use_cache else 0
+    if not pending:
+        return simulation_dataset
+
+    settings = dict(
+        srim_directory=srim_directory, shards=shards, backend=backend, precision=precision, batch_size=batch_size,
+        follow=follow, timeout=timeout, stall_timeout=stall_timeout, session=session or None, outputs=outputs,
+        **kwargs
+    )
+    cost_model = CostModel.load(backend)
+    runs = list(pending.values())
+    predicted_costs = [cost_model.predict(parameters, shards) for parameters in runs]
+    runs = [runs[index] for index in longest_first(predicted_costs)]
+    makespans = {"predicted": makespan(sorted(predicted_costs, reverse=True), jobs)}
+
+    def run_simulations():
+        """Yield (Simulation, result, EXYZ file) as runs finish. TRIM always runs in worker
+        processes, pysrim changes the working directory under the other stages otherwise."""
+        start = timer()
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Only `jobs` runs are submitted at a time, in order, the next one as one finishes.
+            # The pool hands more than that to its workers ahead, and those can't be cancelled.
+            queued, futures = iter(runs), {}
+
+            def submit_next():
+                for parameters in islice(queued, 1):
+                    futures[executor.submit(
+                        run_in_sandbox, parameters["element"], parameters["mass"], parameters["energy"],
+                        num_events, parameters["energy_interval"], staging_directory, **settings
+                    )] = parameters
+
+            for _ in range(jobs):
+                submit_next()
+            try:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        parameters = futures.pop(future)
+                        result, exyz_path, seconds = future.result()
+                        submit_next()
+                        completed = getattr(result, "partial", None) or getattr(result, "convergence", None)
+                        # A converged or partial run took its actual number of ions, not num_events
+                        record_runtime(
+                            dict(parameters, num_events=completed["num_events"]) if completed else parameters,
+                            shards, seconds,
+                        )
+                        makespans["actual"] = timer() - start
+                        sim = Simulation(
+                            parameters["element"], parameters["mass"], parameters["energy"], num_events,
+                            parameters["energy_interval"], **settings
+                        )
+                        yield sim, result, exyz_path
+            finally:
+                # On an error, or a stage that failed and closed this generator, only the runs
+                # already going are waited for
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def convert(item):
+        sim, result, exyz_path = item
+        sim_result = sim.finish(result, exyz_path)
+        sim_result.tuning = tunings.get((sim.element, sim.mass, sim.energy))
+        print(f"Finished {sim_result.id}{run_summary(sim_result)}")
+        return sim_result
+
+    def parse(sim_result):
+        # Builds the EXYZ sidecar, later reads are memory-mapped
+        load_exyz(sim_result.exyz_file_path)
+        return sim_result
+
+    def persist(sim_result):
+        save_sim_result(sim_result)
+        return sim_result
+
+    def send(sim_result):
+        transfer.put(sim_result.exyz_file_path)
+        return sim_result
+
+    stages = [("convert", convert), ("parse", parse), ("persist", persist)]
+    if transfer is not None:
+        stages.append(("transfer", send))
+    pipeline = Pipeline(stages, queue_size)
+    staging_directory = tempfile.mkdtemp(dir=DATA_DIR, prefix=".staging-")
+    try:
+        for sim_result in pipeline.run(run_simulations(), name="simulate"):
+            simulation_dataset[sim_result.id] = sim_result
+    finally:
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        print(pipeline.report())
+    print(
+        f"Makespan {makespans['actual']:.1f} s, predicted {makespans['predicted']:.1f} s "
+        f"from {cost_model.num_records} recorded runs"
+    )
     return simulation_dataset
 
 
+RESULT_FORMAT_VERSION = 1
+# Columns kept of each SRIM output, RANGE only when it was asked for, see srim_outputs.py
+STORED_OUTPUTS = {
+    "ioniz": ["depth", "ions", "recoils"],
+    "exyz": EXYZ_NAMES,
+    "range": ["depth", "ions", "elements"],
+}
+
+
+class StoredResults:
+    """The columns of the SRIM outputs of a saved result, memory-mapped on first access, and
+    the paths of the run's table files as SrimOutputs had them"""
+
+    def __init__(self, directory, outputs, index, paths=None):
+        for output, names in outputs.items():
+            setattr(self, output, LazyArrays(directory, names, prefix=f"{index}-{output}-"))
+        self.paths = dict(paths or {})
+
+
 def save_sim_result(sim_result: SimulationResult):
-    with open(sim_result.pickle_path, "wb") as f:
-        pickle.dump(sim_result, f)
+    """Save as a directory with meta.json and one .npy file per column"""
+    arrays, outputs = {}, []
+    for index, result in enumerate(sim_result.results):
+        outputs.append({})
+        for output, names in STORED_OUTPUTS.items():
+            srim_output = getattr(result, output, None)
+            if srim_output is None:
+                continue
+            outputs[-1][output] = [name for name in names if hasattr(srim_output, name)]
+            for name in outputs[-1][output]:
+                arrays[f"{index}-{output}-{name}"] = np.asarray(getattr(srim_output, name))
+    meta = {
+        "format_version": RESULT_FORMAT_VERSION,
+        "isotope": sim_result.isotope,
+        "total_energy": sim_result.total_energy,
+        "num_events": sim_result.num_events,
+        "exyz_file_name": getattr(sim_result, "exyz_file_name", None),
+        # Table files of each run, see SrimOutputs.paths, only there until the SRIM directory is reused
+        "paths": [dict(getattr(result, "paths", {})) for result in sim_result.results],
+        "parameters": getattr(sim_result, "parameters", None),
+        "tuning": getattr(sim_result, "tuning", None),
+        "convergence": getattr(sim_result, "convergence", None),
+        "partial": getattr(sim_result, "partial", None),
+        "results": outputs,
+    }
+    save_sidecar(sim_result.result_path, arrays, meta, replace=True)
+    return sim_result.result_path
+
+
+def load_sim_result(result_path):
+    """Load a result saved by save_sim_result without reading any arrays.
+    Old .pickle files are still unpickled as before."""
+    if result_path.endswith(".pickle"):
+        with open(result_path, "rb") as f:
+            return pickle.load(f)
+    with open(os.path.join(result_path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["format_version"] > RESULT_FORMAT_VERSION:
+        raise ValueError(f"{result_path} has format version {meta['format_version']}, "
+                         f"this version reads up to {RESULT_FORMAT_VERSION}")
+    sim_result = SimulationResult(meta["isotope"], meta["total_energy"], meta["num_events"])
+    sim_result.parameters = meta.get("parameters")
+    sim_result.tuning = meta.get("tuning")
+    sim_result.convergence = meta.get("convergence")
+    sim_result.partial = meta.get("partial")
+    if meta["exyz_file_name"] is not None:
+        sim_result.add_exyz_file(meta["exyz_file_name"])
+    paths = meta.get("paths") or [{}] * len(meta["results"])
+    for index, (outputs, result_paths) in enumerate(zip(meta["results"], paths)):
+        sim_result.add_result(StoredResults(result_path, outputs, index, result_paths))
+    return sim_result
 
 
-def load_sim_result(pickle_path):
-    with open(pickle_path, "rb") as f:
-        return pickle.load(f)
+def convert_pickles(pickle_dir=PICKLE_DIR):
+    """Save every old pickled result in the new format"""
+    for pickle_path in sorted(glob.glob(os.path.join(pickle_dir, "*.pickle"))):
+        print(f"{pickle_path} -> {save_sim_result(load_sim_result(pickle_path))}")
 
 
 def main():
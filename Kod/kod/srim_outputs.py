@@ -0,0 +1,167 @@
+"""Lean loader for the TRIM outputs SimulationResult reads.
+
+pysrim's Results parses all six tables of a run with regular expressions and genfromtxt, while
+only IONIZ and EXYZ are ever used. SrimOutputs parses IONIZ.txt, EXYZ.txt and, when asked for,
+RANGE.txt in one go with NumPy, each on first access. The other tables are only referenced by
+path. The attributes match pysrim's, so both work wherever a result is read.
+"""
+from argparse import ArgumentParser
+from functools import cached_property
+import os
+import re
+from timeit import default_timer as timer
+from types import SimpleNamespace
+import numpy as np
+from srim.output import Results
+from exyz import complete_rows, parse_exyz_block, split_exyz_header
+
+# Output tables of a TRIM run by the name of their pysrim Results attribute
+TABLE_FILES = {
+    "ioniz": "IONIZ.txt",
+    "vacancy": "VACANCY.txt",
+    "novac": "NOVAC.txt",
+    "etorecoils": "E2RECOIL.txt",
+    "phonons": "PHONON.txt",
+    "range": "RANGE.txt",
+}
+# Outputs SrimOutputs can parse, and those SimulationResult needs
+OUTPUTS = ("ioniz", "exyz", "range")
+DEFAULT_OUTPUTS = ("ioniz", "exyz")
+# Names of the raw EXYZ columns, as save_sim_result keeps them
+EXYZ_NAMES = ["ion_number", "energy", "depth", "y", "z", "electronic_stop", "recoil_energy_loss"]
+# SRIM tables have 100 depth bins, pysrim reads no more
+TABLE_ROWS = 100
+NUM_IONS_REGEX = re.compile(rb"Total Ions calculated\s*=\s*(\d+(?:[.,]\d+)?)")
+# e.g. "-----------  ----------  ----------", the last one starts the table
+TABLE_RULE_REGEX = re.compile(rb"(?m)^[ \t]*-+(?:[ \t]+-+)+[ \t]*\r?$")
+
+
+def parse_num_ions(output: bytes):
+    match = NUM_IONS_REGEX.search(output)
+    if match is None:
+        raise ValueError("No 'Total Ions calculated' in SRIM output")
+    # Rounded down like pysrim does
+    return int(float(match.group(1).replace(b",", b".")))
+
+
+def parse_table(output: bytes, max_rows=TABLE_ROWS):
+    """Rows of the table of a SRIM output file in raw SRIM units, shape (rows, columns)"""
+    rules = list(TABLE_RULE_REGEX.finditer(output))
+    if not rules:
+        raise ValueError("No table in SRIM output")
+    block = output[rules[-1].end():]
+    if b"," in block:
+        block = block.replace(b",", b".")
+    lines = [line for line in block.splitlines() if line.strip()][:max_rows]
+    if not lines:
+        raise ValueError("SRIM output table is empty")
+    num_columns = len(lines[0].split())
+    values = np.array(b" ".join(lines).split(), dtype=np.float64)
+    if values.size != len(lines) * num_columns:
+        raise ValueError(f"SRIM output table has rows of different lengths, expected {num_columns} columns")
+    return values.reshape(-1, num_columns)
+
+
+def read_table(file_path, max_rows=TABLE_ROWS):
+    """num_ions and the table rows of a SRIM output file"""
+    with open(file_path, "rb") as file:
+        output = file.read()
+    try:
+        return parse_num_ions(output), parse_table(output, max_rows)
+    except ValueError as error:
+        raise ValueError(f"{file_path}: {error}") from None
+
+
+def read_ioniz(file_path):
+    """IONIZ.txt: depth [A] and the ionization by ions and by recoils [eV/A] per ion"""
+    num_ions, rows = read_table(file_path)
+    return SimpleNamespace(depth=rows[:, 0], ions=rows[:, 1], recoils=rows[:, 2], num_ions=num_ions)
+
+
+def read_range(file_path):
+    """RANGE.txt: depth [A], the final distribution of the ions and of each target element
+    [(atoms/cm3)/(atoms/cm2)]"""
+    num_ions, rows = read_table(file_path)
+    return SimpleNamespace(depth=rows[:, 0], ions=rows[:, 1], elements=rows[:, 2:], num_ions=num_ions)
+
+
+def read_exyz_columns(file_path):
+    """The columns of an EXYZ file in raw SRIM units, named as save_sim_result keeps them"""
+    with open(file_path, "rb") as file:
+        _, block = split_exyz_header(file.read())
+    rows = parse_exyz_block(complete_rows(block))
+    return SimpleNamespace(**dict(zip(EXYZ_NAMES, rows.T)))
+
+
+class SrimOutputs:
+    """The outputs of the TRIM run in `directory` that are in `outputs`, each parsed on first
+    access, None for the others. EXYZ is read from exyz_path, keep it pointed at the file when
+    that is moved, see exyz_moved. Every table file of the run is referenced in `paths`, valid
+    until the directory is reused by the next run."""
+
+    def __init__(self, directory, outputs=DEFAULT_OUTPUTS, exyz_path=None):
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f"Unknown SRIM outputs {sorted(unknown)}, expected some of {OUTPUTS}")
+        self.directory = os.path.abspath(directory)
+        self.outputs = tuple(outputs)
+        self.exyz_path = os.path.abspath(exyz_path or os.path.join(self.directory, "SRIM Outputs", "EXYZ.txt"))
+        self.paths = {
+            name: os.path.join(self.directory, file_name) for name, file_name in TABLE_FILES.items()
+            if os.path.isfile(os.path.join(self.directory, file_name))
+        }
+
+    @cached_property
+    def ioniz(self):
+        return read_ioniz(os.path.join(self.directory, TABLE_FILES["ioniz"])) if "ioniz" in self.outputs else None
+
+    @cached_property
+    def range(self):
+        return read_range(os.path.join(self.directory, TABLE_FILES["range"])) if "range" in self.outputs else None
+
+    @cached_property
+    def exyz(self):
+        return read_exyz_columns(self.exyz_path) if "exyz" in self.outputs else None
+
+    def load_tables(self):
+        """Parse the requested tables now, before the next run overwrites them. EXYZ stays
+        lazy, the file is moved out of the way of the next run instead."""
+        for output in self.outputs:
+            if output != "exyz":
+                getattr(self, output)
+        return self
+
+
+def load_outputs(directory, outputs=DEFAULT_OUTPUTS):
+    """SrimOutputs of the run that just finished in directory, with its tables parsed"""
+    return SrimOutputs(directory, outputs).load_tables()
+
+
+def exyz_moved(result, exyz_path):
+    """Point a SrimOutputs at its EXYZ file after the file was moved, other results carry
+    their EXYZ columns. Returns exyz_path."""
+    if isinstance(result, SrimOutputs):
+        result.exyz_path = os.path.abspath(exyz_path)
+    return exyz_path
+
+
+def main():
+    parser = ArgumentParser(description="Time the lean loader against pysrim's Results on a TRIM output directory")
+    parser.add_argument("directory", type=str)
+    parser.add_argument("-r", "--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    start = timer()
+    for _ in range(args.runs):
+        Results(args.directory)
+    pysrim = (timer() - start) / args.runs
+    start = timer()
+    for _ in range(args.runs):
+        outputs = SrimOutputs(args.directory)
+        outputs.ioniz, outputs.exyz
+    lean = (timer() - start) / args.runs
+    print(f"pysrim Results {pysrim * 1e3:.1f} ms, SrimOutputs with IONIZ and EXYZ {lean * 1e3:.1f} ms per load")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Stand-in for TRIM.exe, for testing the simulation pipeline without SRIM.
+
+Reads TRIM.IN in the working directory like TRIM does and writes synthetic
+IONIZ/VACANCY/NOVAC/E2RECOIL/PHONON/RANGE tables and SRIM Outputs/EXYZ.txt.
+STAND_IN_ION_SECONDS in the environment slows it down to that many seconds per ion,
+STAND_IN_HANG_AFTER_IONS makes it hang after that many ions, STAND_IN_EXIT_CODE makes it exit
+with that code once it is done.
+make_stand_in_srim() creates a SRIM directory whose TRIM.exe runs this module.
+"""
+from argparse import ArgumentParser
+import os
+import stat
+import sys
+import time
+import numpy as np
+from archive import ROW_FORMAT
+from surrogate import SYMBOLS, exyz_header
+
+TABLE_FILES = ["IONIZ.txt", "VACANCY.txt", "NOVAC.txt", "E2RECOIL.txt", "PHONON.txt", "RANGE.txt"]
+# Stopping power S = STOPPING_SCALE * Z**2 * mass / (E + mass * BRAGG_PEAK_ENERGY) [eV/A], E in keV,
+# roughly SRIM for light ions in CF4 at 500 mbar
+STOPPING_SCALE = 5.25
+BRAGG_PEAK_ENERGY = 25.0
+# Seconds spent on every ion, so EXYZ.txt grows like it does under TRIM
+ION_SECONDS = float(os.environ.get("STAND_IN_ION_SECONDS", 0))
+# Hang halfway through the ion after this many, like TRIM under wine sometimes does, None never
+HANG_AFTER_IONS = int(os.environ["STAND_IN_HANG_AFTER_IONS"]) if "STAND_IN_HANG_AFTER_IONS" in os.environ else None
+# Exit code, TRIM under wine sometimes fails on its way out after all ions
+EXIT_CODE = int(os.environ.get("STAND_IN_EXIT_CODE", 0))
+LAUNCHER = f"""#!{sys.executable}
+import sys
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+from stand_in_trim import main
+main()
+"""
+
+
+def read_trim_input(file_path="TRIM.IN"):
+    with open(file_path, encoding="latin-1") as file:
+        lines = [line.strip() for line in file]
+    settings = {"exyz": 0.0}
+    for header, values in zip(lines[:-1], lines[1:]):
+        if header.startswith("Ion: Z"):
+            z, mass, energy, _, num_ions = values.split()[:5]
+            settings.update(z=int(z), mass=float(mass), energy=float(energy), num_ions=int(num_ions))
+        elif header.startswith("Cascades"):
+            settings["seed"] = int(values.split()[1])
+        elif header.startswith("Diskfiles"):
+            settings["exyz"] = float(values.split()[-1])
+    return settings
+
+
+def stopping(energy, z, mass):
+    return STOPPING_SCALE * z ** 2 * mass / (energy + mass * BRAGG_PEAK_ENERGY)
+
+
+def simulate_ion(rng, z, mass, energy, energy_interval):
+    """Rows (energy [keV], depth, y, z [A], stopping [eV/A], recoil [eV]) of one ion,
+    one row per energy_interval [eV] lost and a last one at energy 0, like SRIM's"""
+    step = energy_interval / 1e3
+    energies = np.append(np.arange(energy, step, -step), 0.0)
+    stopping_powers = stopping(energies, z, mass)
+    dx = step * 1e3 / stopping_powers * rng.normal(1, 0.02, len(energies))
+    depth = np.concatenate([[0], np.cumsum(dx[:-1])])
+    lateral = np.cumsum(rng.normal(0, 1e-3, (2, len(energies))) * np.sqrt(dx), axis=1)
+    lateral[:, 0] = 0
+    recoil = np.where(rng.random(len(energies)) < 0.1, rng.exponential(20, len(energies)), 0)
+    recoil[0] = 0
+    stopping_powers[-1] = 0
+    return np.column_stack([energies, depth, lateral[0], lateral[1], stopping_powers, recoil])
+
+
+def write_exyz(file_path, settings, seed=None):
+    rng = np.random.default_rng(seed)
+    symbol = SYMBOLS[settings["z"] - 1]
+    with open(file_path, "w") as file:
+        file.write(exyz_header(symbol, settings["mass"], settings["energy"], settings["exyz"]))
+        for ion_number in range(1, settings["num_ions"] + 1):
+            rows = simulate_ion(rng, settings["z"], settings["mass"], settings["energy"], settings["exyz"])
+            if HANG_AFTER_IONS is not None and ion_number > HANG_AFTER_IONS:
+                file.write("".join(ROW_FORMAT % (ion_number, *row) + "\n" for row in rows[:len(rows) // 2]))
+                file.flush()
+                while True:
+                    time.sleep(60)
+            file.write("".join(ROW_FORMAT % (ion_number, *row) + "\n" for row in rows))
+            if ION_SECONDS:
+                file.flush()
+                time.sleep(ION_SECONDS)
+
+
+def write_table(file_path, settings, num_rows=100):
+    """A table in the layout pysrim's SRIM_Output parsers expect"""
+    symbol = SYMBOLS[settings["z"] - 1]
+    depth = np.linspace(0, 1e9, num_rows + 1)[1:]
+    values = stopping(np.linspace(settings["energy"], 0, num_rows), settings["z"], settings["mass"])
+    with open(file_path, "w", newline="\r\n") as file:
+        file.write(f" Ion    = {symbol}   Energy = {settings['energy']:.0f} keV\n")
+        file.write(f" Total Ions calculated ={settings['num_ions']:.2f}\n")
+        file.write("=" * 60 + "\n  TARGET     IONIZ.      IONIZ.     IONIZ.\n")
+        file.write("-----------  ----------  ----------  ----------\n")
+        for x, value in zip(depth, values):
+            file.write(f"{x:.5E}  {value:.4E}  {value / 10:.4E}  {value / 100:.4E}\n")
+
+
+def make_stand_in_srim(directory):
+    """A SRIM directory with the stand-in as TRIM.exe"""
+    os.makedirs(os.path.join(directory, "SRIM Outputs"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "Data"), exist_ok=True)
+    trim_path = os.path.join(directory, "TRIM.exe")
+    with open(trim_path, "w") as file:
+        file.write(LAUNCHER)
+    os.chmod(trim_path, os.stat(trim_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return directory
+
+
+def main():
+    parser = ArgumentParser(description="Stand-in for TRIM.exe, run in a SRIM directory")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--make", type=str, default=None, help="create a stand-in SRIM directory here")
+    args = parser.parse_args()
+    if args.make:
+        print(make_stand_in_srim(args.make))
+        return
+
+    settings = read_trim_input()
+    for file_name in TABLE_FILES:
+        write_table(file_name, settings)
+    if settings["exyz"] > 0:
+        seed = settings.get("seed") if args.seed is None else args.seed
+        write_exyz(os.path.join("SRIM Outputs", "EXYZ.txt"), settings, seed)
+    sys.exit(EXIT_CODE)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import datetime
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+from config import DATA_DIR, STORE_DIR
+from cache import file_hash
+from exyz import read_exyz_header
+
+# e.g. EXYZ_Ca40-600.0MeV_2023-04-27_1401.txt
+TIME_STAMP_REGEX = re.compile(r"(\d{4}-\d{2}-\d{2}_\d{4,6})")
+
+
+class ExyzStore:
+    """Content-addressed store for EXYZ files.
+    Every unique file is kept once under objects/<hash>, and any number of readable
+    aliases (isotope, energy, energy interval, time stamp) point to it."""
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, "objects")
+        self.aliases_dir = os.path.join(directory, "aliases")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.aliases_dir, exist_ok=True)
+        self.migrate_aliases()
+
+    def alias_path(self, alias):
+        return os.path.join(self.aliases_dir, f"{alias}.json")
+
+    @property
+    def aliases(self):
+        """{alias: entry}, read from disk so that ingests of other processes are seen"""
+        aliases = {}
+        for file_name in os.listdir(self.aliases_dir):
+            if file_name.endswith(".json") and not file_name.startswith(".tmp-"):
+                with open(os.path.join(self.aliases_dir, file_name)) as file:
+                    aliases[file_name[:-len(".json")]] = json.load(file)
+        return aliases
+
+    def create_alias(self, alias, entry):
+        """Write the entry of a new alias, False if the alias exists already.
+        The entry is written to a temporary file and hard linked into place, which fails
+        atomically when another ingest created the alias first, so no alias is ever lost."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.aliases_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(entry, file, indent=1, sort_keys=True)
+            os.link(tmp_path, self.alias_path(alias))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def migrate_aliases(self):
+        """Move the entries of a single aliases.json, as written by older versions, to alias files"""
+        legacy_path = os.path.join(self.directory, "aliases.json")
+        if not os.path.isfile(legacy_path):
+            return
+        with open(legacy_path) as file:
+            legacy_aliases = json.load(file)
+        for alias, entry in legacy_aliases.items():
+            self.create_alias(alias, entry)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(legacy_path)
+
+    def object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash[:2], f"{content_hash}.txt")
+
+    def path(self, alias):
+        with open(self.alias_path(alias)) as file:
+            return self.object_path(json.load(file)["hash"])
+
+    def find(self, isotope=None, energy=None, energy_interval=None):
+        """Aliases matching the given isotope (e.g. 'Ca40'), energy and interval (eV)"""
+        return sorted(
+            alias for alias, entry in self.aliases.items()
+            if (isotope is None or entry["isotope"] == isotope)
+            and (energy is None or entry["energy"] == energy)
+            and (energy_interval is None or entry["energy_interval"] == energy_interval)
+        )
+
+    @staticmethod
+    def describe(file_path):
+        """Content hash and alias metadata of an EXYZ file"""
+        header = read_exyz_header(file_path)
+        match = TIME_STAMP_REGEX.search(os.path.basename(file_path))
+        if match:
+            time_stamp = match.group(1)
+        else:
+            modified = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
+            time_stamp = modified.strftime("%Y-%m-%d_%H%M%S")
+        return {
+            "hash": file_hash(file_path),
+            "isotope": f"{header.element}{header.mass:.0f}",
+            "energy": header.energy,
+            "energy_interval": header.energy_interval,
+            "time_stamp": time_stamp,
+            "source": os.path.basename(file_path),
+        }
+
+    @staticmethod
+    def alias_name(entry):
+        return (
+            f"EXYZ_{entry['isotope']}-{entry['energy'] / 1e6}MeV"
+            f"_{entry['energy_interval']:.0f}eV_{entry['time_stamp']}"
+        )
+
+    def add_object(self, file_path, content_hash):
+        """Hard link the file into the store, copy only if linking is not possible"""
+        object_path = self.object_path(content_hash)
+        if os.path.exists(object_path):
+            return object_path
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f"{object_path}.tmp-{os.getpid()}"
+        try:
+            os.link(file_path, tmp_path)
+        except OSError:
+            shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, object_path)
+        return object_path
+
+    def add_alias(self, entry):
+        """Register `entry` under a free alias, reusing an existing alias for the same content"""
+        alias = self.alias_name(entry)
+        # Two different runs in the same minute, keep both
+        for name in (alias, f"{alias}_{entry['hash'][:8]}"):
+            if self.create_alias(name, entry):
+                return name
+            with open(self.alias_path(name)) as file:
+                if json.load(file)["hash"] == entry["hash"]:
+                    return name
+        raise ValueError(f"Aliases {alias} and {name} are taken by other files")
+
+    def link_source(self, file_path, content_hash):
+        """Replace a file by a hard link to its stored object, so that duplicates take no space"""
+        object_path = self.object_path(content_hash)
+        if os.path.samefile(file_path, object_path):
+            return
+        tmp_path = f"{file_path}.tmp-{os.getpid()}"
+        try:
+            os.link(object_path, tmp_path)
+        except OSError:
+            # e.g. the store is on another file system
+            return
+        os.replace(tmp_path, file_path)
+
+    def ingest(self, file_path):
+        entry = self.describe(file_path)
+        self.add_object(file_path, entry["hash"])
+        return self.add_alias(entry)
+
+    def ingest_directory(self, directory=DATA_DIR, pattern="EXYZ*.txt", jobs=None, dedupe=True):
+        """Hash and parse the headers of all matching files in parallel, then store each unique
+        payload once. With dedupe, the files are replaced by hard links to their objects, so
+        duplicates in the directory share one copy on disk.
+        Returns {file name: alias}, files that are not EXYZ files are skipped."""
+        file_paths = sorted(glob.glob(os.path.join(directory, pattern)))
+
+        def describe(file_path):
+            try:
+                return self.describe(file_path)
+            except Exception as e:
+                print(f"Skipping {file_path}: {e}")
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            entries = list(executor.map(describe, file_paths))
+
+        ingested = {}
+        for file_path, entry in zip(file_paths, entries):
+            if entry is None:
+                continue
+            self.add_object(file_path, entry["hash"])
+            if dedupe:
+                self.link_source(file_path, entry["hash"])
+            ingested[entry["source"]] = self.add_alias(entry)
+        return ingested
+
+    def summary(self):
+        aliases = self.aliases
+        hashes = {entry["hash"] for entry in aliases.values()}
+        payload_size = sum(os.path.getsize(self.object_path(h)) for h in hashes)
+        return f"{len(aliases)} aliases, {len(hashes)} unique files, {payload_size / 1e6:.1f} MB"
+
+
+def main():
+    parser = ArgumentParser(description="Ingest EXYZ files into the content-addressed store")
+    parser.add_argument("-d", "--directory", type=str, default=DATA_DIR, help="directory to ingest")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of hashing threads")
+    parser.add_argument(
+        "--keep_copies", action="store_true", help="do not replace duplicate files by links to the store"
+    )
+    args = parser.parse_args()
+
+    store = ExyzStore()
+    store.ingest_directory(args.directory, jobs=args.jobs, dedupe=not args.keep_copies)
+    print(store.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+from argparse import ArgumentParser
+from dataclasses import dataclass
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from cache import LazyArrays, file_hash, load_sidecar, save_sidecar
+from config import DATA_DIR, RESULTS_DIR, TABLES_DIR
+from exyz import load_exyz
+from surrogate import SYMBOLS, SurrogateTarget, stopping_power
+
+TABLE_VERSION = 1
+# Log energy grid of every table [MeV per nucleon]
+MIN_ENERGY_PER_NUCLEON = 1e-3
+MAX_ENERGY_PER_NUCLEON = 100.0
+NUM_POINTS = 512
+TABLE_ARRAYS = ["energy", "stopping", "ranges"]
+SOURCES = ("model", "exyz", "ioniz")
+
+
+@dataclass
+class RangeTable:
+    """Electronic stopping power [MeV/cm] and CSDA range [cm] of one ion in one target,
+    tabulated on a log energy grid [MeV]. All lookups are vectorized log-log interpolation."""
+    element: str
+    mass: int
+    material: str
+    density: float
+    source: str
+    energy: np.ndarray
+    stopping: np.ndarray
+    ranges: np.ndarray
+
+    def __post_init__(self):
+        self._log_energy = np.log(self.energy)
+        self._log_stopping = np.log(self.stopping)
+        self._log_ranges = np.log(self.ranges)
+
+    @classmethod
+    def from_stopping(cls, element, mass, material, density, source, energy, stopping):
+        """Integrate the range from stopping powers on an increasing energy grid. Below the
+        grid S ~ sqrt(E), so the range of the first point is 2 E / S."""
+        energy, stopping = np.asarray(energy, dtype=float), np.asarray(stopping, dtype=float)
+        steps = np.diff(energy) * (1 / stopping[1:] + 1 / stopping[:-1]) / 2
+        ranges = 2 * energy[0] / stopping[0] + np.concatenate([[0], np.cumsum(steps)])
+        return cls(element, mass, material, density, source, energy, stopping, ranges)
+
+    @classmethod
+    def from_model(cls, element, mass, material="CF4", density=0.001764):
+        """From the Bethe-Bloch model of surrogate.py"""
+        energy = energy_grid(mass)
+        target = SurrogateTarget.from_formula(material, density)
+        stopping = stopping_power(energy, SYMBOLS.index(element) + 1, mass, target)
+        return cls.from_stopping(element, mass, material, density, "model", energy, stopping)
+
+    @classmethod
+    def from_samples(cls, element, mass, material, density, source, energy, stopping):
+        """From measured (energy [MeV], stopping [MeV/cm]) samples. Their median ratio to the
+        model in every grid bin is interpolated over the grid, so the model only fills in the
+        shape where there are no samples."""
+        model = cls.from_model(element, mass, material, density)
+        energy, stopping = np.asarray(energy, dtype=float), np.asarray(stopping, dtype=float)
+        valid = (energy > 0) & (stopping > 0)
+        bins = np.searchsorted(model.energy, energy[valid])
+        ratios = stopping[valid] / model.stopping_power(energy[valid])
+        covered = np.unique(bins)
+        if not len(covered):
+            raise ValueError(f"No stopping samples for {element}{mass}")
+        median_ratio = [np.median(ratios[bins == index]) for index in covered]
+        ratio = np.interp(model._log_energy, model._log_energy[np.minimum(covered, NUM_POINTS - 1)], median_ratio)
+        return cls.from_stopping(element, mass, material, density, source, model.energy, model.stopping * ratio)
+
+    @classmethod
+    def from_exyz(cls, exyz_data_list, material="CF4", density=0.001764):
+        """From the electronic stopping column of EXYZ files of one ion, see from_samples"""
+        header = exyz_data_list[0].header
+        return cls.from_samples(
+            header.element, int(round(header.mass)), material, density, "exyz",
+            np.concatenate([exyz_data.energy for exyz_data in exyz_data_list]),
+            np.concatenate([exyz_data.stopping for exyz_data in exyz_data_list]),
+        )
+
+    @classmethod
+    def from_ioniz(cls, element, mass, runs, material="CF4", density=0.001764):
+        """From the IONIZ outputs of runs given as (energy [eV], ioniz) pairs. The mean energy at
+        each depth is the initial energy minus the ionization deposited before it, see
+        from_samples. Range straggling smears IONIZ near the Bragg peak, so the lowest energies
+        are least reliable."""
+        energies, stoppings = [], []
+        for energy, ioniz in runs:
+            depth = np.asarray(ioniz.depth) * 1e-8  # cm
+            ionization = (np.asarray(ioniz.ions) + np.asarray(ioniz.recoils)) * 1e2  # MeV/cm
+            widths = np.diff(np.concatenate([[0], depth]))
+            energies.append(energy * 1e-6 - np.cumsum(ionization * widths) + ionization * widths / 2)
+            stoppings.append(ionization)
+        return cls.from_samples(
+            element, mass, material, density, "ioniz", np.concatenate(energies), np.concatenate(stoppings)
+        )
+
+    def stopping_power(self, energy):
+        """Stopping power [MeV/cm] at energy [MeV]"""
+        return np.exp(np.interp(np.log(energy), self._log_energy, self._log_stopping))
+
+    def csda_range(self, energy):
+        """Range [cm] at energy [MeV], 0 at no energy"""
+        energy = np.asarray(energy, dtype=float)
+        with np.errstate(divide="ignore"):
+            ranges = np.exp(np.interp(np.log(energy), self._log_energy, self._log_ranges))
+        return np.where(energy > 0, ranges, 0.0)
+
+    def energy_at_range(self, ranges):
+        """Inverse of csda_range, energy [MeV] of an ion with range [cm]"""
+        ranges = np.asarray(ranges, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            energy = np.exp(np.interp(np.log(ranges), self._log_ranges, self._log_energy))
+        return np.where(ranges > 0, energy, 0.0)
+
+    def residual_energy(self, energy, depth):
+        """Mean energy [MeV] left at depth [cm] of an ion entering with energy [MeV]"""
+        return self.energy_at_range(self.csda_range(energy) - depth)
+
+    def bragg_curve(self, energy, depth):
+        """Mean dE/dx [MeV/cm] at depth [cm], without straggling. Broadcasts, e.g. energies of
+        shape (n, 1) and depths of shape (m,) give n curves."""
+        residual_energy = self.residual_energy(energy, depth)
+        with np.errstate(divide="ignore"):
+            return np.where(residual_energy > 0, self.stopping_power(residual_energy), 0.0)
+
+
+def energy_grid(mass):
+    return np.geomspace(MIN_ENERGY_PER_NUCLEON * mass, MAX_ENERGY_PER_NUCLEON * mass, NUM_POINTS)
+
+
+def exyz_files(element, mass, data_dir=DATA_DIR):
+    """EXYZ files of an ion in data_dir, named by Simulation.move_exyz_file"""
+    return sorted(glob.glob(os.path.join(data_dir, f"EXYZ_{element}{mass}-*.txt")))
+
+
+def ioniz_runs(element, mass, material="CF4", density=0.001764, results_dir=RESULTS_DIR):
+    """(energy [eV], ioniz columns) of the TRIM runs of an ion in a target saved in results_dir
+    by simulation.save_sim_result, and the column files they are read from. Results saved
+    without parameters were simulated in the default target, surrogate runs are left out."""
+    runs, file_paths = [], []
+    for meta_path in sorted(glob.glob(os.path.join(results_dir, f"{element}{mass}-*", "meta.json"))):
+        with open(meta_path) as file:
+            meta = json.load(file)
+        parameters = meta.get("parameters") or {"material": "CF4", "density": 0.001764}
+        if (parameters["material"], parameters["density"]) != (material, density):
+            continue
+        if parameters.get("backend", "srim") != "srim":
+            continue
+        directory = os.path.dirname(meta_path)
+        for index, outputs in enumerate(meta["results"]):
+            if "ioniz" not in outputs:
+                continue
+            prefix = f"{index}-ioniz-"
+            runs.append((meta["total_energy"], LazyArrays(directory, outputs["ioniz"], prefix=prefix)))
+            file_paths += [os.path.join(directory, f"{prefix}{name}.npy") for name in outputs["ioniz"]]
+    return runs, file_paths
+
+
+def table_directory(element, mass, material, density, source, file_paths=()):
+    key = f"{element}{mass}-{material}-{density:g}-{source}-v{TABLE_VERSION}"
+    if file_paths:
+        # Tables from files are rebuilt when the files change
+        hashes = sorted(file_hash(file_path) for file_path in file_paths)
+        key += "-" + hashlib.sha1("".join(hashes).encode()).hexdigest()[:12]
+    return os.path.join(TABLES_DIR, key)
+
+
+# Tables of this process by (element, mass, material, density, source)
+_tables = {}
+
+
+def get_table(element, mass, material="CF4", density=0.001764, source="model") -> RangeTable:
+    """The table of an ion in a target, from memory, TABLES_DIR or built and saved there.
+    source="exyz" uses the EXYZ files of the ion in DataFiles, which were all simulated in
+    the default target, source="ioniz" the IONIZ outputs of the saved results of the ion
+    in the target, see ioniz_runs."""
+    key = (element, int(mass), material, float(density), source)
+    if key in _tables:
+        return _tables[key]
+    if source not in SOURCES:
+        raise ValueError(f"Unknown table source {source!r}")
+    file_paths = ()
+    if source == "exyz":
+        file_paths = exyz_files(element, mass)
+        if not file_paths:
+            raise ValueError(f"No EXYZ files of {element}{mass} in {DATA_DIR}")
+    elif source == "ioniz":
+        runs, file_paths = ioniz_runs(element, mass, material, density)
+        if not runs:
+            raise ValueError(f"No saved results of {element}{mass} in {material} in {RESULTS_DIR}")
+    directory = table_directory(*key, file_paths=file_paths)
+
+    sidecar = load_sidecar(directory)
+    if sidecar is not None:
+        _, arrays = sidecar
+        table = RangeTable(*key, **{name: np.array(arrays[name]) for name in TABLE_ARRAYS})
+    else:
+        if source == "exyz":
+            exyz_data_list = []
+            for file_path in file_paths:
+                try:
+                    exyz_data_list.append(load_exyz(file_path))
+                except ValueError:
+                    # Not a single clean EXYZ file
+                    continue
+            table = RangeTable.from_exyz(exyz_data_list, material, density)
+        elif source == "ioniz":
+            table = RangeTable.from_ioniz(element, mass, runs, material, density)
+        else:
+            table = RangeTable.from_model(element, mass, material, density)
+        save_sidecar(directory, {name: getattr(table, name) for name in TABLE_ARRAYS}, {"files": list(file_paths)})
+    _tables[key] = table
+    return table
+
+
+def main():
+    parser = ArgumentParser(description="Stopping power and range of an ion from cached tables")
+    parser.add_argument("isotope", type=str, help="e.g. Ca-40")
+    parser.add_argument("energies", type=float, nargs="+", help="energies [eV]")
+    parser.add_argument("-m", "--material", type=str, default="CF4")
+    parser.add_argument("-d", "--density", type=float, default=0.001764)
+    parser.add_argument("-s", "--source", type=str, choices=SOURCES, default="model")
+    args = parser.parse_args()
+
+    element, mass = args.isotope.split("-")
+    table = get_table(element, int(mass), args.material, args.density, args.source)
+    energy = np.array(args.energies) * 1e-6
+    for energy, stopping, ion_range in zip(energy, table.stopping_power(energy), table.csda_range(energy)):
+        print(f"{args.isotope} {energy:g} MeV: {stopping:.4g} MeV/cm, range {ion_range:.4g} cm")
+
+
+if __name__ == "__main__":
+    main()
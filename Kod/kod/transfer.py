@@ -0,0 +1,210 @@
+"""Background transfer of finished files, e.g. EXYZ files to the remote machine.
+
+A TransferQueue collects files and a worker thread ships them in batches through a
+backend, so the next simulation does not wait for the copy. Failed batches are retried.
+"""
+from argparse import ArgumentParser
+import atexit
+import gzip
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from archive import ARCHIVE_EXTENSION, write_archive
+
+REMOTE_HOST = "remote11.chalmers.se"
+REMOTE_USERNAME = "jakonil"
+REMOTE_EXYZ_DIR = "~/kandidatarbete/Kod/kod/DataFiles"
+
+
+class LocalDirectoryBackend:
+    """Copies files into a local directory, each published with an atomic rename"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, file_paths):
+        os.makedirs(self.directory, exist_ok=True)
+        for file_path in file_paths:
+            destination_path = os.path.join(self.directory, os.path.basename(file_path))
+            tmp_path = f"{destination_path}.part"
+            shutil.copyfile(file_path, tmp_path)
+            os.replace(tmp_path, destination_path)
+
+    def __str__(self):
+        return self.directory
+
+
+class ScpBackend:
+    """Copies a whole batch with a single scp call"""
+
+    def __init__(self, host=REMOTE_HOST, username=REMOTE_USERNAME, directory=REMOTE_EXYZ_DIR, timeout=600):
+        self.destination = f"{username}@{host}:{directory}"
+        self.timeout = timeout
+
+    def send(self, file_paths):
+        result = subprocess.run(
+            ["scp", "-q", "-B", *file_paths, self.destination],
+            capture_output=True, text=True, timeout=self.timeout,
+        )
+        if result.returncode != 0:
+            raise OSError(f"scp failed: {result.stderr.strip()}")
+
+    def __str__(self):
+        return self.destination
+
+
+def compress_gzip(file_path, directory):
+    destination_path = os.path.join(directory, os.path.basename(file_path) + ".gz")
+    with open(file_path, "rb") as source, gzip.open(destination_path, "wb") as destination:
+        shutil.copyfileobj(source, destination)
+    return destination_path
+
+
+def compress_exyza(file_path, directory):
+    """EXYZ archive, see archive.py. Falls back to gzip for files it can't archive exactly,
+    or that are no EXYZ files at all."""
+    destination_path = os.path.join(directory, os.path.splitext(os.path.basename(file_path))[0] + ARCHIVE_EXTENSION)
+    try:
+        write_archive(file_path, destination_path)
+    except OSError:
+        raise
+    except Exception:
+        # write_archive raises ValueError for rows it can't keep exactly, Exception without a header
+        return compress_gzip(file_path, directory)
+    return destination_path
+
+
+COMPRESSORS = {"gzip": compress_gzip, "exyza": compress_exyza}
+
+
+class TransferQueue:
+    """Ships queued files in the background. A batch is sent once batch_size files are
+    waiting or batch_delay seconds have passed since the first one. A failing batch is
+    retried max_retries times with exponentially growing waits, then given up on and
+    listed in `failed`."""
+
+    def __init__(self, backend, compression=None, batch_size=8, batch_delay=1.0, max_retries=3, retry_delay=2.0):
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression {compression!r}, expected one of {sorted(COMPRESSORS)}")
+        self.backend = backend
+        self.compression = compression
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.sent = []
+        self.failed = []
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, file_path):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker, name="transfer", daemon=True)
+                self.thread.start()
+        self.queue.put(file_path)
+
+    def close(self):
+        """Send everything still queued and stop the worker"""
+        with self.lock:
+            if self.thread is None:
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _next_batch(self):
+        """Block for the first file, then gather more until the batch is full or due.
+        The batch ends with None when the queue was closed."""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_delay
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            closed = batch[-1] is None
+            file_paths = [file_path for file_path in batch if file_path is not None]
+            if file_paths:
+                self._send(file_paths)
+            if closed:
+                return
+
+    def _send(self, file_paths):
+        with tempfile.TemporaryDirectory(prefix="transfer-") as directory:
+            try:
+                if self.compression:
+                    send_paths = [COMPRESSORS[self.compression](file_path, directory) for file_path in file_paths]
+                else:
+                    send_paths = file_paths
+            except Exception as error:
+                # Not only OSError, an exception escaping here would end the worker and drop the queue
+                print(f"Could not prepare {len(file_paths)} files for transfer: {error}")
+                self.failed.extend(file_paths)
+                return
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.backend.send(send_paths)
+                except Exception as error:
+                    # Only errors of the copy itself are worth a retry
+                    retry = isinstance(error, (OSError, subprocess.SubprocessError)) and attempt < self.max_retries
+                    if not retry:
+                        print(f"Transfer of {len(file_paths)} files to {self.backend} failed: {error}")
+                        self.failed.extend(file_paths)
+                        return
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                else:
+                    print(f"Transferred {len(file_paths)} files to {self.backend}")
+                    self.sent.extend(file_paths)
+                    return
+
+
+# Shared queue of Simulation(scp_to_remote=True)
+_remote_queue = None
+
+
+def remote_transfer_queue():
+    """The process-wide queue to the remote machine, flushed when the interpreter exits"""
+    global _remote_queue
+    if _remote_queue is None:
+        _remote_queue = TransferQueue(ScpBackend())
+        atexit.register(_remote_queue.close)
+    return _remote_queue
+
+
+def main():
+    parser = ArgumentParser(description="Send files to the remote machine, or a local directory")
+    parser.add_argument("file_paths", type=str, nargs="+")
+    parser.add_argument("-d", "--directory", type=str, default=None, help="copy to this directory instead")
+    parser.add_argument("-c", "--compression", type=str, choices=sorted(COMPRESSORS), default=None)
+    args = parser.parse_args()
+
+    backend = LocalDirectoryBackend(args.directory) if args.directory else ScpBackend()
+    with TransferQueue(backend, args.compression) as transfer:
+        for file_path in args.file_paths:
+            transfer.put(file_path)
+    if transfer.failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Choice of energy_interval from a pilot run at a fine reference interval.
+
+Every k-th row of each ion of the pilot stands in for a run at k times the interval. The
+coarsest interval whose mean Bragg curve and cluster density stay within the tolerance of
+the pilot's, compared over NUM_BINS = 25 depth bins, is chosen.
+"""
+from argparse import ArgumentParser
+import dataclasses
+import json
+import os
+import time
+import numpy as np
+from config import TUNINGS_PATH
+from events import BraggEvents
+from exyz import ExyzData, bragg_curves, read_exyz
+
+# Rows per ion of the reference pilot
+REFERENCE_POINTS = 1000
+# Intervals tried, in multiples of the reference interval
+COARSENING = (1, 2, 5, 10, 20, 50, 100)
+# Coarser intervals than this many rows per ion are never chosen
+MIN_POINTS = 10
+PILOT_EVENTS = 20
+# Largest deviation from the reference, relative to its peak
+DEFAULT_TOLERANCE = 0.05
+# Wide bins, so that each holds many rows even at the coarsest intervals
+NUM_BINS = 25
+# Mean energy per electron-ion pair in CF4 [eV], Garfield's TrackTrim makes dE / W electrons per cluster
+W_VALUE = 34.0
+
+
+def reference_interval(energy):
+    """Fine interval [eV] of the pilot of an ion with energy [eV]"""
+    return energy / REFERENCE_POINTS
+
+
+def coarsen(exyz_data: ExyzData, factor):
+    """The rows a run at `factor` times the interval would have written, every factor-th row
+    of each ion starting with its first"""
+    lengths = np.diff(exyz_data.ion_offsets)
+    position = np.arange(exyz_data.num_rows) - np.repeat(exyz_data.ion_offsets[:-1], lengths)
+    keep = position % factor == 0
+    header = dataclasses.replace(exyz_data.header, energy_interval=exyz_data.header.energy_interval * factor)
+    columns = {
+        name: getattr(exyz_data, name)[keep]
+        for name in ("ion_number", "energy", "depth", "y", "z", "stopping", "recoil")
+    }
+    return ExyzData(header=header, **columns)
+
+
+def depth_bins(exyz_data: ExyzData, num_bins=NUM_BINS):
+    """Bins [cm] covering all ions of the pilot"""
+    return np.linspace(0, 1.05 * exyz_data.depth.max(), num_bins + 1)
+
+
+def dedx_curve(exyz_data: ExyzData, bins):
+    """Mean dE/dx [MeV/cm] per depth bin"""
+    return BraggEvents(*bragg_curves(exyz_data)).average(bins)[1]
+
+
+def cluster_density(exyz_data: ExyzData, bins):
+    """Electrons per cm per ion in each depth bin. Like TrackTrim every row after the first of
+    an ion is a cluster at the row's depth with the energy lost since the previous row."""
+    energy_loss = -np.diff(exyz_data.energy, prepend=np.nan)
+    energy_loss[exyz_data.ion_offsets[:-1]] = 0
+    electrons = energy_loss * 1e6 / W_VALUE
+    density = np.histogram(exyz_data.depth, bins, weights=electrons)[0]
+    return density / np.diff(bins) / exyz_data.num_ions
+
+
+def deviation(curve, reference):
+    """Largest difference in bins where both are defined, relative to the reference peak"""
+    valid = np.isfinite(curve) & np.isfinite(reference)
+    if not valid.any():
+        return float("inf")
+    return float(np.max(np.abs(curve[valid] - reference[valid])) / np.max(np.abs(reference[valid])))
+
+
+def tune(reference: ExyzData, tolerance=DEFAULT_TOLERANCE, factors=COARSENING, num_bins=NUM_BINS):
+    """Compare coarsened versions of the pilot to it and choose the coarsest interval [eV]
+    for which it and all finer ones stay within tolerance. Returns a dict of the choice and
+    the deviations of every candidate, stored with the result."""
+    header = reference.header
+    bins = depth_bins(reference, num_bins)
+    reference_curves = dedx_curve(reference, bins), cluster_density(reference, bins)
+    chosen = header.energy_interval
+    candidates = []
+    for factor in factors:
+        energy_interval = header.energy_interval * factor
+        if factor > 1 and header.energy / energy_interval < MIN_POINTS:
+            break
+        coarse = coarsen(reference, factor)
+        candidate = {
+            "energy_interval": energy_interval,
+            "dedx_deviation": deviation(dedx_curve(coarse, bins), reference_curves[0]),
+            "cluster_deviation": deviation(cluster_density(coarse, bins), reference_curves[1]),
+        }
+        candidates.append(candidate)
+        if max(candidate["dedx_deviation"], candidate["cluster_deviation"]) > tolerance:
+            break
+        chosen = energy_interval
+    return {
+        "energy_interval": chosen,
+        "reference_interval": header.energy_interval,
+        "tolerance": tolerance,
+        "num_bins": num_bins,
+        "pilot_events": reference.num_ions,
+        "candidates": candidates,
+    }
+
+
+def record_tuning(parameters, tuning, path=TUNINGS_PATH):
+    """Append the tuning of a pilot with the given simulation_parameters"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as file:
+        file.write(json.dumps({"parameters": parameters, "tuning": tuning, "time": time.time()}) + "\n")
+
+
+def find_tuning(parameters, tolerance, path=TUNINGS_PATH, num_bins=NUM_BINS):
+    """The latest recorded tuning of an identical pilot at the same tolerance and bins, or None"""
+    if not os.path.isfile(path):
+        return None
+    found = None
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            tuning = record["tuning"]
+            if (record["parameters"] == parameters and tuning["tolerance"] == tolerance
+                    and tuning.get("num_bins") == num_bins):
+                found = tuning
+    return found
+
+
+def format_tuning(tuning):
+    lines = [f"{'interval [eV]':>14} {'dE/dx':>8} {'clusters':>9}"]
+    for candidate in tuning["candidates"]:
+        chosen = " <-" if candidate["energy_interval"] == tuning["energy_interval"] else ""
+        lines.append(
+            f"{candidate['energy_interval']:>14.6g} {candidate['dedx_deviation']:>8.2%} "
+            f"{candidate['cluster_deviation']:>9.2%}{chosen}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(description="Choose energy_interval from a fine EXYZ file")
+    parser.add_argument("file_path", type=str)
+    parser.add_argument("-t", "--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("-n", "--num_bins", type=int, default=NUM_BINS)
+    args = parser.parse_args()
+
+    tuning = tune(read_exyz(args.file_path), args.tolerance, num_bins=args.num_bins)
+    print(format_tuning(tuning))
+    print(f"energy_interval {tuning['energy_interval']:g} eV")
+
+
+if __name__ == "__main__":
+    main()
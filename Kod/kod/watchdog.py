@@ -0,0 +1,165 @@
+"""Supervised TRIM runs: a wall-clock and a no-progress timeout, and salvage of the ions that
+were finished when TRIM hung, crashed or was killed.
+
+TRIM is started like pysrim's TRIM.run does, but as the leader of its own process group so
+that wine and everything it started can be terminated together. Progress is read from the
+EXYZ.txt it writes, see follow.py.
+"""
+from contextlib import contextmanager
+import os
+import shutil
+import signal
+import subprocess
+import time
+import numpy as np
+from srim.input import AutoTRIM, TRIMInput
+from exyz import complete_rows, parse_exyz_block, split_exyz_header
+from follow import POLL_INTERVAL, ExyzFollower
+
+# Seconds between SIGTERM and SIGKILL
+GRACE_PERIOD = 10.0
+
+
+@contextmanager
+def working_directory(directory):
+    current_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(current_directory)
+
+
+def write_trim_input(trim, directory):
+    """TRIM.IN and TRIMAUTO of a pysrim TRIM in directory, as TRIM.run writes them"""
+    with working_directory(directory):
+        AutoTRIM().write()
+        TRIMInput(trim).write()
+
+
+def trim_command():
+    # Like pysrim, wine when it is installed
+    executable = os.path.join(".", "TRIM.exe")
+    return ["wine", executable] if shutil.which("wine") else [executable]
+
+
+def call_trim(trim, srim_directory):
+    """Run TRIM like pysrim's TRIM.run does, but leave its outputs unparsed"""
+    write_trim_input(trim, srim_directory)
+    subprocess.check_call(trim_command(), cwd=srim_directory)
+
+
+def terminate(process, grace_period=GRACE_PERIOD):
+    """Stop the process and all processes of its group, forcefully after grace_period seconds"""
+    if process.poll() is not None:
+        return
+    if hasattr(os, "killpg"):
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(grace_period)
+            return
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+    process.wait()
+
+
+def salvage_exyz(file_path, num_events=None):
+    """Cut a partial EXYZ file after its last complete ion. SRIM ends every ion with a row at
+    energy 0, the last ion is dropped only when it lacks that row and is not the num_events-th,
+    it was cut off. Returns the raw rows that are kept, see parse_exyz_block, or None when not
+    even the header was written."""
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    try:
+        header, block = split_exyz_header(contents)
+    except Exception:
+        return None
+    if not header.endswith(b"\n"):
+        return None
+    block = complete_rows(block)
+    if block and not block.endswith(b"\n"):
+        block += b"\n"
+    rows = parse_exyz_block(block)
+    keep = len(rows)
+    if len(rows) and rows[-1, 1] != 0 and len(np.unique(rows[:, 0])) != num_events:
+        keep = int(np.flatnonzero(rows[:, 0] == rows[-1, 0])[0])
+    line_starts = np.concatenate([[0], np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord("\n")) + 1])
+    os.truncate(file_path, len(header) + line_starts[keep])
+    return rows[:keep]
+
+
+class WatchdogReport:
+    """How a supervised run ended. reason is None when TRIM finished normally."""
+
+    def __init__(self, reason, returncode, seconds, follower):
+        self.reason = reason
+        self.returncode = returncode
+        self.seconds = seconds
+        self.follower = follower
+
+    @property
+    def finished(self):
+        return self.reason is None
+
+
+class Watchdog:
+    """Runs TRIM and terminates it after `timeout` seconds, or after `stall_timeout` seconds
+    in which EXYZ.txt has not grown. Either can be None for no limit."""
+
+    def __init__(self, timeout=None, stall_timeout=None, poll_interval=POLL_INTERVAL, grace_period=GRACE_PERIOD,
+                 print_interval=None, label=""):
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.grace_period = grace_period
+        # Progress is printed every print_interval seconds when it is set
+        self.print_interval = print_interval
+        self.label = label
+
+    def run(self, trim, srim_directory, num_events=None):
+        srim_directory = os.path.abspath(srim_directory)
+        exyz_path = os.path.join(srim_directory, "SRIM Outputs", "EXYZ.txt")
+        write_trim_input(trim, srim_directory)
+        if os.path.isfile(exyz_path):
+            # Left from an earlier run, it would pass for progress
+            os.remove(exyz_path)
+
+        follower = ExyzFollower(exyz_path, num_events)
+        process = subprocess.Popen(trim_command(), cwd=srim_directory, start_new_session=hasattr(os, "killpg"))
+        start = last_progress = last_print = time.monotonic()
+        reason = None
+        try:
+            while True:
+                try:
+                    process.wait(self.poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                now = time.monotonic()
+                position = follower.position
+                try:
+                    follower.poll()
+                except ValueError:
+                    # A row caught mid-write, read again on the next poll
+                    pass
+                if follower.position != position:
+                    last_progress = now
+                if self.print_interval is not None and now - last_print >= self.print_interval:
+                    print(f"{self.label}{follower.status()}")
+                    last_print = now
+                if self.timeout is not None and now - start > self.timeout:
+                    reason = f"timeout after {self.timeout:g} s"
+                elif self.stall_timeout is not None and now - last_progress > self.stall_timeout:
+                    reason = f"no progress for {self.stall_timeout:g} s"
+                if reason is not None:
+                    print(f"{self.label}{reason}, terminating TRIM")
+                    break
+        finally:
+            # Also on KeyboardInterrupt, TRIM must not outlive the run
+            terminate(process, self.grace_period)
+        if reason is None and process.returncode != 0:
+            reason = f"TRIM exited with code {process.returncode}"
+        return WatchdogReport(reason, process.returncode, time.monotonic() - start, follower)
+
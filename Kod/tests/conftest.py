@@ -0,0 +1,46 @@
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+KOD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kod")
+DATA_FILES = os.path.join(KOD_DIR, "DataFiles")
+# The modules import each other as scripts, e.g. "from exyz import read_exyz"
+sys.path.insert(0, KOD_DIR)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """An empty working directory with DataFiles/, the code resolves its paths from the working directory"""
+    os.makedirs(tmp_path / "DataFiles")
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def data_file(workdir):
+    """Copy a file of the repository's DataFiles into the working directory, so its sidecars go there"""
+
+    def copy(file_name):
+        return shutil.copy(os.path.join(DATA_FILES, file_name), os.path.join("DataFiles", file_name))
+
+    return copy
+
+
+@pytest.fixture
+def srim_directory(workdir):
+    """A SRIM directory whose TRIM.exe is the stand-in of stand_in_trim.py"""
+    pytest.importorskip("srim")
+    from stand_in_trim import make_stand_in_srim
+
+    return make_stand_in_srim(str(workdir / "SRIM"))
+
+
+@pytest.fixture
+def sandbox_directory(workdir, monkeypatch):
+    """Where the SRIM sandboxes go, forked worker processes inherit it"""
+    directory = workdir / "tmp"
+    directory.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(directory))
+    return directory
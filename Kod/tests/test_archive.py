@@ -0,0 +1,111 @@
+import json
+import os
+import struct
+import numpy as np
+import pytest
+import archive
+from archive import COMPRESSORS, MAGIC_V1, ExyzArchive, encode_ion, write_archive
+from exyz import ion_boundaries, parse_exyz_block, read_exyz, split_exyz_header
+from .test_exyz import EXYZ_FILES, assert_matches_reference, read_exyz_file
+
+
+def assert_round_trip(file_path, archive_path):
+    exyz_archive = ExyzArchive(archive_path)
+    np.testing.assert_array_equal(exyz_archive.read().energy, read_exyz(file_path).energy)
+    text_path = os.path.join("DataFiles", "restored.txt")
+    exyz_archive.write_text(text_path)
+    with open(file_path, "rb") as original, open(text_path, "rb") as restored:
+        assert original.read() == restored.read()
+
+
+@pytest.mark.parametrize("compression", ["lzma", "zlib"])
+@pytest.mark.parametrize("file_name", EXYZ_FILES)
+def test_archive_round_trip(data_file, file_name, compression):
+    file_path = data_file(file_name)
+    archive_path = write_archive(file_path, compression=compression)
+    assert_matches_reference(ExyzArchive(archive_path).read(), read_exyz_file(file_path))
+    assert_round_trip(file_path, archive_path)
+
+
+def test_ions_read_from_their_chunks(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    exyz_data = read_exyz(file_path)
+    # A few ions per chunk
+    exyz_archive = ExyzArchive(write_archive(file_path, chunk_rows=2000))
+    assert 1 < exyz_archive.chunk.max() < len(exyz_archive) - 1
+    for ion_number in (1, 2, 57, 100):
+        start, end = exyz_data.ion_offsets[ion_number - 1:ion_number + 1]
+        np.testing.assert_array_equal(exyz_archive.read_ion(ion_number).energy, exyz_data.energy[start:end])
+    with pytest.raises(KeyError):
+        exyz_archive.read_ion(101)
+    num_rows = np.diff(exyz_data.ion_offsets)
+    np.testing.assert_array_equal(exyz_archive.read_rows([99, 0])[:, 0], [100] * num_rows[99] + [1] * num_rows[0])
+
+
+def test_cut_off_file(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    with open(file_path, "wb") as file:
+        file.write(contents[:-100])
+    exyz_archive = ExyzArchive(write_archive(file_path))
+    assert exyz_archive.trailer and not exyz_archive.trailer.endswith(b"\n")
+    assert_round_trip(file_path, exyz_archive.archive_path)
+
+
+def test_compressed_footer(data_file):
+    # A single ion, the header of about 1 kB is most of the text that is not rows
+    file_path = data_file("EXYZ_Ca40_800MeV.txt")
+    archive_path = write_archive(file_path)
+    with open(archive_path, "rb") as file:
+        file.seek(-8, os.SEEK_END)
+        (footer_length,) = struct.unpack("<Q", file.read(8))
+    assert footer_length < 600
+    assert os.path.getsize(file_path) / os.path.getsize(archive_path) > 4
+
+
+def write_archive_v1(exyz_path, archive_path):
+    """The first archive format: one zlib chunk per ion and a JSON footer"""
+    with open(exyz_path, "rb") as file:
+        header_text, block = split_exyz_header(file.read())
+    rows = parse_exyz_block(block)
+    boundaries = ion_boundaries(rows[:, 0])
+    ions, offset = [], len(MAGIC_V1)
+    with open(archive_path, "wb") as file:
+        file.write(MAGIC_V1)
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            chunk = COMPRESSORS["zlib"](encode_ion(rows[start:end]))
+            file.write(chunk)
+            ions.append([int(rows[start, 0]), int(end - start), offset, len(chunk)])
+            offset += len(chunk)
+        footer = json.dumps({
+            "version": 1, "compression": "zlib", "header": header_text.decode("latin-1"),
+            "newline": "\n", "trailer": "", "ions": ions,
+        }).encode()
+        file.write(footer)
+        file.write(struct.pack("<Q", len(footer)))
+
+
+def test_version_1_archive(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    archive_path = os.path.join("DataFiles", "EXYZ.exyza")
+    write_archive_v1(file_path, archive_path)
+    assert_round_trip(file_path, archive_path)
+    assert ExyzArchive(archive_path).read_ion(100).ion_number == 100
+
+
+def test_archive_not_left_behind_on_error(data_file, monkeypatch):
+    file_path = data_file(EXYZ_FILES[0])
+    decode_ion = archive.decode_ion
+    # The third ion does not come back bit-exact
+    calls = []
+
+    def decode_ion_once_wrong(data, ion_number, num_rows):
+        calls.append(ion_number)
+        return decode_ion(data, ion_number, num_rows) + (len(calls) == 3)
+
+    monkeypatch.setattr(archive, "decode_ion", decode_ion_once_wrong)
+    archive_path = os.path.join("DataFiles", "EXYZ.exyza")
+    with pytest.raises(ValueError, match="bit-exact"):
+        write_archive(file_path, archive_path)
+    assert sorted(os.listdir("DataFiles")) == [EXYZ_FILES[0]]
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from cache import clear_cache
+from exyz import load_exyz, read_exyz
+from read_geant4 import Geant4Result
+from surrogate import exyz_header
+from .test_exyz import EXYZ_FILES, assert_matches_reference, read_exyz_file
+
+
+def sidecars():
+    return sorted(os.listdir(os.path.join("DataFiles", "CacheFiles")))
+
+
+@pytest.mark.parametrize("file_name", EXYZ_FILES)
+def test_exyz_sidecar(data_file, file_name):
+    file_path = data_file(file_name)
+    built, cached = load_exyz(file_path), load_exyz(file_path)
+    assert len(sidecars()) == 1
+    assert isinstance(cached.energy, np.memmap)
+    for exyz_data in (built, cached):
+        assert_matches_reference(exyz_data, read_exyz_file(file_path))
+        np.testing.assert_array_equal(exyz_data.ion_offsets, read_exyz(file_path).ion_offsets)
+        assert exyz_data.header == read_exyz(file_path).header
+
+
+def test_sidecar_rebuilt_when_the_file_changes(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    assert load_exyz(file_path).num_ions == 100
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    # Drop the last ion
+    with open(file_path, "wb") as file:
+        file.write(contents[:contents.index(b"\n0000100 ") + 1])
+    assert load_exyz(file_path).num_ions == 99
+    assert len(sidecars()) == 2
+    clear_cache("DataFiles")
+    assert not os.path.exists(os.path.join("DataFiles", "CacheFiles"))
+
+
+def test_sidecar_of_file_without_rows(workdir):
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    with open(file_path, "w") as file:
+        file.write(exyz_header("He", 4, 5400, 1e4))
+    for exyz_data in (load_exyz(file_path), load_exyz(file_path)):
+        assert exyz_data.num_ions == 0
+        assert len(exyz_data.energy) == 0
+        np.testing.assert_array_equal(exyz_data.ion_offsets, [0])
+
+
+def test_geant4_sidecar(data_file):
+    file_name = "He4_15MeV_100_events_CF4_500mbar_train.txt"
+    file_path = data_file(file_name)
+    expected = pd.read_csv(file_path, sep=r"\s+", header=None).values
+    for _ in range(2):
+        result = Geant4Result.from_file_name(file_name, "DataFiles")
+        np.testing.assert_array_equal(result.results.values[:, :-1].T, expected)
+    assert len(sidecars()) == 1
+    assert len(result.get_bragg_data()) == 100
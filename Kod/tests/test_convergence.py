@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from convergence import MIN_EVENTS, RunningCurve, StoppingRule, ion_curves
+from exyz import read_exyz
+
+EXYZ_FILE = "EXYZ_He4-15.0MeV_2023-05-04_1738.txt"
+
+
+@pytest.fixture
+def exyz_data(data_file):
+    return read_exyz(data_file(EXYZ_FILE))
+
+
+def test_ion_curves_keep_the_energy(exyz_data):
+    bins = RunningCurve.for_batch(exyz_data).bins
+    curves = ion_curves(exyz_data, bins)
+    assert curves.shape == (100, len(bins) - 1)
+    first, last = exyz_data.ion_offsets[:-1], exyz_data.ion_offsets[1:] - 1
+    np.testing.assert_allclose(curves @ np.diff(bins), exyz_data.energy[first] - exyz_data.energy[last])
+
+
+def test_batches_merge_to_the_statistics_of_all_ions(exyz_data):
+    curve = RunningCurve.for_batch(exyz_data.ions(0, 10))
+    for start in range(0, 100, 30):
+        curve.add(exyz_data.ions(start, min(start + 30, 100)))
+    curve.add(exyz_data.ions(100, 100))
+    curves = ion_curves(exyz_data, curve.bins)
+    assert curve.count == 100
+    np.testing.assert_allclose(curve.mean, curves.mean(axis=0), atol=1e-9 * curves.max())
+    np.testing.assert_allclose(curve.standard_error, curves.std(axis=0, ddof=1) / 10, atol=1e-9 * curves.max())
+    report = curve.report(0.02)
+    assert report["num_events"] == 100 and report["achieved"] == curve.relative_error()
+
+
+class FixedError:
+    """A RunningCurve stand-in with a given count and relative error"""
+
+    def __init__(self, count, error):
+        self.count, self.error = count, error
+
+    def relative_error(self):
+        return self.error
+
+
+def test_stopping_rule():
+    rule = StoppingRule(0.02)
+    # Two batches in a row within the precision, and enough ions
+    assert not rule.done(FixedError(5, 0.01))
+    assert not rule.done(FixedError(MIN_EVENTS, 0.03))
+    assert not rule.done(FixedError(15, 0.01))
+    assert rule.done(FixedError(20, 0.01))
+    rule = StoppingRule(0.02, max_events=30)
+    assert not rule.done(FixedError(20, 0.5))
+    assert rule.done(FixedError(30, 0.5))
+    assert np.isinf(RunningCurve(np.arange(3.0)).relative_error())
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from events import BraggEvents
+
+
+@pytest.fixture
+def events():
+    """Ragged events as the lists of dicts they replace, one of them empty and one with a NaN"""
+    rng = np.random.default_rng(1)
+    events = []
+    for length in (5, 0, 3, 8, 1):
+        events.append({"x_values": np.sort(rng.uniform(0, 10, length)), "dE_values": rng.uniform(0, 5, length)})
+    events[3]["dE_values"][2] = np.nan
+    return events
+
+
+def assert_same_events(bragg_events, events):
+    assert len(bragg_events) == len(events)
+    for event, expected in zip(bragg_events, events):
+        np.testing.assert_array_equal(event["x_values"], expected["x_values"])
+        np.testing.assert_array_equal(event["dE_values"], expected["dE_values"])
+
+
+def test_events_are_views(events):
+    bragg_events = BraggEvents.from_events(events)
+    assert_same_events(bragg_events, events)
+    assert np.shares_memory(bragg_events[2]["dE_values"], bragg_events.dE_values)
+    np.testing.assert_array_equal(bragg_events[-1]["x_values"], events[-1]["x_values"])
+    with pytest.raises(IndexError):
+        bragg_events[5]
+    with pytest.raises(ValueError):
+        BraggEvents(np.zeros(3), np.zeros(2), [0, 3])
+
+
+def test_slicing_and_concatenation(events):
+    bragg_events = BraggEvents.from_events(events)
+    assert_same_events(bragg_events[1:4], events[1:4])
+    assert np.shares_memory(bragg_events[1:4].x_values, bragg_events.x_values)
+    assert_same_events(bragg_events[::2], events[::2])
+    assert_same_events(bragg_events[[4, 0]], [events[4], events[0]])
+    assert_same_events(bragg_events[3:1], [])
+    # Slices of slices keep their offsets, concatenation renumbers them
+    assert_same_events(bragg_events[2:][1:3], events[3:5])
+    assert_same_events(BraggEvents.concatenate([bragg_events[3:], bragg_events[:2]]), events[3:] + events[:2])
+    assert_same_events(BraggEvents.concatenate([]), [])
+
+
+def test_reductions(events):
+    bragg_events = BraggEvents.from_events(events)
+    np.testing.assert_allclose(bragg_events.sum(), [np.nansum(event["dE_values"]) for event in events])
+    means = bragg_events.mean()
+    assert np.isnan(means[1])
+    np.testing.assert_allclose(
+        np.delete(means, 1), [np.nanmean(event["dE_values"]) for event in events if len(event["x_values"])]
+    )
+    maxima, peaks = bragg_events.max(), bragg_events.peak_x()
+    for index, event in enumerate(events):
+        if not len(event["x_values"]):
+            assert np.isnan(maxima[index]) and np.isnan(peaks[index])
+            continue
+        assert maxima[index] == np.nanmax(event["dE_values"])
+        assert peaks[index] == event["x_values"][np.nanargmax(event["dE_values"])]
+    np.testing.assert_array_equal(bragg_events[1:].sum(), bragg_events.sum()[1:])
+
+
+def test_average(events):
+    bragg_events = BraggEvents.from_events(events)
+    bins = np.linspace(0, 10, 6)
+    x_values = np.concatenate([event["x_values"] for event in events])
+    dE_values = np.concatenate([event["dE_values"] for event in events])
+    valid = np.isfinite(dE_values)
+    which = np.digitize(x_values[valid], bins) - 1
+    centers, means = bragg_events.average(bins)
+    np.testing.assert_allclose(centers, [1, 3, 5, 7, 9])
+    for index, mean in enumerate(means):
+        values = dE_values[valid][which == index]
+        np.testing.assert_allclose(mean, values.mean() if len(values) else np.nan)
+
+
+def test_matrix():
+    bragg_events = BraggEvents.from_matrix(np.arange(4.0), np.arange(12.0).reshape(3, 4))
+    assert len(bragg_events) == 3
+    np.testing.assert_array_equal(bragg_events[2]["x_values"], np.arange(4.0))
+    np.testing.assert_array_equal(bragg_events.sum(), [6, 22, 38])
@@ -0,0 +1,178 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from cache import load_sidecar
+from exyz import (
+    ExyzIndex, bragg_curves, build_exyz_index, complete_rows, compute_dedx, merge_exyz_files, move_exyz_file, parse_exyz_block, parse_exyz_header, read_exyz, split_exyz_header,
+)
+
+# 100 ions with '.' decimals, 10 ions with ',' decimals and a single ion of 800 rows
+EXYZ_FILES = [
+    "EXYZ_He4-15.0MeV_2023-05-04_1738.txt",
+    "EXYZ_He4-5.4MeV.txt",
+    "EXYZ_Ca40_800MeV.txt",
+]
+COLUMNS = ["Ion Number", "Energy", "Depth", "Y", "Z", "Electronic Stop.", "Recoil Energy"]
+
+
+def read_exyz_file(file_path):
+    """Raw columns the way SimulationResult.read_exyz_file first read them, with pandas"""
+    with open(file_path, "rb") as file:
+        header, _ = split_exyz_header(file.read())
+    return pd.read_csv(
+        file_path, sep=r"\s+", header=None, names=COLUMNS, engine="python", skiprows=header.count(b"\n"),
+        converters={name: lambda x: float(x.replace(",", ".")) for name in COLUMNS},
+    )
+
+
+def assert_matches_reference(exyz_data, reference):
+    np.testing.assert_array_equal(exyz_data.ion_number, reference["Ion Number"])
+    np.testing.assert_allclose(exyz_data.energy, reference["Energy"] * 1e-3, rtol=1e-12)
+    np.testing.assert_allclose(exyz_data.depth, reference["Depth"] * 1e-8, rtol=1e-12)
+    np.testing.assert_allclose(exyz_data.y, reference["Y"] * 1e-8, rtol=1e-12)
+    np.testing.assert_allclose(exyz_data.z, reference["Z"] * 1e-8, rtol=1e-12)
+    np.testing.assert_allclose(exyz_data.stopping, reference["Electronic Stop."] * 1e2, rtol=1e-12)
+    np.testing.assert_allclose(exyz_data.recoil, reference["Recoil Energy"] * 1e-6, rtol=1e-12)
+
+
+@pytest.mark.parametrize("file_name", EXYZ_FILES)
+def test_parser_matches_pandas(data_file, file_name):
+    file_path = data_file(file_name)
+    exyz_data = read_exyz(file_path)
+    assert_matches_reference(exyz_data, read_exyz_file(file_path))
+    assert exyz_data.num_ions == len(np.unique(exyz_data.ion_number))
+    np.testing.assert_array_equal(exyz_data.ion_number[exyz_data.ion_offsets[:-1]], np.unique(exyz_data.ion_number))
+
+
+def test_header():
+    header = parse_exyz_header(
+        b"  Ion Data: Name. Mass.   Energy . Energy Interval\n"
+        b"           He     004,00  5400keV    1000eV\n"
+        b"------- ----------- ----------\n"
+    )
+    assert (header.element, header.mass, header.energy, header.energy_interval) == ("He", 4.0, 5.4e6, 1000.0)
+    assert header.decimal == ","
+
+
+def test_decimal_commas():
+    rows = parse_exyz_block(b"0000001 1,5000E+03 2,0000E+00 0 0 1,0E+01 0\n0000001 1.0000E+03 3 0 0 1 0\n")
+    np.testing.assert_array_equal(rows[:, :3], [[1, 1500, 2], [1, 1000, 3]])
+
+
+def test_cut_off_row():
+    block = b"1 2 3 4 5 6 7\n1 2 3"
+    assert complete_rows(block) == b"1 2 3 4 5 6 7\n"
+    # A last row without a newline but with all its values is kept
+    assert complete_rows(b"1 2 3 4 5 6 7") == b"1 2 3 4 5 6 7"
+    with pytest.raises(ValueError):
+        parse_exyz_block(block)
+
+
+def test_move_without_copy(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    inode, expected = os.stat(file_path).st_ino, read_exyz_file(file_path)
+    destination_path = os.path.join("DataFiles", "moved.txt")
+    move_exyz_file(file_path, destination_path)
+    assert not os.path.exists(file_path)
+    assert os.stat(destination_path).st_ino == inode
+    assert_matches_reference(read_exyz(destination_path), expected)
+
+
+def test_move_fixes_decimal_commas(data_file):
+    file_path = data_file("EXYZ_He4-5.4MeV.txt")
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    expected = read_exyz_file(file_path)
+    destination_path = os.path.join("DataFiles", "moved.txt")
+    move_exyz_file(file_path, destination_path, chunk_size=4096)
+    assert not os.path.exists(file_path)
+    with open(destination_path, "rb") as file:
+        assert file.read() == contents.replace(b",", b".")
+    exyz_data = read_exyz(destination_path)
+    assert exyz_data.header.decimal == "."
+    assert_matches_reference(exyz_data, expected)
+
+
+@pytest.mark.parametrize("file_name", EXYZ_FILES)
+def test_index_reads_every_ion(data_file, file_name):
+    file_path = data_file(file_name)
+    reference = read_exyz_file(file_path)
+    index = ExyzIndex(file_path)
+    ion_numbers = np.unique(reference["Ion Number"]).astype(int)
+    assert len(index) == len(ion_numbers)
+    assert_matches_reference(index.read_ions(0, len(index)), reference)
+    last = index.read_ion(ion_numbers[-1])
+    np.testing.assert_allclose(
+        last.energy, reference["Energy"][reference["Ion Number"] == ion_numbers[-1]] * 1e-3, rtol=1e-12
+    )
+    np.testing.assert_allclose(index.final_depth[-1], last.depth[-1])
+    with pytest.raises(KeyError):
+        index.read_ion(ion_numbers[-1] + 1)
+
+    subset_path = os.path.join("DataFiles", "subset.txt")
+    index.write_ions(subset_path, 0, 1)
+    assert_matches_reference(read_exyz(subset_path), reference[reference["Ion Number"] == ion_numbers[0]])
+
+
+def test_index_of_small_chunks(data_file, tmp_path):
+    # Ions spanning several chunks are put together
+    file_path = data_file(EXYZ_FILES[0])
+    build_exyz_index(file_path, str(tmp_path / "index"), chunk_size=1000)
+    _, arrays = load_sidecar(str(tmp_path / "index"))
+    index = ExyzIndex(file_path)
+    assert index.contiguous
+    for name in ("ion_number", "byte_offset", "num_rows", "final_depth", "final_energy"):
+        np.testing.assert_array_equal(arrays[name], getattr(index, name))
+    np.testing.assert_array_equal(index.num_rows, np.diff(read_exyz(file_path).ion_offsets))
+
+
+def baseline_bragg_curves(file_path):
+    """Per-ion dE/dx with a tail of 20 zeros, the groupby of the original read_exyz_file"""
+    df = read_exyz_file(file_path)
+    df["Energy"] *= 1e-3
+    df["Depth"] *= 1e-8
+    curves = []
+    for _, ion in df.groupby("Ion Number"):
+        dx = ion["Depth"].diff()
+        dE_dx = -ion["Energy"].diff() / dx
+        last_depth = ion["Depth"].iloc[-1]
+        depth = np.concatenate([ion["Depth"], np.linspace(last_depth, last_depth + 20 * dx.mean(), 20)])
+        curves.append((depth[1:], np.concatenate([dE_dx, np.zeros(20)])[1:]))
+    return curves
+
+
+@pytest.mark.parametrize("file_name", EXYZ_FILES)
+def test_bragg_curves_match_groupby(data_file, file_name):
+    file_path = data_file(file_name)
+    x_values, dE_values, offsets = bragg_curves(read_exyz(file_path))
+    curves = baseline_bragg_curves(file_path)
+    assert len(offsets) == len(curves) + 1
+    for start, end, (depth, dE_dx) in zip(offsets[:-1], offsets[1:], curves):
+        np.testing.assert_allclose(x_values[start:end], depth, rtol=1e-12)
+        np.testing.assert_allclose(dE_values[start:end], dE_dx, rtol=1e-12)
+
+
+def test_dedx_of_single_row_ions():
+    energy, depth = np.array([3.0, 2.0, 5.0, 1.0]), np.array([0.0, 1.0, 0.0, 0.0])
+    dE, dx, dE_dx = compute_dedx(energy, depth, np.array([0, 2, 3, 4]))
+    assert np.isnan(dE[[0, 2, 3]]).all() and np.isnan(dE_dx[[0, 2, 3]]).all()
+    assert dE_dx[1] == 1.0
+
+
+def test_merge_renumbers_ions(data_file):
+    file_path = data_file(EXYZ_FILES[0])
+    index = ExyzIndex(file_path)
+    first_path, second_path = os.path.join("DataFiles", "first.txt"), os.path.join("DataFiles", "second.txt")
+    index.write_ions(first_path, 0, 40)
+    index.write_ions(second_path, 60, 100)
+    merged_path = merge_exyz_files([first_path, second_path, first_path], os.path.join("DataFiles", "merged.txt"))
+    merged = read_exyz(merged_path)
+    np.testing.assert_array_equal(np.unique(merged.ion_number), np.arange(1, 121))
+    parts = [read_exyz(first_path), read_exyz(second_path), read_exyz(first_path)]
+    np.testing.assert_array_equal(merged.energy, np.concatenate([part.energy for part in parts]))
+    assert merged.header == parts[0].header
+
+    with pytest.raises(ValueError, match="not from the same simulation"):
+        merge_exyz_files([first_path, data_file(EXYZ_FILES[1])], os.path.join("DataFiles", "mixed.txt"))
+    assert not os.path.exists(os.path.join("DataFiles", "mixed.txt"))
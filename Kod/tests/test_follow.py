@@ -0,0 +1,80 @@
+import os
+import numpy as np
+from convergence import RunningCurve
+from exyz import read_exyz
+from follow import ExyzFollower, FollowThread
+
+EXYZ_FILE = "EXYZ_He4-15.0MeV_2023-05-04_1738.txt"
+
+
+def write_in_pieces(file_path, contents, cuts):
+    """Append contents to file_path in pieces ending at the offsets in cuts, yielding after each"""
+    start = 0
+    for end in list(cuts) + [len(contents)]:
+        with open(file_path, "ab") as file:
+            file.write(contents[start:end])
+        start = end
+        yield end
+
+
+def test_follower_matches_the_whole_file(data_file):
+    source = data_file(EXYZ_FILE)
+    with open(source, "rb") as file:
+        contents = file.read()
+    exyz_data = read_exyz(source)
+    bins = RunningCurve.for_batch(exyz_data).bins
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    follower = ExyzFollower(file_path, num_events=exyz_data.num_ions, bins=bins)
+    assert follower.poll() == 0 and follower.eta is None
+    # Pieces cut mid-header, mid-row and mid-ion
+    finished = []
+    for _ in write_in_pieces(file_path, contents, range(37, len(contents), len(contents) // 13)):
+        finished.append(follower.poll())
+        # The ion being written is never counted
+        assert follower.ions_finished < exyz_data.num_ions
+    assert follower.header == exyz_data.header
+    assert finished[0] == 0 and all(count >= 0 for count in finished)
+    assert follower.finish() == 1
+    assert follower.ions_finished == exyz_data.num_ions and follower.eta == 0
+
+    expected = RunningCurve(bins)
+    expected.add(exyz_data)
+    depth, mean = follower.running_mean()
+    np.testing.assert_allclose(depth, expected.depth)
+    np.testing.assert_allclose(mean, expected.mean, atol=1e-9 * expected.mean.max())
+    assert f"{exyz_data.num_ions}/{exyz_data.num_ions} ions" in follower.status()
+
+
+def test_new_run_starts_over(data_file):
+    source = data_file(EXYZ_FILE)
+    with open(source, "rb") as file:
+        contents = file.read()
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    with open(file_path, "wb") as file:
+        file.write(contents)
+    follower = ExyzFollower(file_path)
+    follower.poll()
+    assert follower.ions_finished == 99
+    # TRIM writes the file over for the next run, shorter so far
+    ion_11 = contents.find(b"\n0000011 ") + 1
+    with open(file_path, "wb") as file:
+        file.write(contents[:contents.find(b"\n", ion_11) + 1])
+    assert follower.poll() == 10
+    assert follower.ions_finished == 10 and follower.running_mean()[0].size
+
+
+def test_thread_reports_until_stopped(data_file):
+    source = data_file(EXYZ_FILE)
+    with open(source, "rb") as file:
+        contents = file.read()
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    reports = []
+    thread = FollowThread(ExyzFollower(file_path, num_events=100), label="He4: ", poll_interval=0.01,
+                          print_interval=0.0, report=reports.append)
+    thread.start()
+    for _ in write_in_pieces(file_path, contents, range(0, len(contents), len(contents) // 5)):
+        pass
+    thread.stop()
+    assert not thread.is_alive()
+    assert reports[-1].startswith("He4: 100/100 ions")
+    assert all(report.startswith("He4: ") for report in reports)
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import pytest
+from pipeline import Pipeline
+
+
+def slow(function, seconds):
+    def stage(item):
+        time.sleep(seconds)
+        return function(item)
+
+    return stage
+
+
+def test_items_pass_through_in_order():
+    pipeline = Pipeline([("double", lambda x: 2 * x), ("name", str)], queue_size=2)
+    assert pipeline.run(range(10)) == [str(2 * x) for x in range(10)]
+    assert [stats.name for stats in pipeline.stats] == ["produce", "double", "name"]
+    assert [stats.items for stats in pipeline.stats] == [10, 10, 10]
+    report = pipeline.report().splitlines()
+    assert len(report) == 4 and report[2].split()[:2] == ["double", "10"]
+
+
+def test_stages_overlap():
+    def produce():
+        for item in range(6):
+            time.sleep(0.05)
+            yield item
+
+    pipeline = Pipeline([("convert", slow(lambda x: x, 0.05)), ("persist", slow(lambda x: x, 0.05))])
+    start = time.perf_counter()
+    assert pipeline.run(produce()) == list(range(6))
+    # 0.9 s one after the other, about 0.4 s with the three of them overlapping
+    assert time.perf_counter() - start < 0.7
+    assert all(stats.busy >= 0.3 for stats in pipeline.stats)
+
+
+def test_bounded_queues_hold_up_the_producer():
+    pipeline = Pipeline([("slow", slow(lambda x: x, 0.05))], queue_size=1)
+    pipeline.run(range(5))
+    produce, stage = pipeline.stats
+    # The producer waited for room in the queue most of the time
+    assert produce.idle > 0.1 and produce.busy < 0.05
+    assert stage.throughput == pytest.approx(20, rel=0.5)
+
+
+def test_error_stops_the_producer():
+    produced, closed = [], threading.Event()
+
+    def produce():
+        try:
+            for item in range(100):
+                produced.append(item)
+                yield item
+        finally:
+            # e.g. the TRIM worker processes are shut down
+            closed.set()
+
+    def fail_on_3(item):
+        if item == 3:
+            raise ValueError("cannot parse 3")
+        return item
+
+    pipeline = Pipeline([("parse", fail_on_3), ("persist", slow(lambda x: x, 0.01))], queue_size=1)
+    with pytest.raises(ValueError, match="cannot parse 3"):
+        pipeline.run(produce())
+    assert closed.is_set()
+    assert len(produced) < 100
+    # Items after the failure are drained without work, by every stage
+    assert pipeline.stats[1].items == 3
+    assert pipeline.results == list(range(len(pipeline.results))) and len(pipeline.results) <= 3
+
+
+def test_failed_campaign_cancels_pending_runs(workdir, monkeypatch):
+    pytest.importorskip("srim")
+    import simulation
+    from scheduler import read_runtimes
+
+    def finish(self, result, exyz_path):
+        raise RuntimeError("convert failed")
+
+    monkeypatch.setattr(simulation.Simulation, "finish", finish)
+    energies = [float(energy) for energy in range(5_000_000, 13_000_000, 1_000_000)]
+    with pytest.raises(RuntimeError, match="convert failed"):
+        simulation.simulate_all(["He-4"] * 8, energies, 100, 2e4, jobs=2, backend="surrogate")
+    # Only the runs going when convert failed were finished, not all 8
+    assert len(read_runtimes()) < 8
+    assert [name for name in os.listdir("DataFiles") if name.startswith(".staging-")] == []
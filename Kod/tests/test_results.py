@@ -0,0 +1,162 @@
+from itertools import islice
+import os
+import pickle
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+pytest.importorskip("srim")
+import matplotlib  # noqa: E402
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+from simulation import SimulationResult, convert_pickles, load_sim_result, save_sim_result  # noqa: E402
+
+EXYZ_FILE = "EXYZ_He4-15.0MeV_2023-05-04_1738.txt"
+
+
+@pytest.fixture
+def sim_result(data_file):
+    data_file(EXYZ_FILE)
+    sim_result = SimulationResult("He4", 15e6, 100)
+    sim_result.add_exyz_file(EXYZ_FILE)
+    return sim_result
+
+
+def test_exyz_events_streamed(sim_result):
+    events = sim_result.get_exyz_data2()
+    streamed = list(sim_result.iter_exyz_data(max_rows=500))
+    assert len(streamed) == len(events) == 100
+    for event, streamed_event in zip(events, streamed):
+        np.testing.assert_array_equal(event["x_values"], streamed_event["x_values"])
+        np.testing.assert_array_equal(event["dE_values"], streamed_event["dE_values"])
+    # A batch holds at most max_rows EXYZ rows, or a single ion. Every curve drops the first
+    # row of its ion and ends with a tail of 20 zeros.
+    batches = list(sim_result.iter_bragg_batches(max_rows=500))
+    assert len(batches) > 1
+    for batch in batches:
+        assert len(batch) == 1 or batch.lengths.sum() - 19 * len(batch) <= 500
+
+
+def test_plot_reads_only_the_plotted_ions(sim_result):
+    _, ax = plt.subplots()
+    sim_result.plot(ax, num_events=2, exyz=True, ioniz=False)
+    assert len(ax.lines) == 2
+    assert "exyz2" not in sim_result.views
+    first = next(sim_result.iter_exyz_data())
+    np.testing.assert_array_equal(ax.lines[0].get_xdata(), first["x_values"])
+    plt.close("all")
+
+
+def test_ion_tracks_streamed(sim_result):
+    tracks = sim_result.get_ion_tracks()
+    first, second = islice(tracks, 2)
+    assert (first.ion_number, second.ion_number) == (1, 2)
+    assert sum(1 for _ in tracks) == 98
+    assert "tracks" not in sim_result.views
+
+
+def test_average_over_batches(sim_result):
+    bins = np.linspace(0, 60, 31)
+    depth, dE_mean = sim_result.get_average_exyz_data(bins)
+    expected_depth, expected_mean = sim_result.get_exyz_data2().average(bins)
+    np.testing.assert_allclose(depth, expected_depth)
+    np.testing.assert_allclose(dE_mean, expected_mean, rtol=1e-12)
+
+
+def srim_result(num_rows=50, seed=0):
+    """Stand-in for a pysrim Results with the ioniz and exyz columns that are saved"""
+    rng = np.random.default_rng(seed)
+    depth = np.cumsum(rng.uniform(1e3, 2e3, num_rows))
+    return SimpleNamespace(
+        ioniz=SimpleNamespace(depth=np.linspace(0, 1e6, 100), ions=rng.random(100), recoils=rng.random(100)),
+        exyz=SimpleNamespace(
+            ion_number=np.ones(num_rows), energy=np.linspace(15e3, 0, num_rows), depth=depth,
+            y=rng.random(num_rows), z=rng.random(num_rows),
+            electronic_stop=rng.random(num_rows), recoil_energy_loss=rng.random(num_rows),
+        ),
+    )
+
+
+def test_save_and_load(workdir):
+    sim_result = SimulationResult("He4", 15e6, 2)
+    sim_result.parameters = {"element": "He", "mass": 4}
+    sim_result.partial = {"reason": "timeout after 60 s", "num_events": 2}
+    sim_result.add_exyz_file(EXYZ_FILE)
+    for seed in range(2):
+        sim_result.add_result(srim_result(seed=seed))
+    result_path = save_sim_result(sim_result)
+    assert result_path == sim_result.result_path and os.path.isfile(os.path.join(result_path, "meta.json"))
+
+    loaded = load_sim_result(result_path)
+    assert (loaded.id, loaded.num_events, loaded.exyz_file_name) == (sim_result.id, 2, EXYZ_FILE)
+    assert (loaded.parameters, loaded.partial) == (sim_result.parameters, sim_result.partial)
+    assert loaded.result_path == result_path
+    # Nothing is read until a column is used, then it is memory-mapped
+    assert "depth" not in vars(loaded.results[1].ioniz)
+    assert isinstance(loaded.results[1].ioniz.depth, np.memmap)
+    for result, loaded_result in zip(sim_result.results, loaded.results):
+        for name in ("ion_number", "energy", "depth", "recoil_energy_loss"):
+            np.testing.assert_array_equal(getattr(loaded_result.exyz, name), getattr(result.exyz, name))
+    np.testing.assert_array_equal(loaded.get_ioniz_data().dE_values, sim_result.get_ioniz_data().dE_values)
+    np.testing.assert_array_equal(loaded.get_exyz_data().x_values, sim_result.get_exyz_data().x_values)
+
+
+def test_newer_format_refused(workdir):
+    result_path = save_sim_result(SimulationResult("He4", 15e6, 0))
+    meta_path = os.path.join(result_path, "meta.json")
+    with open(meta_path) as file:
+        meta = file.read()
+    with open(meta_path, "w") as file:
+        file.write(meta.replace('"format_version": 1', '"format_version": 99'))
+    with pytest.raises(ValueError, match="format version 99"):
+        load_sim_result(result_path)
+
+
+def test_pickles_converted(workdir):
+    sim_result = SimulationResult("He4", 15e6, 1)
+    sim_result.add_result(srim_result())
+    os.makedirs(os.path.join("DataFiles", "PickleFiles"))
+    with open(sim_result.pickle_path, "wb") as file:
+        pickle.dump(sim_result, file)
+    assert load_sim_result(sim_result.pickle_path).num_events == 1
+    convert_pickles()
+    loaded = load_sim_result(sim_result.result_path)
+    np.testing.assert_array_equal(loaded.results[0].ioniz.ions, sim_result.results[0].ioniz.ions)
+
+
+def test_views_cached_until_the_inputs_change(sim_result):
+    sim_result.add_result(srim_result())
+    ioniz, exyz2 = sim_result.get_ioniz_data(), sim_result.get_exyz_data2()
+    assert sim_result.get_ioniz_data() is ioniz and sim_result.get_exyz_data2() is exyz2
+    assert sim_result.cache_nbytes() >= ioniz.nbytes + exyz2.nbytes
+    sim_result.add_result(srim_result(seed=1))
+    assert sim_result.views == {}
+    assert len(sim_result.get_ioniz_data()) == 2
+    exyz2 = sim_result.get_exyz_data2()
+    sim_result.add_exyz_file(EXYZ_FILE)
+    assert sim_result.get_exyz_data2() is not exyz2
+    # Views are not pickled
+    assert "_views" not in pickle.loads(pickle.dumps(sim_result)).__dict__
+
+
+def test_cache_bound(sim_result):
+    calls = []
+
+    def build(key, size):
+        calls.append(key)
+        return np.zeros(size, dtype=np.uint8)
+
+    sim_result.max_cache_bytes = 250
+    for key in "abc":
+        sim_result.cached_view(key, lambda: build(key, 100))
+    # The least recently used view is dropped first
+    assert list(sim_result.views) == ["b", "c"]
+    sim_result.cached_view("b", lambda: build("b", 100))
+    sim_result.cached_view("d", lambda: build("d", 100))
+    assert list(sim_result.views) == ["b", "d"] and calls == ["a", "b", "c", "d"]
+    # A view larger than the bound is still kept, on its own
+    sim_result.cached_view("e", lambda: build("e", 1000))
+    assert list(sim_result.views) == ["e"]
+    assert SimulationResult("He4", 15e6, 1, max_cache_bytes=10).max_cache_bytes == 10
+    assert SimulationResult.max_cache_bytes is None
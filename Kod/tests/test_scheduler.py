@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pytest
+from scheduler import CostModel, longest_first, makespan, read_runtimes, record_runtime
+
+
+def parameters(element="He", mass=4, energy=5.4e6, num_events=100, energy_interval=1e4, **extra):
+    return dict(element=element, mass=mass, energy=energy, num_events=num_events,
+                energy_interval=energy_interval, **extra)
+
+
+def true_seconds(run, shards):
+    """A runtime law of the form CostModel fits"""
+    return 2e-4 * run["num_events"] * (run["energy"] / 1e6) ** 1.2 / shards
+
+
+def test_runtimes_recorded(workdir):
+    path = os.path.join("DataFiles", "runtimes.jsonl")
+    assert read_runtimes(path) == []
+    record_runtime(parameters(), 1, 1.5, path)
+    record_runtime(parameters(backend="surrogate"), 2, 0.1, path)
+    records = read_runtimes(path)
+    assert [(record["shards"], record["seconds"]) for record in records] == [(1, 1.5), (2, 0.1)]
+    assert records[1]["parameters"]["backend"] == "surrogate"
+
+
+def test_cost_model_learns_runtimes():
+    rng = np.random.default_rng(0)
+    records = []
+    for _ in range(40):
+        run = parameters(
+            *rng.choice([("He", 4), ("Ca", 40), ("Sr", 80)]), energy=rng.uniform(5e6, 2e9),
+            num_events=int(rng.integers(10, 1000)), energy_interval=rng.choice([1e4, 1e5]),
+        )
+        run["mass"] = int(run["mass"])
+        shards = int(rng.integers(1, 4))
+        records.append({"parameters": run, "shards": shards, "seconds": true_seconds(run, shards)})
+    # Surrogate runs are fitted on their own
+    records.append({"parameters": parameters(backend="surrogate"), "shards": 1, "seconds": 1e3})
+    model = CostModel(records)
+    assert model.num_records == 40
+    run = parameters("Ca", 40, 700e6, 500)
+    assert model.predict(run, 2) == pytest.approx(true_seconds(run, 2), rel=0.2)
+    assert CostModel(records, "surrogate").num_records == 1
+
+
+def test_prior_orders_runs_without_records():
+    model = CostModel()
+    costs = [model.predict(run) for run in (parameters(), parameters("Sr", 80, 2e9), parameters(num_events=1000))]
+    assert longest_first(costs) == [1, 2, 0]
+    assert model.predict(parameters(), shards=2) == pytest.approx(model.predict(parameters()) / 2)
+
+
+def test_longest_first_shortens_the_makespan():
+    costs = [1, 1, 1, 1, 1, 1, 6]
+    assert makespan(costs, 2) == 9
+    assert makespan([costs[index] for index in longest_first(costs)], 2) == 6
+    assert makespan(costs, 10) == 6
+    assert makespan([], 2) == 0
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import threading
+import pytest
+from .test_simulation import ENERGY_INTERVAL, NUM_EVENTS, assert_complete
+
+pytest.importorskip("pexpect")
+pytest.importorskip("srim")
+from srim import Ion, Layer, Target, TRIM  # noqa: E402
+from session import TrimSession  # noqa: E402
+from simulation import simulate, simulate_all  # noqa: E402
+
+
+def new_trim(energy=5.4e6):
+    target = Target([Layer.from_formula("CF4", density=0.001764, phase=1, width=10000.0e06)])
+    return TRIM(target, Ion("He", energy, 4), number_ions=NUM_EVENTS, calculation=1, exyz=ENERGY_INTERVAL)
+
+
+def test_session_reuses_worker(srim_directory):
+    with TrimSession(srim_directory) as session:
+        for energy in (5.4e6, 8e6):
+            sim_result = simulate("He", 4, energy, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                                  srim_directory=srim_directory, session=session)
+            assert_complete(sim_result)
+        assert [worker.jobs for worker in session.workers] == [2]
+        # With a timeout TRIM runs supervised in srim_directory, not on the session
+        sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                              srim_directory=srim_directory, session=session, timeout=60)
+        assert_complete(sim_result)
+        assert sim_result.partial is None
+        assert [worker.jobs for worker in session.workers] == [2]
+
+
+def test_workers_borrowed_one_job_at_a_time(srim_directory, sandbox_directory):
+    session = TrimSession(srim_directory, num_workers=2, parent_directory=str(sandbox_directory))
+    borrowed, lock = [], threading.Lock()
+
+    def run_job():
+        with session.worker() as worker:
+            with lock:
+                assert worker not in borrowed
+                borrowed.append(worker)
+            outputs = worker.run(new_trim())
+            with lock:
+                borrowed.remove(worker)
+        assert outputs.ioniz.num_ions == NUM_EVENTS
+
+    threads = [threading.Thread(target=run_job) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(session.workers) == 2 and sum(worker.jobs for worker in session.workers) == 5
+    directories = [worker.directory for worker in session.workers]
+    assert all(os.path.isdir(directory) for directory in directories)
+    session.close()
+    assert session.workers == [] and not any(os.path.exists(directory) for directory in directories)
+
+
+def test_worker_recovers_from_a_failed_job(srim_directory, sandbox_directory, monkeypatch):
+    # The worker shell passes its environment on to every TRIM it starts
+    monkeypatch.setenv("STAND_IN_EXIT_CODE", "3")
+    with TrimSession(srim_directory, parent_directory=str(sandbox_directory)) as session:
+        with session.worker() as worker:
+            with pytest.raises(subprocess.CalledProcessError) as failure:
+                worker.run(new_trim())
+            assert failure.value.returncode == 3
+    monkeypatch.setenv("STAND_IN_HANG_AFTER_IONS", "1")
+    monkeypatch.delenv("STAND_IN_EXIT_CODE")
+    with TrimSession(srim_directory, parent_directory=str(sandbox_directory)) as session:
+        with session.worker() as worker:
+            shell = worker.shell
+            with pytest.raises(TimeoutError):
+                worker.run(new_trim(), timeout=1)
+            # A new shell, the hung TRIM went with the old one
+            assert worker.shell is not shell and not shell.isalive()
+            assert worker.execute("true") == 0 and worker.jobs == 0
+
+
+@pytest.mark.parametrize("timeout", [None, 60])
+def test_parallel_simulate_all_with_session(srim_directory, sandbox_directory, timeout):
+    simulation_dataset = simulate_all(
+        ["He-4", "Li-7", "He-4"], [5.4e6, 14e6, 8e6], NUM_EVENTS, ENERGY_INTERVAL, jobs=2, use_cache=False,
+        srim_directory=srim_directory, session=True, timeout=timeout
+    )
+    assert len(simulation_dataset) == 3
+    for sim_result in simulation_dataset.values():
+        assert_complete(sim_result)
+        assert sim_result.partial is None
+    assert os.listdir(sandbox_directory) == []
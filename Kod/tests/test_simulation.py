@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pytest
+from exyz import read_exyz
+from transfer import LocalDirectoryBackend, TransferQueue
+
+pytest.importorskip("srim")
+import simulation  # noqa: E402
+from simulation import load_sim_result, simulate, simulate_all  # noqa: E402
+
+NUM_EVENTS = 10
+ENERGY_INTERVAL = 1e4
+
+
+def assert_complete(sim_result, num_events=NUM_EVENTS):
+    exyz_data = read_exyz(sim_result.exyz_file_path)
+    assert exyz_data.num_ions == num_events
+    np.testing.assert_array_equal(np.unique(exyz_data.ion_number), np.arange(1, num_events + 1))
+    assert sim_result.results[0].ioniz.num_ions == num_events
+
+
+def test_parallel_simulate_all_in_sandboxes(srim_directory, sandbox_directory):
+    isotopes, energies = ["He-4", "Li-7", "He-4"], [5.4e6, 14e6, 8e6]
+    simulation_dataset = simulate_all(
+        isotopes, energies, NUM_EVENTS, ENERGY_INTERVAL, jobs=2, use_cache=False, srim_directory=srim_directory
+    )
+    assert sorted(simulation_dataset) == ["He4-5.4MeV", "He4-8.0MeV", "Li7-14.0MeV"]
+    for sim_result in simulation_dataset.values():
+        assert_complete(sim_result)
+        assert load_sim_result(sim_result.result_path).num_events == NUM_EVENTS
+    # TRIM ran in sandboxes, which are gone, never in the SRIM directory itself
+    assert os.listdir(sandbox_directory) == []
+    assert not os.path.exists(os.path.join(srim_directory, "TRIM.IN"))
+    assert os.listdir(os.path.join(srim_directory, "SRIM Outputs")) == []
+
+    cached = simulate_all(isotopes, energies, NUM_EVENTS, ENERGY_INTERVAL, jobs=2, srim_directory=srim_directory)
+    assert {id: sim_result.result_path for id, sim_result in cached.items()} == {
+        id: sim_result.result_path for id, sim_result in simulation_dataset.items()
+    }
+
+
+@pytest.fixture
+def remote_directory(workdir, monkeypatch):
+    """Where remote_transfer_queue sends the files to, instead of scp"""
+    directory = workdir / "remote"
+    queue = TransferQueue(LocalDirectoryBackend(str(directory)), batch_delay=0.1)
+    monkeypatch.setattr(simulation, "remote_transfer_queue", lambda: queue)
+    yield directory
+    queue.close()
+
+
+def test_result_cache(workdir, monkeypatch):
+    monkeypatch.setattr(simulation, "cache_stats", {"hits": 0, "misses": 0})
+    sim_result = simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate")
+    assert simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate").result_path == sim_result.result_path
+    assert simulation.cache_stats == {"hits": 1, "misses": 1}
+    # Another target is another result
+    other = simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate", density=0.002)
+    assert other.result_path != sim_result.result_path
+    assert other.parameters["density"] == 0.002
+    simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate", use_cache=False)
+    assert simulation.cache_stats == {"hits": 1, "misses": 2}
+    with pytest.raises(TypeError, match="Unknown simulation parameters"):
+        simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate", densty=0.002)
+
+
+def test_scp_to_remote(remote_directory):
+    sim_result = simulate("He", 4, 5.4e6, 2, 1e5, backend="surrogate", use_cache=False, scp_to_remote=True)
+    simulation_dataset = simulate_all(["Li-7"], [14e6], 2, 1e5, backend="surrogate", scp_to_remote=True)
+    simulation.remote_transfer_queue().close()
+    assert sorted(os.listdir(remote_directory)) == sorted(
+        [sim_result.exyz_file_name, simulation_dataset["Li7-14.0MeV"].exyz_file_name]
+    )
+
+
+def test_shards_renumber_ions(srim_directory):
+    sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                          srim_directory=srim_directory, shards=3)
+    assert_complete(sim_result)
+    ion_number = sim_result.results[0].exyz.ion_number
+    # Ions of a shard follow those of the one before, the EXYZ file has every ion in one block
+    assert np.all(np.diff(ion_number) >= 0)
+    assert not [name for name in os.listdir(os.path.join(srim_directory, "SRIM Outputs")) if name.startswith(".")]
+
+
+def test_run_stops_once_converged(workdir):
+    sim_result = simulate("He", 4, 5.4e6, 500, 1e5, backend="surrogate", precision=0.05, batch_size=10)
+    convergence = sim_result.convergence
+    assert convergence["converged"] and convergence["achieved"] <= 0.05
+    assert 10 <= convergence["num_events"] < 500
+    assert sim_result.num_events == convergence["num_events"]
+    assert read_exyz(sim_result.exyz_file_path).num_ions == convergence["num_events"]
+    assert sim_result.parameters["precision"] == 0.05
+    assert load_sim_result(sim_result.result_path).convergence == convergence
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pytest
+from .test_simulation import ENERGY_INTERVAL, NUM_EVENTS
+
+pytest.importorskip("srim")
+from srim.output import Ioniz  # noqa: E402
+from srim_outputs import TABLE_FILES, SrimOutputs, exyz_moved, load_outputs, parse_table, read_ioniz  # noqa: E402
+from simulation import load_sim_result, simulate  # noqa: E402
+
+TABLE = b""" Total Ions calculated =10.00
+=====================
+  TARGET     IONIZ.      IONIZ.
+ DEPTH       by IONS     by RECOILS
+-----------  ----------  ----------
+100,0E+00  1,5E-01  2,0E-03
+200,0E+00  1,6E-01  2,1E-03
+"""
+
+
+def test_parse_table():
+    np.testing.assert_array_equal(parse_table(TABLE), [[100, 0.15, 2e-3], [200, 0.16, 2.1e-3]])
+    assert parse_table(TABLE, max_rows=1).shape == (1, 3)
+    with pytest.raises(ValueError, match="different lengths"):
+        parse_table(TABLE + b"300,0E+00  1,7E-01\n")
+    with pytest.raises(ValueError, match="No table"):
+        parse_table(b" Total Ions calculated =10.00\n")
+    with pytest.raises(ValueError, match="empty"):
+        parse_table(TABLE[:TABLE.index(b"100,0E")])
+
+
+def test_ioniz_with_decimal_commas(data_file):
+    # Written by SRIM under a locale with decimal commas, which pysrim cannot read
+    file_path = data_file("IONIZ1.txt")
+    with pytest.raises(ValueError):
+        Ioniz("DataFiles", "IONIZ1.txt")
+    ioniz = read_ioniz(file_path)
+    with open(file_path) as file:
+        expected = np.loadtxt([line.replace(",", ".") for line in file.read().splitlines()[-100:]])
+    assert ioniz.num_ions == 1
+    np.testing.assert_array_equal(ioniz.depth, expected[:, 0])
+    np.testing.assert_array_equal(ioniz.ions, expected[:, 1])
+    np.testing.assert_array_equal(ioniz.recoils, expected[:, 2])
+
+
+def test_outputs_parsed_on_first_access(srim_directory):
+    simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False, srim_directory=srim_directory)
+    # The last run's tables are still in srim_directory, its EXYZ file was moved
+    exyz_path = os.path.join("DataFiles", "EXYZ.txt")
+    with open(exyz_path, "w") as file:
+        file.write("")
+    outputs = SrimOutputs(srim_directory, outputs=("ioniz", "range"))
+    assert sorted(outputs.paths) == sorted(TABLE_FILES)
+    assert "ioniz" not in vars(outputs) and outputs.exyz is None
+    assert outputs.ioniz.num_ions == NUM_EVENTS and outputs.range.elements.shape[0] == 100
+    assert "ioniz" in vars(outputs)
+    assert "range" not in vars(load_outputs(srim_directory))
+    assert exyz_moved(outputs, exyz_path) == exyz_path and outputs.exyz_path == os.path.abspath(exyz_path)
+    with pytest.raises(ValueError, match="Unknown SRIM outputs"):
+        SrimOutputs(srim_directory, outputs=("ioniz", "phonons"))
+
+
+def test_paths_saved_with_the_result(srim_directory):
+    sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                          srim_directory=srim_directory)
+    paths = sim_result.results[0].paths
+    assert paths["ioniz"] == os.path.join(os.path.abspath(srim_directory), "IONIZ.txt")
+    loaded = load_sim_result(sim_result.result_path)
+    assert loaded.results[0].paths == paths
+    # Results without table files, e.g. of the surrogate, have none
+    sim_result = simulate("He", 4, 8e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False, backend="surrogate")
+    assert load_sim_result(sim_result.result_path).results[0].paths == {}
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from store import ExyzStore
+
+EXYZ_FILE = "EXYZ_He4-5.4MeV_2023-04-03_1017.txt"
+
+
+def copies(data_file, time_stamps):
+    """Identical copies of one EXYZ file, whose names give different time stamps"""
+    with open(data_file(EXYZ_FILE), "rb") as file:
+        contents = file.read()
+    os.remove(os.path.join("DataFiles", EXYZ_FILE))
+    file_paths = [os.path.join("DataFiles", f"EXYZ_He4-5.4MeV_{time_stamp}.txt") for time_stamp in time_stamps]
+    for file_path in file_paths:
+        with open(file_path, "wb") as file:
+            file.write(contents)
+    return file_paths
+
+
+def test_ingest_directory_dedupes(data_file):
+    file_paths = copies(data_file, ["2023-04-03_1017", "2023-04-03_1018"])
+    with open(file_paths[0], "rb") as file:
+        contents = file.read()
+    with open(os.path.join("DataFiles", "EXYZ_notes.txt"), "w") as file:
+        file.write("not an EXYZ file\n")
+
+    store = ExyzStore()
+    ingested = store.ingest_directory()
+    assert sorted(ingested) == sorted(os.path.basename(file_path) for file_path in file_paths)
+    assert len({entry["hash"] for entry in store.aliases.values()}) == 1
+    object_path = store.path(ingested[os.path.basename(file_paths[0])])
+    for file_path in file_paths:
+        # The duplicates are links to the single stored copy, with unchanged contents
+        assert os.path.samefile(file_path, object_path)
+        with open(file_path, "rb") as file:
+            assert file.read() == contents
+    assert store.summary().startswith("2 aliases, 1 unique files")
+    # Ingesting again finds the same aliases
+    assert store.ingest_directory() == ingested
+    assert len(store.aliases) == 2
+
+
+def test_concurrent_ingests_keep_every_alias(data_file):
+    file_paths = copies(data_file, [f"2023-04-03_{minute:04d}" for minute in range(1000, 1016)])
+
+    def ingest(file_path):
+        return ExyzStore().ingest(file_path)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        aliases = list(executor.map(ingest, file_paths))
+    assert len(set(aliases)) == len(file_paths)
+    assert sorted(ExyzStore().aliases) == sorted(aliases)
+    assert ExyzStore().find(isotope="He4", energy=5.4e6) == sorted(aliases)
+
+
+def test_same_alias_for_other_contents(data_file):
+    file_path = copies(data_file, ["2023-04-03_1017"])[0]
+    store = ExyzStore()
+    alias = store.ingest(file_path)
+    # A new file, the first one is linked into the store
+    with open(file_path, "rb") as file:
+        contents = file.read()
+    os.remove(file_path)
+    with open(file_path, "wb") as file:
+        file.write(contents + b"\n")
+    other_alias = store.ingest(file_path)
+    assert other_alias.startswith(f"{alias}_")
+    assert store.path(alias) != store.path(other_alias)
+
+
+def test_aliases_json_migrated(data_file):
+    file_path = copies(data_file, ["2023-04-03_1017"])[0]
+    entry = ExyzStore.describe(file_path)
+    os.makedirs(os.path.join("DataFiles", "Store"))
+    with open(os.path.join("DataFiles", "Store", "aliases.json"), "w") as file:
+        json.dump({"old_alias": entry}, file)
+    store = ExyzStore()
+    assert store.aliases == {"old_alias": entry}
+    assert not os.path.exists(os.path.join("DataFiles", "Store", "aliases.json"))
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pytest
+from exyz import read_exyz
+from surrogate import SurrogateTarget, ionization_profile, simulate_tracks, spread_histogram, validate, write_exyz
+
+HE4_FILE = "EXYZ_He4-15.0MeV_2023-05-04_1738.txt"
+SR80_FILE = "EXYZ_Sr80-1200.0MeV_2023-05-04_1449.txt"
+
+
+def test_tracks_in_exyz_format(workdir):
+    energy, energy_interval, num_ions = 5.4e6, 1e5, 20
+    target = SurrogateTarget.from_formula()
+    rows = simulate_tracks(2, 4, energy, num_ions, energy_interval, target, np.random.default_rng(0))
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    write_exyz(file_path, "He", 4, energy, energy_interval, rows)
+    exyz_data = read_exyz(file_path)
+    header = exyz_data.header
+    assert (header.element, header.mass, header.energy, header.energy_interval) == ("He", 4, energy, energy_interval)
+    assert exyz_data.num_ions == num_ions
+    for start, end in zip(exyz_data.ion_offsets[:-1], exyz_data.ion_offsets[1:]):
+        energy_kev = exyz_data.energy[start:end] * 1e3
+        # Every ion starts at full energy, loses about energy_interval per row and stops at 0
+        assert energy_kev[0] == energy / 1e3 and energy_kev[-1] == 0
+        assert np.all(np.diff(energy_kev) <= 0) and np.all(np.diff(exyz_data.depth[start:end]) >= 0)
+        assert abs(end - start - 1 - energy / energy_interval) <= 3
+
+
+def test_ionization_profile_keeps_the_energy():
+    rows = simulate_tracks(2, 4, 5.4e6, 50, 1e4, SurrogateTarget.from_formula(), np.random.default_rng(1))
+    depth, ions, recoils = ionization_profile(rows, 50)
+    deposited = (ions + recoils).sum() * (depth[1] - depth[0])
+    np.testing.assert_allclose(deposited, 5.4e6, rtol=1e-6)
+    histogram = spread_histogram(np.array([0.0, 1.0]), np.array([2.0, 1.0]), np.array([4.0, 1.0]), np.arange(4.0))
+    np.testing.assert_allclose(histogram, [2, 3, 0])
+
+
+@pytest.mark.parametrize("file_name, bragg_curve", [(HE4_FILE, 0.1), (SR80_FILE, 0.35)])
+def test_agrees_with_srim(data_file, file_name, bragg_curve):
+    # 100 and 50 SRIM ions, the surrogate's straggling is tuned on those with 50 and more
+    report = validate([data_file(file_name)], num_ions=300)[file_name]
+    assert abs(report["range"]) < 0.05
+    assert abs(report["straggling"]) < 0.2
+    assert report["bragg_curve"] < bragg_curve
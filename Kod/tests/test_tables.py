@@ -0,0 +1,91 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import tables
+from exyz import read_exyz
+from surrogate import SurrogateTarget, ionization_profile, simulate_tracks
+from tables import RangeTable, get_table, ioniz_runs
+
+
+@pytest.fixture(autouse=True)
+def no_tables_in_memory(monkeypatch):
+    monkeypatch.setattr(tables, "_tables", {})
+
+
+def test_lookups_are_consistent():
+    table = RangeTable.from_model("Ca", 40)
+    energy = np.array([1.0, 100.0, 700.0])
+    ranges = table.csda_range(energy)
+    assert np.all(np.diff(ranges) > 0) and table.csda_range(0.0) == 0
+    np.testing.assert_allclose(table.energy_at_range(ranges), energy, rtol=1e-4)
+    # A thin slice loses stopping power times its thickness
+    energy_loss = 700 - table.residual_energy(700.0, 1e-3)
+    np.testing.assert_allclose(energy_loss, table.stopping_power(700.0) * 1e-3, rtol=1e-3)
+    curves = table.bragg_curve(np.array([[600.0], [800.0]]), np.linspace(0, 30, 50))
+    assert curves.shape == (2, 50)
+    assert curves[0, -1] == 0 and curves[1, 0] < curves[1, 1] < curves[1].max()
+
+
+def test_tables_saved_and_reloaded(workdir, monkeypatch):
+    table = get_table("He", 4)
+    assert get_table("He", 4) is table
+    assert len(os.listdir(os.path.join("DataFiles", "Tables"))) == 1
+    monkeypatch.setattr(tables, "_tables", {})
+    reloaded = get_table("He", 4)
+    assert reloaded is not table
+    np.testing.assert_array_equal(reloaded.ranges, table.ranges)
+    with pytest.raises(ValueError, match="Unknown table source"):
+        get_table("He", 4, source="geant4")
+
+
+def test_exyz_table(data_file):
+    with pytest.raises(ValueError, match="No EXYZ files"):
+        get_table("He", 4, source="exyz")
+    file_path = data_file("EXYZ_He4-15.0MeV_2023-05-04_1738.txt")
+    table = get_table("He", 4, source="exyz")
+    exyz_data = read_exyz(file_path)
+    moving = exyz_data.energy > 1
+    np.testing.assert_allclose(
+        np.median(table.stopping_power(exyz_data.energy[moving]) / exyz_data.stopping[moving]), 1, rtol=0.02
+    )
+
+
+def save_ioniz_result(energy, num_ions=100, density=0.001764, seed=0):
+    """A saved result with the IONIZ profile of a surrogate run, as a TRIM run would have"""
+    pytest.importorskip("srim")
+    from simulation import SimulationResult, save_sim_result, simulation_parameters
+
+    target = SurrogateTarget.from_formula("CF4", density)
+    rows = simulate_tracks(2, 4, energy, num_ions, 1e4, target, np.random.default_rng(seed))
+    depth, ions, recoils = ionization_profile(rows, num_ions)
+    sim_result = SimulationResult("He4", energy, num_ions)
+    sim_result.parameters = simulation_parameters("He", 4, energy, num_ions, 1e4, density=density)
+    sim_result.add_result(SimpleNamespace(ioniz=SimpleNamespace(depth=depth, ions=ions, recoils=recoils)))
+    return save_sim_result(sim_result)
+
+
+def test_ioniz_table(workdir):
+    with pytest.raises(ValueError, match="No saved results"):
+        get_table("He", 4, source="ioniz")
+    for energy in (5.4e6, 15e6):
+        save_ioniz_result(energy)
+    # In another target, left out
+    save_ioniz_result(15e6, density=0.002)
+    runs, file_paths = ioniz_runs("He", 4)
+    assert sorted(energy for energy, _ in runs) == [5.4e6, 15e6] and len(file_paths) == 6
+
+    table = get_table("He", 4, source="ioniz")
+    assert table.source == "ioniz"
+    # The surrogate deposits the energy of its own stopping model, which the table recovers
+    # away from the smeared Bragg peak
+    model = RangeTable.from_model("He", 4)
+    energy = np.linspace(3, 12, 10)
+    np.testing.assert_allclose(table.stopping_power(energy), model.stopping_power(energy), rtol=0.1)
+
+    # A new run builds a new table
+    save_ioniz_result(8e6)
+    tables._tables.clear()
+    assert len(ioniz_runs("He", 4)[0]) == 3
+    get_table("He", 4, source="ioniz")
+    assert len(os.listdir(os.path.join("DataFiles", "Tables"))) == 2
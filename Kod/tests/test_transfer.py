@@ -0,0 +1,101 @@
+import gzip
+import os
+import pytest
+from archive import ExyzArchive
+from transfer import LocalDirectoryBackend, TransferQueue
+
+EXYZ_FILE = "EXYZ_He4-5.4MeV.txt"
+
+
+class FailingBackend:
+    """Raises `error` on the first `failures` sends, then copies like LocalDirectoryBackend"""
+
+    def __init__(self, directory, error, failures=None):
+        self.local = LocalDirectoryBackend(directory)
+        self.error = error
+        self.failures = failures
+        self.attempts = 0
+
+    def send(self, file_paths):
+        self.attempts += 1
+        if self.failures is None or self.attempts <= self.failures:
+            raise self.error
+        self.local.send(file_paths)
+
+
+def test_local_directory_backend(data_file):
+    file_paths = [data_file(EXYZ_FILE), data_file("EXYZ_Ca40_800MeV.txt")]
+    with TransferQueue(LocalDirectoryBackend("Remote"), batch_size=2, batch_delay=0.1) as transfer:
+        for file_path in file_paths:
+            transfer.put(file_path)
+    assert transfer.sent == file_paths and transfer.failed == []
+    assert sorted(os.listdir("Remote")) == sorted(os.path.basename(file_path) for file_path in file_paths)
+
+
+def test_exyza_compression(data_file):
+    exyz_path = data_file(EXYZ_FILE)
+    other_path = os.path.join("DataFiles", "notes.txt")
+    with open(other_path, "w") as file:
+        file.write("no EXYZ header\n")
+    with TransferQueue(LocalDirectoryBackend("Remote"), compression="exyza", batch_delay=0.1) as transfer:
+        transfer.put(exyz_path)
+        transfer.put(other_path)
+    assert transfer.sent == [exyz_path, other_path]
+    # An EXYZ file as an archive, anything else falls back to gzip
+    assert sorted(os.listdir("Remote")) == ["EXYZ_He4-5.4MeV.exyza", "notes.txt.gz"]
+    with gzip.open(os.path.join("Remote", "notes.txt.gz"), "rt") as file:
+        assert file.read() == "no EXYZ header\n"
+    ExyzArchive(os.path.join("Remote", "EXYZ_He4-5.4MeV.exyza")).write_text("restored.txt")
+    with open(exyz_path, "rb") as original, open("restored.txt", "rb") as restored:
+        assert original.read() == restored.read()
+
+
+def test_retried_after_os_error(data_file):
+    exyz_path = data_file(EXYZ_FILE)
+    backend = FailingBackend("Remote", OSError("connection reset"), failures=2)
+    with TransferQueue(backend, batch_delay=0.1, max_retries=3, retry_delay=0) as transfer:
+        transfer.put(exyz_path)
+    assert backend.attempts == 3
+    assert transfer.sent == [exyz_path] and transfer.failed == []
+
+
+def test_failed_after_max_retries(data_file):
+    exyz_path = data_file(EXYZ_FILE)
+    backend = FailingBackend("Remote", OSError("connection reset"))
+    with TransferQueue(backend, batch_delay=0.1, max_retries=2, retry_delay=0) as transfer:
+        transfer.put(exyz_path)
+    assert backend.attempts == 3
+    assert transfer.sent == [] and transfer.failed == [exyz_path]
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_other_errors_not_retried_and_worker_survives(data_file, compression):
+    exyz_path = data_file(EXYZ_FILE)
+    backend = FailingBackend("Remote", RuntimeError("bug in the backend"), failures=1)
+    with TransferQueue(backend, compression=compression, batch_size=1, batch_delay=0.1, retry_delay=0) as transfer:
+        transfer.put(exyz_path)
+        transfer.put(data_file("EXYZ_Ca40_800MeV.txt"))
+    assert backend.attempts == 2
+    assert transfer.failed == [exyz_path]
+    assert transfer.sent == [os.path.join("DataFiles", "EXYZ_Ca40_800MeV.txt")]
+
+
+def test_failed_compression(data_file, monkeypatch):
+    import transfer as transfer_module
+
+    def compress_broken(file_path, directory):
+        raise ValueError("broken compressor")
+
+    monkeypatch.setitem(transfer_module.COMPRESSORS, "gzip", compress_broken)
+    exyz_path = data_file(EXYZ_FILE)
+    backend = LocalDirectoryBackend("Remote")
+    with TransferQueue(backend, compression="gzip", batch_size=1, batch_delay=0.1) as transfer:
+        transfer.put(exyz_path)
+        transfer.put(exyz_path)
+    assert transfer.sent == [] and transfer.failed == [exyz_path, exyz_path]
+    assert not os.path.exists("Remote")
+
+
+def test_unknown_compression():
+    with pytest.raises(ValueError, match="Unknown compression"):
+        TransferQueue(LocalDirectoryBackend("Remote"), compression="zip")
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import pytest
+from exyz import parse_exyz_header, read_exyz, to_exyz_data
+from surrogate import SurrogateTarget, exyz_header, simulate_tracks
+from tuning import NUM_BINS, coarsen, find_tuning, record_tuning, reference_interval, tune
+
+ENERGY = 5.4e6
+
+
+@pytest.fixture(scope="module")
+def pilot():
+    """A surrogate pilot of 20 He4 ions at the reference interval"""
+    energy_interval = reference_interval(ENERGY)
+    header = parse_exyz_header(exyz_header("He", 4, ENERGY / 1e3, energy_interval).encode())
+    target = SurrogateTarget.from_formula()
+    return to_exyz_data(header, simulate_tracks(2, 4, ENERGY, 20, energy_interval, target, np.random.default_rng(0)))
+
+
+def test_coarsen(data_file):
+    exyz_data = read_exyz(data_file("EXYZ_He4-5.4MeV.txt"))
+    coarse = coarsen(exyz_data, 3)
+    assert coarse.header.energy_interval == 3 * exyz_data.header.energy_interval
+    assert coarse.num_ions == exyz_data.num_ions
+    for position in range(exyz_data.num_ions):
+        start, end = exyz_data.ion_offsets[position:position + 2]
+        coarse_start, coarse_end = coarse.ion_offsets[position:position + 2]
+        # Every third row of the ion, from its first
+        np.testing.assert_array_equal(coarse.depth[coarse_start:coarse_end], exyz_data.depth[start:end:3])
+
+
+def test_coarsest_interval_within_tolerance(pilot):
+    tunings = [tune(pilot, tolerance) for tolerance in (0.0, 0.05, 0.2)]
+    assert tunings[0]["energy_interval"] == reference_interval(ENERGY)
+    intervals = [tuning["energy_interval"] for tuning in tunings]
+    assert intervals == sorted(intervals) and intervals[2] > intervals[0]
+    for tuning in tunings:
+        assert tuning["num_bins"] == NUM_BINS and tuning["pilot_events"] == 20
+        candidates = tuning["candidates"]
+        assert candidates[0]["dedx_deviation"] == candidates[0]["cluster_deviation"] == 0
+        # Every candidate up to the chosen one is within tolerance, the next one is not
+        for candidate in candidates:
+            within = max(candidate["dedx_deviation"], candidate["cluster_deviation"]) <= tuning["tolerance"]
+            assert within == (candidate["energy_interval"] <= tuning["energy_interval"])
+
+
+def test_tunings_recorded(workdir, pilot):
+    path = os.path.join("DataFiles", "tunings.jsonl")
+    parameters = {"element": "He", "mass": 4, "energy": ENERGY}
+    assert find_tuning(parameters, 0.05, path) is None
+    tuning = tune(pilot, 0.05)
+    record_tuning(parameters, tuning, path)
+    record_tuning(parameters, tune(pilot, 0.05, num_bins=100), path)
+    assert find_tuning(parameters, 0.05, path) == tuning
+    assert find_tuning(parameters, 0.1, path) is None
+    assert find_tuning(dict(parameters, energy=15e6), 0.05, path) is None
+    assert find_tuning(parameters, 0.05, path, num_bins=100)["num_bins"] == 100
@@ -0,0 +1,102 @@
+import os
+import numpy as np
+import pytest
+from exyz import read_exyz
+from .test_simulation import ENERGY_INTERVAL, NUM_EVENTS, assert_complete
+
+pytest.importorskip("srim")
+from simulation import load_sim_result, simulate, simulate_all  # noqa: E402
+from watchdog import salvage_exyz  # noqa: E402
+
+EXYZ_FILE = "EXYZ_He4-15.0MeV_2023-05-04_1738.txt"
+
+
+@pytest.fixture
+def contents(data_file):
+    with open(data_file(EXYZ_FILE), "rb") as file:
+        return file.read()
+
+
+def write(contents):
+    file_path = os.path.join("DataFiles", "EXYZ.txt")
+    with open(file_path, "wb") as file:
+        file.write(contents)
+    return file_path
+
+
+def test_salvage_drops_an_ion_cut_off(contents):
+    # Cut in the middle of a row of ion 4
+    cut = contents.find(b"\n0000004 ") + 1
+    file_path = write(contents[:contents.find(b"\n", cut + 2000) + 30])
+    rows = salvage_exyz(file_path, 100)
+    np.testing.assert_array_equal(np.unique(rows[:, 0]), [1, 2, 3])
+    assert os.path.getsize(file_path) == cut
+    assert read_exyz(file_path).num_ions == 3
+
+
+def test_salvage_keeps_finished_ions(contents):
+    # Every ion ends at energy 0
+    file_path = write(contents)
+    assert len(np.unique(salvage_exyz(file_path)[:, 0])) == 100
+    assert os.path.getsize(file_path) == len(contents)
+    # Without its last row, the last ion still counts once the run has all its ions
+    end = contents.rstrip(b"\n").rfind(b"\n") + 1
+    file_path = write(contents[:end])
+    assert len(np.unique(salvage_exyz(file_path, 100)[:, 0])) == 100
+    assert len(np.unique(salvage_exyz(file_path, 1000)[:, 0])) == 99
+
+
+def test_salvage_without_ions(contents):
+    data_start = contents.find(b"\n0000001 ") + 1
+    file_path = write(contents[:data_start])
+    assert len(salvage_exyz(file_path)) == 0
+    assert os.path.getsize(file_path) == data_start
+    file_path = write(contents[:data_start // 2])
+    assert salvage_exyz(file_path) is None
+
+
+def test_stall_salvages_complete_ions(srim_directory, monkeypatch):
+    monkeypatch.setenv("STAND_IN_HANG_AFTER_IONS", "3")
+    sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                          srim_directory=srim_directory, stall_timeout=2)
+    assert sim_result.partial["reason"] == "no progress for 2 s"
+    assert sim_result.partial["num_events"] == sim_result.num_events == 3
+    assert sim_result.partial["requested"] == NUM_EVENTS
+    assert_complete(sim_result, 3)
+    assert load_sim_result(sim_result.result_path).partial == sim_result.partial
+
+
+def test_timeout_salvages_complete_ions(srim_directory, monkeypatch):
+    monkeypatch.setenv("STAND_IN_ION_SECONDS", "0.3")
+    sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                          srim_directory=srim_directory, timeout=1.5)
+    assert sim_result.partial["reason"] == "timeout after 1.5 s"
+    assert 0 < sim_result.num_events < NUM_EVENTS
+    assert_complete(sim_result, sim_result.num_events)
+
+
+def test_exit_code_after_all_ions_keeps_them(srim_directory, monkeypatch):
+    monkeypatch.setenv("STAND_IN_EXIT_CODE", "1")
+    sim_result = simulate("He", 4, 5.4e6, NUM_EVENTS, ENERGY_INTERVAL, use_cache=False,
+                          srim_directory=srim_directory, timeout=60)
+    assert sim_result.partial["reason"] == "TRIM exited with code 1"
+    assert sim_result.num_events == NUM_EVENTS
+    assert_complete(sim_result)
+
+
+def test_campaign_goes_on_without_ions(srim_directory, monkeypatch):
+    monkeypatch.setenv("STAND_IN_HANG_AFTER_IONS", "0")
+    simulation_dataset = simulate_all(["He-4", "Li-7"], [5.4e6, 14e6], NUM_EVENTS, ENERGY_INTERVAL,
+                                      use_cache=False, srim_directory=srim_directory, stall_timeout=1)
+    assert sorted(simulation_dataset) == ["He4-5.4MeV", "Li7-14.0MeV"]
+    for sim_result in simulation_dataset.values():
+        assert sim_result.partial["num_events"] == sim_result.num_events == 0
+        assert read_exyz(sim_result.exyz_file_path).num_ions == 0
+        assert load_sim_result(sim_result.result_path).partial == sim_result.partial
+    # Saved flagged partial, the next campaign runs them again
+    monkeypatch.delenv("STAND_IN_HANG_AFTER_IONS")
+    simulation_dataset = simulate_all(["He-4", "Li-7"], [5.4e6, 14e6], NUM_EVENTS, ENERGY_INTERVAL,
+                                      srim_directory=srim_directory, stall_timeout=10)
+    for sim_result in simulation_dataset.values():
+        assert sim_result.partial is None
+        assert_complete(sim_result)